@@ -12,6 +12,7 @@ from c3nav.mapdata.api.mapdata import mapdata_api_router
 from c3nav.mapdata.api.updates import updates_api_router
 from c3nav.routing.api.positioning import positioning_api_router
 from c3nav.routing.api.routing import routing_api_router
+from c3nav.routing.consumers import PositioningConsumer
 
 """
 new API (v2)
@@ -34,3 +35,7 @@ urlpatterns = [
     path('v2/', ninja_api.urls),
     path('', RedirectView.as_view(pattern_name="api-v2:openapi-view")),
 ]
+
+websocket_urlpatterns = [
+    path('v2/positioning/ws', PositioningConsumer.as_asgi()),
+]
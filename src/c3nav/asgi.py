@@ -15,6 +15,10 @@ from c3nav.urls import websocket_urlpatterns  # noqa
 
 from c3nav import settings
 
+if settings.PRELOAD_ARTIFACTS:
+    from c3nav.mapdata.utils.cache.artifacts import preload_artifacts
+    preload_artifacts()
+
 
 class OriginValidatorWithAllowNone(OriginValidator):
     def valid_origin(self, parsed_origin):
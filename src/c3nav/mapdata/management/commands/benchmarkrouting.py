@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import gettext_lazy as _
+
+
+class Command(BaseCommand):
+    help = 'benchmark the router on a generated venue, everything gets rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nodes', type=int, default=10000, help=_('number of graph nodes to generate'))
+        parser.add_argument('--levels', type=int, default=4, help=_('number of levels to generate'))
+        parser.add_argument('--routes', type=int, default=200, help=_('number of random routes to get'))
+        parser.add_argument('--seed', type=int, default=1, help=_('random seed'))
+        parser.add_argument('--json', action='store_true', help=_('output results as json'))
+        parser.add_argument('--force', action='store_true',
+                            help=_('run even if the database already contains map data'))
+
+    def handle(self, *args, **options):
+        from c3nav.mapdata.models import Level
+        from c3nav.routing.benchmark import run_benchmark
+
+        if Level.objects.exists() and not options['force']:
+            raise CommandError(_('The database already contains map data, which would be part of the benchmark. '
+                                 'Use --force to run anyway.'))
+
+        results = run_benchmark(nodes=options['nodes'], levels=options['levels'],
+                                routes=options['routes'], seed=options['seed'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        venue = results['venue']
+        self.stdout.write('venue: %(levels)d levels, %(spaces)d spaces, %(nodes)d nodes, %(edges)d edges '
+                          '(generated in %(generate_seconds).1fs)' % venue)
+        self.stdout.write('rebuild: %.2fs' % results['rebuild_seconds'])
+        self.stdout.write('load: %.3fs, %.1f MB in memory' % (results['load_seconds'],
+                                                              results['router_memory_bytes'] / 1024 ** 2))
+        self.stdout.write('pickle: %.1f MB, graph arrays: %.1f MB' % (results['pickle_bytes'] / 1024 ** 2,
+                                                                      results['graph_bytes'] / 1024 ** 2))
+        for name, percentiles in (('routes between locations', results['routes']['locations']),
+                                  ('routes to coordinates', results['routes']['coordinates']),
+                                  ('serialize', results['serialize'])):
+            if not percentiles['count']:
+                self.stdout.write('%s: none' % name)
+                continue
+            self.stdout.write('%s: p50 %.2fms, p95 %.2fms, p99 %.2fms (%d)' % (
+                name, percentiles['p50_ms'], percentiles['p95_ms'], percentiles['p99_ms'], percentiles['count']
+            ))
+        self.stdout.write('unreachable: %d' % results['routes']['unreachable'])
+        self.stdout.write('peak rss: %.1f MB' % (results['peak_rss_bytes'] / 1024 ** 2))
@@ -0,0 +1,26 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+
+
+class Command(BaseCommand):
+    help = 'precompute routes from the most popular origins for the last processed map update'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--origins', type=int, default=settings.ROUTING_WARMUP_ORIGINS or 20,
+                            help=_('number of origins to precompute routes from'))
+
+    def handle(self, *args, **options):
+        from c3nav.mapdata.models import MapUpdate
+        from c3nav.routing.router import Router
+
+        logger = logging.getLogger('c3nav')
+
+        update = MapUpdate.last_processed_update(force=True)
+        router = Router.load_nocache(update)
+        origins = Router.get_popular_origins(options['origins'])
+        logger.info('Precomputing routes from %d popular origins...' % len(origins))
+        router.build_origin_trees(update, origins)
+        logger.info('Done. Workers that load the router from now on will use them.')
@@ -9,7 +9,7 @@ from c3nav.mapdata.models.report import Report
 
 if settings.METRICS:
     from prometheus_client import Gauge
-    from prometheus_client.core import CounterMetricFamily
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
     from prometheus_client.registry import Collector, CollectorRegistry
 
     REGISTRY = CollectorRegistry(auto_describe=True)
@@ -72,3 +72,26 @@ if settings.METRICS:
 
 
     REGISTRY.register(APIStatsCollector())
+
+    class ArtifactsCollector(Collector):
+        def collect(self):
+            from c3nav.mapdata.utils.cache.artifacts import artifacts
+            stats = artifacts.stats()
+            metrics = (
+                GaugeMetricFamily('c3nav_artifacts_loaded', 'Number of loaded artifacts', labels=['name']),
+                GaugeMetricFamily('c3nav_artifacts_size_bytes', 'Size of the files the loaded artifacts are from',
+                                  labels=['name']),
+                GaugeMetricFamily('c3nav_artifacts_load_seconds', 'Time it took to load the loaded artifacts',
+                                  labels=['name']),
+                CounterMetricFamily('c3nav_artifacts_loads', 'Number of artifact loads', labels=['name']),
+                CounterMetricFamily('c3nav_artifacts_hits', 'Number of artifact registry hits', labels=['name']),
+            )
+            for name, values in stats.items():
+                for metric, key in zip(metrics, ('count', 'size', 'load_seconds', 'loads', 'hits')):
+                    metric.add_metric([name], values[key])
+            return metrics
+
+        def describe(self):
+            return list()
+
+    REGISTRY.register(ArtifactsCollector())
@@ -200,6 +200,10 @@ class MapUpdate(models.Model):
 
             last_geometry_update = ([None] + [update for update in new_updates if update.geometries_changed])[-1]
 
+            # levels that the router has to rebuild, None if we don't know
+            previous_update = cls.last_processed_update(force=True)
+            changed_levels = frozenset()
+
             if last_geometry_update is not None:
                 geometry_update_cache_key = MapUpdate.build_cache_key(*last_geometry_update.to_tuple)
                 (settings.CACHE_ROOT / geometry_update_cache_key).mkdir(exist_ok=True)
@@ -214,7 +218,7 @@ class MapUpdate(models.Model):
 
                 logger.info('%.3f m² of altitude areas affected.' % changed_geometries.area)
 
-                last_processed_update = cls.last_processed_update(force=True)
+                last_processed_update = previous_update
 
                 for new_update in new_updates:
                     logger.info('Applying changed geometries from MapUpdate #%(id)s (%(type)s)...' %
@@ -222,11 +226,14 @@ class MapUpdate(models.Model):
                     new_changes = new_update.get_changed_geometries()
                     if new_changes is None:
                         logger.warning('changed_geometries pickle file not found.')
+                        changed_levels = None
                     else:
                         logger.info('%.3f m² affected by this update.' % new_changes.area)
                         changed_geometries.combine(new_changes)
 
                 logger.info('%.3f m² of geometries affected in total.' % changed_geometries.area)
+                if changed_levels is not None:
+                    changed_levels = changed_geometries.level_ids
 
                 changed_geometries.save(last_processed_update, new_updates[-1].to_tuple)
 
@@ -243,7 +250,17 @@ class MapUpdate(models.Model):
 
             logger.info('Rebuilding router...')
             from c3nav.routing.router import Router
-            router = Router.rebuild(new_updates[-1].to_tuple)
+            router = Router.rebuild(new_updates[-1].to_tuple,
+                                    previous_update=previous_update, changed_levels=changed_levels)
+
+            if settings.ROUTING_CONTRACTION_HIERARCHIES:
+                logger.info('Building contraction hierarchy...')
+                router.build_contraction_hierarchy(new_updates[-1].to_tuple)
+
+            if settings.ROUTING_WARMUP_ORIGINS:
+                logger.info('Precomputing routes from popular origins...')
+                router.build_origin_trees(new_updates[-1].to_tuple,
+                                          Router.get_popular_origins(settings.ROUTING_WARMUP_ORIGINS))
 
             logger.info('Rebuilding locator...')
             from c3nav.routing.locator import Locator
@@ -16,14 +16,10 @@ from c3nav.mapdata.models import Level, MapUpdate, Source
 from c3nav.mapdata.models.theme import Theme
 from c3nav.mapdata.render.geometry import AltitudeAreaGeometries, SingleLevelGeometries, CompositeLevelGeometries
 from c3nav.mapdata.utils.cache import AccessRestrictionAffected, MapHistory
+from c3nav.mapdata.utils.cache.artifacts import artifacts
 from c3nav.mapdata.utils.cache.package import CachePackage
 from c3nav.mapdata.utils.geometry import get_rings, unwrap_geom
 
-try:
-    from asgiref.local import Local as LocalContext
-except ImportError:
-    from threading import local as LocalContext
-
 empty_geometry_collection = GeometryCollection()
 
 
@@ -356,8 +352,6 @@ class LevelRenderData:
 
         package.save_all(update_cache_key)
 
-    cached = LocalContext()
-
     @staticmethod
     def _level_filename(update_cache_key, level_pk, theme_pk):
         if theme_pk is None:
@@ -368,24 +362,14 @@ class LevelRenderData:
 
     @classmethod
     def get(cls, level, theme):
-        # get the current render data from local variable if no new processed mapupdate exists.
+        # get the current render data from the artifact registry if no new processed mapupdate exists.
         # this is much faster than any other possible cache
         cache_key = MapUpdate.current_processed_geometry_cache_key()
         level_pk = level.pk if isinstance(level, Level) else level
         theme_pk = theme.pk if isinstance(theme, Theme) else theme
-        key = f'{level_pk}_{theme_pk}'
-        if getattr(cls.cached, 'key', None) != cache_key:
-            cls.cached.key = cache_key
-            cls.cached.data = {}
-        else:
-            result = cls.cached.data.get(key, None)
-            if result is not None:
-                return result
-
-        result = pickle.load(open(cls._level_filename(cache_key, level_pk, theme_pk), 'rb'))
-
-        cls.cached.data[key] = result
-        return result
+        filename = cls._level_filename(cache_key, level_pk, theme_pk)
+        return artifacts.get('render_data', cache_key, lambda: pickle.load(open(filename, 'rb')),
+                             key=(level_pk, theme_pk), files=(filename, ))
 
     def save(self, update_cache_key, level_pk, theme_pk):
         return pickle.dump(self, open(self._level_filename(update_cache_key, level_pk, theme_pk), 'wb'))
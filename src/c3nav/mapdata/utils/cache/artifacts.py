@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger('c3nav')
+
+
+class ArtifactEntry:
+    """
+    All loaded artifacts of one kind for one map update.
+    """
+    def __init__(self, update_key):
+        self.update_key = update_key
+        self.values = {}
+        self.sizes = {}
+        self.load_seconds = {}
+
+
+class ArtifactRegistry:
+    """
+    Process-wide registry for the large read-only objects that are loaded from the cache directory of a map update,
+    like the router, the locator or render data. Unlike LocalContext based caches, each artifact is only loaded once
+    per process and then shared by all threads and async tasks. Artifacts must never be modified.
+
+    When a new map update has been processed, the first request for an artifact loads it for the new update and then
+    atomically replaces all artifacts of the same kind, requests that still hold the old ones can finish using them.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self.hits = {}
+        self.loads = {}
+
+    def _get_lock(self, name):
+        lock = self._locks.get(name)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._locks.setdefault(name, threading.Lock())
+        return lock
+
+    def get(self, name, update_key, loader, key=None, files=()):
+        """
+        Get an artifact, loading it if needed.
+        :param name: kind of artifact, like 'router'
+        :param update_key: map update the artifact belongs to, artifacts of other updates get replaced
+        :param loader: function that loads the artifact
+        :param key: key to distinguish multiple artifacts of the same kind, like a level pk
+        :param files: files or directories the artifact is loaded from, their size is reported in the metrics
+        """
+        entry = self._entries.get(name)
+        if entry is not None and entry.update_key == update_key:
+            try:
+                result = entry.values[key]
+            except KeyError:
+                pass
+            else:
+                self.hits[name] = self.hits.get(name, 0) + 1
+                return result
+
+        # only one thread loads an artifact, all others wait for it
+        with self._get_lock(name):
+            entry = self._entries.get(name)
+            if entry is None or entry.update_key != update_key:
+                entry = ArtifactEntry(update_key)
+            else:
+                try:
+                    result = entry.values[key]
+                except KeyError:
+                    pass
+                else:
+                    self.hits[name] = self.hits.get(name, 0) + 1
+                    return result
+
+            start = time.perf_counter()
+            result = loader()
+            entry.load_seconds[key] = time.perf_counter() - start
+            entry.sizes[key] = sum(self._get_size(Path(filename)) for filename in files)
+            entry.values[key] = result
+            self._entries[name] = entry
+            self.loads[name] = self.loads.get(name, 0) + 1
+            logger.debug('Loaded %s %r for update %s in %.3fs' % (name, key, update_key, entry.load_seconds[key]))
+            return result
+
+    @classmethod
+    def _get_size(cls, path):
+        if path.is_dir():
+            return sum(cls._get_size(child) for child in path.iterdir())
+        try:
+            return os.stat(path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def clear(self):
+        self._entries = {}
+
+    def stats(self):
+        """
+        :return: dict of artifact name → dict with the update key, the number of loaded artifacts, their size on disk
+                 and load time in seconds and the number of loads and hits since the process started
+        """
+        return {
+            name: {
+                'update_key': entry.update_key,
+                'count': len(entry.values),
+                'size': sum(entry.sizes.values()),
+                'load_seconds': sum(entry.load_seconds.values()),
+                'loads': self.loads.get(name, 0),
+                'hits': self.hits.get(name, 0),
+            }
+            for name, entry in tuple(self._entries.items())
+        }
+
+
+artifacts = ArtifactRegistry()
+
+
+def preload_artifacts():
+    """
+    Load the artifacts that almost every request needs, so the first requests of a new worker don't have to.
+    """
+    from c3nav.mapdata.utils.cache.package import CachePackage
+    from c3nav.routing.locator import Locator
+    from c3nav.routing.router import Router
+    for loader in (Router.load, Locator.load, CachePackage.open_cached):
+        try:
+            loader()
+        except FileNotFoundError:
+            logger.warning('Could not preload artifacts, map update not processed yet?')
+            break
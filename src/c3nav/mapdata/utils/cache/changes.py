@@ -37,6 +37,10 @@ class GeometryChangeTracker:
     def is_empty(self):
         return not self._geometries_by_level
 
+    @property
+    def level_ids(self):
+        return frozenset(self._geometries_by_level.keys()) | self._deleted_levels
+
     @property
     def area(self):
         return sum((self._get_unary_union(level_id).area
@@ -3,10 +3,7 @@ import struct
 
 import numpy as np
 
-try:
-    from asgiref.local import Local as LocalContext
-except ImportError:
-    from threading import local as LocalContext
+from c3nav.mapdata.utils.cache.artifacts import artifacts
 
 
 class GeometryIndexed:
@@ -211,20 +208,9 @@ class LevelGeometryIndexed(GeometryIndexed):
         # noinspection PyArgumentList
         return self.save(self.level_filename(level_id, mode))
 
-    cached = LocalContext()
-
     @classmethod
     def open_level_cached(cls, level_id, mode):
         from c3nav.mapdata.models import MapUpdate
         cache_key = MapUpdate.current_processed_cache_key()
-        if getattr(cls.cached, 'key', None) != cache_key:
-            cls.cached.key = cache_key
-            cls.cached.data = {}
-        else:
-            result = cls.cached.data.get((level_id, mode), None)
-            if result is not None:
-                return result
-
-        result = cls.open_level(level_id, mode)
-        cls.cached.data[(level_id, mode)] = result
-        return result
+        return artifacts.get('level_geometry_%s' % cls.__name__, cache_key, lambda: cls.open_level(level_id, mode),
+                             key=(level_id, mode), files=(cls.level_filename(level_id, mode), ))
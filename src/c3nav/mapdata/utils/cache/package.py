@@ -9,11 +9,7 @@ from typing import BinaryIO, Optional, Self
 from pyzstd import CParameter, ZstdError, ZstdFile
 
 from c3nav.mapdata.utils.cache import AccessRestrictionAffected, GeometryIndexed, MapHistory
-
-try:
-    from asgiref.local import Local as LocalContext
-except ImportError:
-    from threading import local as LocalContext
+from c3nav.mapdata.utils.cache.artifacts import artifacts
 
 ZSTD_MAGIC_NUMBER = b"\x28\xb5\x2f\xfd"
 CachePackageLevel = namedtuple('CachePackageLevel', ('history', 'restrictions'))
@@ -133,20 +129,12 @@ class CachePackage:
             package = Path(package)
         return cls.read(package.open('rb'))
 
-    cached = LocalContext()
-
     @classmethod
     def open_cached(cls) -> Self:
         from c3nav.mapdata.models import MapUpdate
         cache_key = MapUpdate.current_processed_geometry_cache_key()
-        if getattr(cls.cached, 'key', None) != cache_key:
-            cls.cached.key = cache_key
-            cls.cached.data = None
-
-        if cls.cached.data is None:
-            cls.cached.data = cls.open(update_cache_key=cache_key)
-
-        return cls.cached.data
+        return artifacts.get('cache_package', cache_key, lambda: cls.open(update_cache_key=cache_key),
+                             files=(cls.get_filename(cache_key), ))
 
     def bounds_valid(self, minx, miny, maxx, maxy):
         return (minx <= self.bounds[2] and maxx >= self.bounds[0] and
@@ -1,5 +1,6 @@
 from operator import itemgetter
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.utils import timezone
@@ -21,6 +22,21 @@ def increment_cache_key(cache_key):
         cache.set(cache_key, 1, None)
 
 
+def get_top_stats(prefix):
+    """
+    Get the current values of all api stats with the given prefix, highest first.
+    This needs the redis cache backend, with other backends there are no stats to get.
+    :return: list of (name without prefix, value)
+    """
+    if settings.CACHES['default']['BACKEND'] != 'django.core.cache.backends.redis.RedisCache':
+        return []
+    client = cache._cache.get_client()
+    keys = tuple(key.decode('utf-8').split(':', 2)[2]
+                 for key in client.keys(f"*{settings.CACHES['default'].get('KEY_PREFIX', '')}{prefix}*"))
+    return sorted(((key[len(prefix):], value) for key, value in cache.get_many(keys).items()),
+                  key=itemgetter(1), reverse=True)
+
+
 def stats_snapshot(reset=True):
     last_now = cache.get('apistats_last_reset', '', None)
     now = timezone.now()
@@ -22,6 +22,7 @@ from c3nav.mesh.cformats import CFormat
 from c3nav.mesh.messages import (MESH_BROADCAST_ADDRESS, MESH_NONE_ADDRESS, MESH_ROOT_ADDRESS, OTA_CHUNK_SIZE,
                                  MeshMessage, MeshMessageType, OTAApplyMessage, OTASettingMessage)
 from c3nav.mesh.models import MeshNode, MeshUplink, NodeMessage, OTARecipientStatus, OTAUpdate, OTAUpdateRecipient
+from c3nav.mesh.schemas import RangeResultItem
 from c3nav.mesh.utils import MESH_ALL_OTA_GROUP, MESH_ALL_UPLINKS_GROUP, UPLINK_PING, get_mesh_uplink_group
 from c3nav.routing.locator import Locator
 
@@ -907,13 +908,8 @@ class MeshUIConsumer(AsyncJsonWebsocketConsumer):
     def locator(self, msg, orig_addr=None):
         locator = Locator.load()
         return locator.locate_range(
-            locator.convert_raw_scan_data([
-                {
-                    "bssid": r["peer"],
-                    "ssid": "",
-                    "rssi": r["rssi"],
-                    "distance": r["distance"]
-                }
+            locator.convert_range_results([
+                RangeResultItem.model_validate(r)
                 for r in msg["ranges"]
                 if r["distance"] != 0xFFFF
             ]),
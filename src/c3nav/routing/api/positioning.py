@@ -1,4 +1,4 @@
-from typing import Annotated, Union
+from typing import Annotated, Optional, Union
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
@@ -8,6 +8,7 @@ from pydantic_extra_types.mac_address import MacAddress
 
 from c3nav.api.auth import auth_responses
 from c3nav.api.schema import BaseSchema
+from c3nav.api.utils import NonEmptyStr
 from c3nav.mapdata.models.access import AccessPermission
 from c3nav.mapdata.schemas.models import CustomLocationSchema
 from c3nav.mapdata.utils.cache.stats import increment_cache_key
@@ -56,6 +57,76 @@ def get_position(request, parameters: LocateRequestSchema):
     }
 
 
+class LocateBatchScanSchema(LocateRequestSchema):
+    device: Optional[NonEmptyStr] = APIField(
+        None,
+        title="device",
+        description="identifier of the device that made this scan, returned with the result",
+    )
+    timestamp: Optional[float] = APIField(
+        None,
+        title="timestamp",
+        description="when this scan was made, as a unix timestamp. used to tell how far the device could have moved "
+                    "between the scans of a time series. if not given, the time the scan is received is used.",
+    )
+
+
+class LocateBatchRequestSchema(BaseSchema):
+    scans: list[LocateBatchScanSchema] = APIField(
+        min_length=1,
+        max_length=100,
+        title="scans",
+        description="scans to locate, from several devices or a time series of one device",
+    )
+
+
+class LocateBatchItemResult(PositioningResult):
+    device: Union[
+        NonEmptyStr,
+        Annotated[None, APIField(title="null", description="no device given")]
+    ] = APIField(
+        None,
+        title="device",
+        description="device given with the scan",
+    )
+
+
+class LocateBatchResult(BaseSchema):
+    results: list[LocateBatchItemResult] = APIField(
+        title="results",
+        description="one result for every scan, in the same order",
+    )
+
+
+def locate_batch(scans: list[LocateBatchScanSchema], permissions, states=None) -> dict:
+    """
+    :param states: LocatorTrackingState or None for every scan, see Locator.locate_many()
+    """
+    locations = Locator.load().locate_many(tuple(scan.dict()["wifi_peers"] for scan in scans),
+                                           permissions=permissions, states=states,
+                                           timestamps=tuple(scan.timestamp for scan in scans))
+    for location in locations:
+        if location is not None:
+            increment_cache_key('apistats__locate__%s' % location.pk)
+    return {
+        "results": [
+            {
+                "device": scan.device,
+                "location": location.serialize(simple_geometry=True) if location else None,
+            }
+            for scan, location in zip(scans, locations)
+        ]
+    }
+
+
+@positioning_api_router.post('/locate/batch/', summary="determine many positions",
+                             description="determine positions for many scans at once, "
+                                         "e.g. from several devices or a time series of one device",
+                             response={200: LocateBatchResult, **auth_responses})
+def get_positions(request, parameters: LocateBatchRequestSchema):
+    return locate_batch(parameters.scans, permissions=AccessPermission.get_for_request(request))
+
+
 if settings.METRICS:
     from c3nav.mapdata.metrics import APIStatsCollector
     APIStatsCollector.add_stat('locate', 'location')
@@ -79,16 +150,7 @@ def locate_test(request):
 
     locator = Locator.load()
     location = locator.locate_range(
-        locator.convert_raw_scan_data([
-            {
-                "bssid": r.peer,
-                "ssid": "",
-                "rssi": r.rssi,
-                "distance": r.distance,
-            }
-            for r in msg.parsed.ranges
-            if r.distance != 0xFFFF
-        ]),
+        locator.convert_range_results([r for r in msg.parsed.ranges if r.distance != 0xFFFF]),
         None
     )
     return {
@@ -8,7 +8,7 @@ from django.utils.translation import gettext_lazy as _
 from ninja import Field as APIField
 from ninja import Router as APIRouter
 from ninja import Schema
-from pydantic import PositiveInt
+from pydantic import NonNegativeInt, PositiveFloat, PositiveInt
 
 from c3nav.api.auth import APIKeyAuth, auth_responses, validate_responses
 from c3nav.api.exceptions import APIRequestValidationFailed
@@ -19,7 +19,9 @@ from c3nav.mapdata.models.access import AccessPermission
 from c3nav.mapdata.models.locations import Position
 from c3nav.mapdata.schemas.model_base import AnyLocationID, Coordinates3D
 from c3nav.mapdata.utils.cache.stats import increment_cache_key
-from c3nav.mapdata.utils.locations import visible_locations_for_request
+from c3nav.mapdata.utils.geometry import smart_mapping
+from c3nav.mapdata.utils.json import format_geojson
+from c3nav.mapdata.utils.locations import get_location_by_id_for_request, visible_locations_for_request
 from c3nav.routing.exceptions import LocationUnreachable, NoRouteFound, NotYetRoutable
 from c3nav.routing.forms import RouteForm
 from c3nav.routing.models import RouteOptions
@@ -205,10 +207,14 @@ def get_route(request, parameters: RouteParametersSchema):
         _new_update_route_options(options, parameters.options_override)
 
     try:
-        route = Router.load().get_route(origin=form.cleaned_data['origin'],
-                                        destination=form.cleaned_data['destination'],
-                                        permissions=AccessPermission.get_for_request(request),
-                                        options=options)
+        route = Router.load().get_serialized_route(
+            origin=form.cleaned_data['origin'],
+            destination=form.cleaned_data['destination'],
+            permissions=AccessPermission.get_for_request(request),
+            options=options,
+            locations=visible_locations_for_request(request),
+            locations_cache_key=AccessPermission.cache_key_for_request(request),
+        )
     except NotYetRoutable:
         return NoRouteResponse(
             request=parameters,
@@ -248,13 +254,246 @@ def get_route(request, parameters: RouteParametersSchema):
             'destination': parameters.destination,
             'options': options.serialize_string(),
         }),
-        result=route.serialize(locations=visible_locations_for_request(request)),
+        result=route,
+    )
+
+
+class RouteMatrixParametersSchema(BaseSchema):
+    origin: AnyLocationID
+    destinations: list[AnyLocationID] = APIField(
+        min_length=1,
+        max_length=100,
+        title="destinations",
+    )
+    full_routes: NonNegativeInt = APIField(
+        0,
+        title="full routes",
+        description="include full routes for this many of the best destinations",
+    )
+    options_override: Optional[UpdateRouteOptionsSchema] = APIField(
+        None,
+        title="override routing options",
+    )
+
+
+class RouteMatrixItemSchema(BaseSchema):
+    destination: AnyLocationID
+    distance: Union[
+        float,
+        Annotated[None, APIField(title="null", description="no route found")],
+    ] = None
+    duration: Union[
+        int,
+        Annotated[None, APIField(title="null", description="no route found")],
+    ] = None
+    error: Union[
+        NonEmptyStr,
+        Annotated[None, APIField(title="null", description="a route was found")],
+    ] = APIField(None, description="reason why no route could be determined")
+    route: Union[
+        RouteSchema,
+        Annotated[None, APIField(title="null", description="full route not requested for this destination")],
+    ] = None
+
+
+class RouteMatrixResponse(BaseSchema):
+    request: RouteMatrixParametersSchema
+    options: RouteOptionsSchema
+    results: list[RouteMatrixItemSchema]
+
+    class Config(Schema.Config):
+        title = "routes determined"
+
+
+class NoRouteMatrixResponse(BaseSchema):
+    request: RouteMatrixParametersSchema
+    options: RouteOptionsSchema
+    error: NonEmptyStr = APIField(
+        name="error description",
+        description=("the routing parameters were valid, but it was not possible to route from the origin. "
+                     "this field contains the reason.")
+    )
+
+    class Config(Schema.Config):
+        title = "origin could not be routed from"
+
+
+routing_errors = {
+    NotYetRoutable: _('Not yet routable, try again shortly.'),
+    LocationUnreachable: _('Unreachable location.'),
+    NoRouteFound: _('No route found.'),
+}
+
+
+@routing_api_router.post('/matrix/', summary="query routes to many destinations",
+                         auth=APIKeyAuth(is_readonly=True),
+                         description=("query distance and duration from one origin to many destinations at once, "
+                                      "optionally including the full routes for the best destinations"),
+                         response={200: RouteMatrixResponse | NoRouteMatrixResponse,
+                                   **validate_responses, **auth_responses})
+def get_route_matrix(request, parameters: RouteMatrixParametersSchema):
+    origin = get_location_by_id_for_request(parameters.origin, request)
+    if origin is None:
+        raise APIRequestValidationFailed(_('Unknown origin.'))
+    destinations = tuple(get_location_by_id_for_request(destination, request)
+                         for destination in parameters.destinations)
+
+    options = RouteOptions.get_for_request(request)
+    if parameters.options_override is not None:
+        _new_update_route_options(options, parameters.options_override)
+
+    try:
+        routes = Router.load().get_routes(origin=origin,
+                                          destinations=tuple(filter(None, destinations)),
+                                          permissions=AccessPermission.get_for_request(request),
+                                          options=options)
+    except (NotYetRoutable, LocationUnreachable) as e:
+        return NoRouteMatrixResponse(
+            request=parameters,
+            options=_new_serialize_route_options(options),
+            error=routing_errors[type(e)],
+        )
+
+    routes = iter(routes)
+    results = []
+    found = []
+    for destination_id, destination in zip(parameters.destinations, destinations):
+        if destination is None:
+            results.append({'destination': destination_id, 'error': _('Unknown destination.')})
+            continue
+        route = next(routes)
+        if isinstance(route, Exception):
+            results.append({'destination': destination_id, 'error': routing_errors[type(route)]})
+            continue
+        distance, duration = route.get_distance_and_duration()
+        result = {'destination': destination_id, 'distance': distance, 'duration': duration}
+        results.append(result)
+        found.append((result, route))
+
+    # only the best destinations get their full route
+    if parameters.full_routes:
+        found.sort(key=lambda item: item[0]['distance' if options['mode'] == 'shortest' else 'duration'])
+        locations = visible_locations_for_request(request)
+        descriptions = Router.load().get_location_descriptions(AccessPermission.cache_key_for_request(request))
+        for result, route in found[:parameters.full_routes]:
+            result['route'] = route.serialize(locations=locations, descriptions=descriptions)
+
+    increment_cache_key('apistats__route_matrix')
+
+    return RouteMatrixResponse(
+        request=parameters,
+        options=_new_serialize_route_options(options),
+        results=results,
+    )
+
+
+class ReachableParametersSchema(BaseSchema):
+    origin: AnyLocationID
+    max_cost: PositiveFloat = APIField(
+        title="maximum cost",
+        description="maximum duration in seconds for the fastest route mode, maximum distance in meters for the "
+                    "shortest route mode",
+    )
+    geometries: bool = APIField(
+        False,
+        title="include geometries",
+        description="include a geometry of the reachable area for each level",
+    )
+    options_override: Optional[UpdateRouteOptionsSchema] = APIField(
+        None,
+        title="override routing options",
+    )
+
+
+class ReachableLocationSchema(BaseSchema):
+    id: PositiveInt
+    cost: float = APIField(
+        title="cost",
+        description="duration in seconds for the fastest route mode, distance in meters for the shortest route mode, "
+                    "as weighted by the router (e.g. including slow down factors of areas)",
+    )
+
+
+class ReachableResponse(BaseSchema):
+    request: ReachableParametersSchema
+    options: RouteOptionsSchema
+    spaces: list[ReachableLocationSchema]
+    areas: list[ReachableLocationSchema]
+    pois: list[ReachableLocationSchema]
+    geometries: Union[
+        Annotated[dict[PositiveInt, dict], APIField(title="geometries", description="geometry for each level")],
+        Annotated[None, APIField(title="null", description="geometries were not requested")],
+    ] = None
+
+    class Config(Schema.Config):
+        title = "reachable locations determined"
+
+
+class NoReachableResponse(BaseSchema):
+    request: ReachableParametersSchema
+    options: RouteOptionsSchema
+    error: NonEmptyStr = APIField(
+        name="error description",
+        description=("the parameters were valid, but it was not possible to route from the origin. "
+                     "this field contains the reason.")
+    )
+
+    class Config(Schema.Config):
+        title = "origin could not be routed from"
+
+
+@routing_api_router.post('/reachable/', summary="query reachable locations",
+                         auth=APIKeyAuth(is_readonly=True),
+                         description="query all spaces, areas and POIs that can be reached from a location "
+                                     "within the given duration or distance",
+                         response={200: ReachableResponse | NoReachableResponse,
+                                   **validate_responses, **auth_responses})
+def get_reachable(request, parameters: ReachableParametersSchema):
+    origin = get_location_by_id_for_request(parameters.origin, request)
+    if origin is None:
+        raise APIRequestValidationFailed(_('Unknown origin.'))
+
+    options = RouteOptions.get_for_request(request)
+    if parameters.options_override is not None:
+        _new_update_route_options(options, parameters.options_override)
+
+    try:
+        reachable = Router.load().get_reachable(origin=origin,
+                                                permissions=AccessPermission.get_for_request(request),
+                                                options=options,
+                                                max_cost=parameters.max_cost,
+                                                geometries=parameters.geometries)
+    except (NotYetRoutable, LocationUnreachable) as e:
+        return NoReachableResponse(
+            request=parameters,
+            options=_new_serialize_route_options(options),
+            error=routing_errors[type(e)],
+        )
+
+    increment_cache_key('apistats__reachable')
+
+    visible_locations = visible_locations_for_request(request)
+    return ReachableResponse(
+        request=parameters,
+        options=_new_serialize_route_options(options),
+        **{
+            name: [{'id': pk, 'cost': round(cost, 1)}
+                   for pk, cost in sorted(locations.items(), key=lambda item: item[1]) if pk in visible_locations]
+            for name, locations in (('spaces', reachable.spaces), ('areas', reachable.areas),
+                                    ('pois', reachable.pois))
+        },
+        geometries=None if reachable.geometries is None else {
+            level: format_geojson(smart_mapping(geometry))
+            for level, geometry in reachable.geometries.items()
+        },
     )
 
 
 if settings.METRICS:
     from c3nav.mapdata.metrics import APIStatsCollector
     APIStatsCollector.add_stat('route')
+    APIStatsCollector.add_stat('route_matrix')
+    APIStatsCollector.add_stat('reachable')
     APIStatsCollector.add_stat('route_tuple', ['origin', 'destination'])
     APIStatsCollector.add_stat('route_origin', ['origin'])
     APIStatsCollector.add_stat('route_destination', ['destination'])
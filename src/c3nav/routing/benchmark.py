@@ -0,0 +1,212 @@
+import math
+import random
+import resource
+import shutil
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from shapely.geometry import Point, box
+
+from c3nav.mapdata.models import (AccessRestriction, AltitudeArea, Area, Building, Door, GraphEdge, GraphNode, Level,
+                                  LocationGroup, LocationGroupCategory, MapUpdate, Space, WayType)
+from c3nav.mapdata.models.geometry.space import POI
+from c3nav.mapdata.utils.cache.changes import changed_geometries
+from c3nav.mapdata.utils.locations import CustomLocation
+from c3nav.routing.exceptions import LocationUnreachable, NoRouteFound, NotYetRoutable
+from c3nav.routing.models import RouteOptions
+from c3nav.routing.router import Router
+
+
+def generate_venue(nodes=10000, levels=4, room_nodes=4, room_size=10.0, seed=1):
+    """
+    Generate a synthetic venue with the given number of graph nodes in the database.
+    Each level is a square grid of rooms with a grid of room_nodes × room_nodes graph nodes each,
+    neighboring rooms are connected through doors and the levels are connected by stairs.
+    Some rooms are restricted, some contain areas that slow you down and POIs that are part of a location group.
+    :return: list of the created levels
+    """
+    rnd = random.Random(seed)
+    rooms = max(1, math.ceil(math.sqrt(nodes / levels / room_nodes ** 2)))
+    extent = rooms * room_size
+    step = room_size / (room_nodes + 1)
+    door = room_nodes // 2
+    # don't collide with existing levels
+    base_altitude = (Level.objects.aggregate(Max('base_altitude'))['base_altitude__max'] or 0) + 10
+
+    category = LocationGroupCategory.objects.create(name='benchmark', title={'en': 'Benchmark'})
+    toilets = LocationGroup.objects.create(category=category, title={'en': 'Toilets'}, slug='benchmark-toilets')
+    restriction = AccessRestriction.objects.create(title={'en': 'Backstage'})
+    stairs = WayType.objects.create(title={'en': 'Stairs'}, title_plural={'en': 'Stairs'}, color='#000000',
+                                    speed=0.5, speed_up=0.3, extra_seconds=2, description={'en': 'Take the stairs.'},
+                                    description_up={'en': 'Go up the stairs.'})
+
+    created_levels = []
+    node_grid = {}
+    edges = []
+    for level_i in range(levels):
+        level = Level.objects.create(base_altitude=base_altitude + level_i * 4, short_label='b%d' % level_i,
+                                     title={'en': 'Benchmark level %d' % level_i})
+        created_levels.append(level)
+        Building.objects.create(level=level, geometry=box(0, 0, extent, extent))
+        AltitudeArea.objects.create(level=level, geometry=box(0, 0, extent, extent),
+                                    altitude=base_altitude + level_i * 4)
+
+        for room_x in range(rooms):
+            for room_y in range(rooms):
+                x0, y0 = room_x * room_size, room_y * room_size
+                space = Space.objects.create(
+                    level=level, geometry=box(x0, y0, x0 + room_size, y0 + room_size),
+                    title={'en': 'Room %d-%d-%d' % (level_i, room_x, room_y)},
+                    access_restriction=restriction if rnd.random() < 0.02 else None,
+                )
+                if rnd.random() < 0.3:
+                    Area.objects.create(space=space, geometry=box(x0 + 1, y0 + 1, x0 + 4, y0 + 4),
+                                        title={'en': 'Area %d-%d-%d' % (level_i, room_x, room_y)},
+                                        slow_down_factor=2)
+                if rnd.random() < 0.3:
+                    poi = POI.objects.create(space=space, geometry=Point(x0 + room_size * 0.73, y0 + room_size * 0.61),
+                                             title={'en': 'Toilet %d-%d-%d' % (level_i, room_x, room_y)})
+                    poi.groups.add(toilets)
+                if room_x:
+                    Door.objects.create(level=level, geometry=box(x0 - 0.1, y0 + room_size / 2 - 0.5,
+                                                                  x0 + 0.1, y0 + room_size / 2 + 0.5))
+                if room_y:
+                    Door.objects.create(level=level, geometry=box(x0 + room_size / 2 - 0.5, y0 - 0.1,
+                                                                  x0 + room_size / 2 + 0.5, y0 + 0.1))
+
+                room_grid = [(i, j) for i in range(room_nodes) for j in range(room_nodes)]
+                graph_nodes = GraphNode.objects.bulk_create(
+                    GraphNode(space=space, geometry=Point(x0 + step * (i + 1), y0 + step * (j + 1)))
+                    for i, j in room_grid
+                )
+                for (i, j), graph_node in zip(room_grid, graph_nodes):
+                    node_grid[(level_i, room_x * room_nodes + i, room_y * room_nodes + j)] = graph_node
+
+        # connect the nodes within each room, and the rooms only where the doors are
+        size = rooms * room_nodes
+        for x in range(size):
+            for y in range(size):
+                for other_x, other_y in ((x + 1, y), (x, y + 1)):
+                    other = node_grid.get((level_i, other_x, other_y))
+                    if other is None:
+                        continue
+                    if other_x // room_nodes != x // room_nodes and y % room_nodes != door:
+                        continue
+                    if other_y // room_nodes != y // room_nodes and x % room_nodes != door:
+                        continue
+                    edge_restriction = restriction if rnd.random() < 0.01 else None
+                    node = node_grid[(level_i, x, y)]
+                    edges.append(GraphEdge(from_node=node, to_node=other, access_restriction=edge_restriction))
+                    edges.append(GraphEdge(from_node=other, to_node=node, access_restriction=edge_restriction))
+
+        # stairs in two corners
+        if level_i:
+            for x, y in ((0, 0), (size - 1, size - 1)):
+                lower, upper = node_grid[(level_i - 1, x, y)], node_grid[(level_i, x, y)]
+                edges.append(GraphEdge(from_node=lower, to_node=upper, waytype=stairs))
+                edges.append(GraphEdge(from_node=upper, to_node=lower, waytype=stairs))
+
+    GraphEdge.objects.bulk_create(edges, batch_size=10000)
+    return created_levels
+
+
+def _get_percentiles(values):
+    values = np.array(values) * 1000
+    if not values.size:
+        return {'count': 0}
+    return {
+        'count': int(values.size),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+    }
+
+
+def _get_size(path):
+    if path.is_dir():
+        return sum(_get_size(child) for child in path.iterdir())
+    return path.stat().st_size
+
+
+def run_benchmark(nodes=10000, levels=4, routes=200, seed=1):
+    """
+    Generate a synthetic venue and measure rebuilding the router, finding routes and serializing them.
+    Everything happens in a transaction that gets rolled back, the cache files are deleted afterwards.
+    :return: dict of results
+    """
+    rnd = random.Random(seed)
+    results = {}
+    with transaction.atomic():
+        start = time.perf_counter()
+        created_levels = generate_venue(nodes=nodes, levels=levels, seed=seed)
+        spaces = tuple(Space.objects.filter(level__in=created_levels).select_related('level'))
+        results['venue'] = {
+            'generate_seconds': time.perf_counter() - start,
+            'levels': len(created_levels),
+            'spaces': len(spaces),
+            'nodes': GraphNode.objects.filter(space__in=spaces).count(),
+            'edges': GraphEdge.objects.filter(from_node__space__in=spaces).count(),
+        }
+
+        update = MapUpdate.objects.create(type='management', geometries_changed=False).to_tuple
+        cache_dir = settings.CACHE_ROOT / MapUpdate.build_cache_key(*update)
+        cache_dir.mkdir(exist_ok=True)
+        try:
+            start = time.perf_counter()
+            Router.rebuild(update)
+            results['rebuild_seconds'] = time.perf_counter() - start
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            router = Router.load_nocache(update)
+            results['load_seconds'] = time.perf_counter() - start
+            results['router_memory_bytes'] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            results['pickle_bytes'] = Router.build_filename(update).stat().st_size
+            results['graph_bytes'] = _get_size(Router.build_graph_dirname(update))
+
+            locations = (spaces + tuple(POI.objects.filter(space__in=spaces)) +
+                         tuple(Area.objects.filter(space__in=spaces)))
+            options = RouteOptions()
+            route_times = {'locations': [], 'coordinates': []}
+            serialize_times = []
+            unreachable = 0
+            for i in range(routes):
+                origin = rnd.choice(locations)
+                if i % 2:
+                    space = rnd.choice(spaces)
+                    minx, miny, maxx, maxy = space.geometry.bounds
+                    destination = CustomLocation(space.level, rnd.uniform(minx, maxx), rnd.uniform(miny, maxy))
+                    kind = 'coordinates'
+                else:
+                    destination = rnd.choice(locations)
+                    kind = 'locations'
+
+                start = time.perf_counter()
+                try:
+                    route = router.get_route(origin, destination, set(), options)
+                except (NotYetRoutable, LocationUnreachable, NoRouteFound):
+                    unreachable += 1
+                    continue
+                route_times[kind].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                if kind == 'coordinates':
+                    # would be described by the last processed router otherwise, not the benchmark one
+                    destination.description = router.describe_custom_location(destination)
+                route.serialize(locations={})
+                serialize_times.append(time.perf_counter() - start)
+
+            results['routes'] = {kind: _get_percentiles(times) for kind, times in route_times.items()}
+            results['routes']['unreachable'] = unreachable
+            results['serialize'] = _get_percentiles(serialize_times)
+            results['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            changed_geometries.reset()
+            transaction.set_rollback(True)
+    return results
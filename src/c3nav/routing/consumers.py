@@ -0,0 +1,52 @@
+from typing import Optional
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from pydantic import ValidationError
+
+from c3nav.mapdata.models.access import AccessPermission
+from c3nav.routing.api.positioning import (LocateBatchRequestSchema, LocateBatchResult, LocateBatchScanSchema,
+                                           locate_batch)
+from c3nav.routing.locator import LocatorTrackingState
+
+
+class PositioningConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Streaming positioning. Send one scan (like for /locate/batch/, with an optional device)
+    or {"scans": [...]}, get {"results": [...]} back, like from /locate/batch/.
+    Permissions are only looked up once on connect, the tracking state of each device is kept for the connection.
+    Devices are tracked, so their next position is only searched near the previous one.
+    """
+    max_devices = 100
+
+    def __init__(self):
+        super().__init__()
+        self.permissions = None
+        self.devices: dict[Optional[str], LocatorTrackingState] = {}
+
+    async def connect(self):
+        self.permissions = await database_sync_to_async(AccessPermission.get_for_user)(self.scope["user"])
+        await self.accept()
+
+    async def receive_json(self, content, **kwargs):
+        try:
+            if isinstance(content, dict) and "scans" in content:
+                scans = LocateBatchRequestSchema.model_validate(content).scans
+            else:
+                scans = [LocateBatchScanSchema.model_validate(content)]
+        except ValidationError as e:
+            await self.send_json({"error": e.errors(include_url=False, include_context=False, include_input=False)})
+            return
+
+        devices = frozenset(scan.device for scan in scans)
+        if len(devices | self.devices.keys()) > self.max_devices:
+            await self.send_json({"error": "too many devices"})
+            return
+
+        states = tuple(self.devices.setdefault(scan.device, LocatorTrackingState()) for scan in scans)
+        await self.send_json(await self.locate(scans, states))
+
+    @database_sync_to_async
+    def locate(self, scans, states):
+        result = locate_batch(scans, permissions=self.permissions, states=states)
+        return LocateBatchResult.model_validate(result).model_dump(mode="json")
@@ -0,0 +1,217 @@
+import heapq
+import pickle
+
+import numpy as np
+from django.conf import settings
+
+from c3nav.mapdata.models import MapUpdate
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy for one fixed set of edge weights (one route profile and one restriction set).
+    Nodes get contracted one by one, adding shortcut edges so that shortest paths between the remaining nodes
+    are preserved. Queries only need to follow edges towards more important nodes from both ends, which makes
+    them settle a tiny fraction of the nodes a regular search on the full graph would have to settle.
+    """
+    # how many nodes a witness search may settle before it assumes that a shortcut is needed
+    witness_settle_limit = 60
+
+    def __init__(self, graph, weights, profile=None):
+        # the route profile this hierarchy was built for, as returned by Router.get_profile()
+        self.profile = profile
+
+        num_nodes = graph.num_nodes
+        out_edges = [{} for i in range(num_nodes)]
+        in_edges = [{} for i in range(num_nodes)]
+        for from_node, to_node, weight in zip(graph.from_nodes.tolist(), graph.to_nodes.tolist(), weights.tolist()):
+            if from_node == to_node or weight == np.inf:
+                continue
+            if weight < out_edges[from_node].get(to_node, np.inf):
+                out_edges[from_node][to_node] = weight
+                in_edges[to_node][from_node] = weight
+
+        shortcuts = {}
+        upward_edges = [None] * num_nodes
+        downward_edges = [None] * num_nodes
+        contracted_neighbors = [0] * num_nodes
+
+        queue = [(self._get_priority(node, out_edges, in_edges, contracted_neighbors), node)
+                 for node in range(num_nodes)]
+        heapq.heapify(queue)
+        while queue:
+            priority, node = heapq.heappop(queue)
+            # lazy update: priorities change as neighbors get contracted
+            priority = self._get_priority(node, out_edges, in_edges, contracted_neighbors)
+            if queue and priority > queue[0][0]:
+                heapq.heappush(queue, (priority, node))
+                continue
+
+            for from_node, to_node, weight in self._get_shortcuts(node, out_edges, in_edges):
+                if weight < out_edges[from_node].get(to_node, np.inf):
+                    out_edges[from_node][to_node] = weight
+                    in_edges[to_node][from_node] = weight
+                    shortcuts[(from_node, to_node)] = node
+
+            # all remaining neighbors are more important than this node
+            upward_edges[node] = out_edges[node]
+            downward_edges[node] = in_edges[node]
+            for to_node in out_edges[node]:
+                in_edges[to_node].pop(node)
+                contracted_neighbors[to_node] += 1
+            for from_node in in_edges[node]:
+                out_edges[from_node].pop(node)
+                contracted_neighbors[from_node] += 1
+
+        self.num_nodes = num_nodes
+        self.shortcuts = shortcuts
+        self.upward_indptr, self.upward_nodes, self.upward_weights = self._build_csr(upward_edges)
+        self.downward_indptr, self.downward_nodes, self.downward_weights = self._build_csr(downward_edges)
+
+    @staticmethod
+    def _build_csr(adjacency):
+        indptr = np.zeros((len(adjacency)+1, ), dtype=np.uint32)
+        np.cumsum(tuple(len(edges) for edges in adjacency), out=indptr[1:])
+        nodes = np.fromiter((node for edges in adjacency for node in edges.keys()),
+                            dtype=np.uint32, count=int(indptr[-1]))
+        weights = np.fromiter((weight for edges in adjacency for weight in edges.values()),
+                              dtype=np.float64, count=int(indptr[-1]))
+        return indptr, nodes, weights
+
+    def _witness_search(self, source, ignore_node, limit, out_edges):
+        # limited dijkstra that doesn't pass the node that is about to be contracted
+        distances = {source: 0}
+        heap = [(0, source)]
+        settled = 0
+        while heap and settled < self.witness_settle_limit:
+            cost, node = heapq.heappop(heap)
+            if cost > distances[node]:
+                continue
+            if cost > limit:
+                break
+            settled += 1
+            for next_node, weight in out_edges[node].items():
+                next_cost = cost + weight
+                if next_node != ignore_node and next_cost < distances.get(next_node, np.inf):
+                    distances[next_node] = next_cost
+                    heapq.heappush(heap, (next_cost, next_node))
+        return distances
+
+    def _get_shortcuts(self, node, out_edges, in_edges):
+        # get the shortcuts that are needed if the given node is contracted
+        if not out_edges[node]:
+            return []
+        max_out = max(out_edges[node].values())
+        result = []
+        for from_node, in_weight in in_edges[node].items():
+            distances = self._witness_search(from_node, node, in_weight+max_out, out_edges)
+            for to_node, out_weight in out_edges[node].items():
+                if to_node == from_node:
+                    continue
+                weight = in_weight + out_weight
+                if distances.get(to_node, np.inf) > weight:
+                    result.append((from_node, to_node, weight))
+        return result
+
+    def _get_priority(self, node, out_edges, in_edges, contracted_neighbors):
+        # edge difference, with a penalty for contracting too many nodes in the same region
+        return (len(self._get_shortcuts(node, out_edges, in_edges))
+                - len(out_edges[node]) - len(in_edges[node]) + contracted_neighbors[node])
+
+    def shortest_path(self, sources, targets):
+        """
+        Find the shortest path from any of the sources to any of the targets.
+        :param sources: dict of node → initial cost
+        :param targets: dict of node → additional cost to get from the node to the destination
+        :return: tuple of nodes or None if there is no path
+        """
+        searches = (
+            # indptr, next nodes, weights, tentative costs, predecessors, heap
+            (self.upward_indptr, self.upward_nodes, self.upward_weights, dict(sources), {}, []),
+            (self.downward_indptr, self.downward_nodes, self.downward_weights, dict(targets), {}, []),
+        )
+        for indptr, next_nodes, weights, costs, predecessors, heap in searches:
+            for node, cost in costs.items():
+                predecessors[node] = -1
+                heap.append((cost, node))
+            heapq.heapify(heap)
+
+        forward_costs, backward_costs = searches[0][3], searches[1][3]
+        best_cost = np.inf
+        best_node = None
+        for node in sources.keys() & targets.keys():
+            if sources[node] + targets[node] < best_cost:
+                best_cost = sources[node] + targets[node]
+                best_node = node
+
+        forward_heap, backward_heap = searches[0][5], searches[1][5]
+        while True:
+            # each search can stop once it can no longer find anything better
+            if forward_heap and forward_heap[0][0] >= best_cost:
+                forward_heap.clear()
+            if backward_heap and backward_heap[0][0] >= best_cost:
+                backward_heap.clear()
+            if not forward_heap and not backward_heap:
+                break
+            search, other_costs = ((searches[0], backward_costs)
+                                   if forward_heap and (not backward_heap or forward_heap[0][0] <= backward_heap[0][0])
+                                   else (searches[1], forward_costs))
+            indptr, next_nodes, weights, costs, predecessors, heap = search
+            cost, node = heapq.heappop(heap)
+            if cost > costs[node]:
+                continue
+            start, end = indptr[node], indptr[node+1]
+            for next_node, weight in zip(next_nodes[start:end].tolist(), weights[start:end].tolist()):
+                next_cost = cost + weight
+                if next_cost < costs.get(next_node, np.inf):
+                    costs[next_node] = next_cost
+                    predecessors[next_node] = node
+                    heapq.heappush(heap, (next_cost, next_node))
+                    total_cost = next_cost + other_costs.get(next_node, np.inf)
+                    if total_cost < best_cost:
+                        best_cost = total_cost
+                        best_node = next_node
+
+        if best_node is None:
+            return None
+        path = (self.get_path(searches[0][4], best_node) +
+                tuple(reversed(self.get_path(searches[1][4], best_node)))[1:])
+        return self.unpack_path(path)
+
+    @staticmethod
+    def get_path(predecessors, node):
+        path = [node]
+        while True:
+            node = predecessors[node]
+            if node < 0:
+                break
+            path.append(node)
+        return tuple(reversed(path))
+
+    def unpack_path(self, path):
+        # replace all shortcuts with the edges they represent
+        result = [path[0]]
+        stack = [(from_node, to_node) for from_node, to_node in zip(path[-2::-1], path[:0:-1])]
+        while stack:
+            from_node, to_node = stack.pop()
+            middle_node = self.shortcuts.get((from_node, to_node))
+            if middle_node is None:
+                result.append(to_node)
+            else:
+                stack.append((middle_node, to_node))
+                stack.append((from_node, middle_node))
+        return tuple(result)
+
+    @classmethod
+    def build_filename(cls, update):
+        return settings.CACHE_ROOT / MapUpdate.build_cache_key(*update) / 'router_ch.pickle'
+
+    def save(self, update):
+        pickle.dump(self, open(self.build_filename(update), 'wb'))
+
+    @classmethod
+    def load_nocache(cls, update):
+        try:
+            return pickle.load(open(cls.build_filename(update), 'rb'))
+        except FileNotFoundError:
+            return None
@@ -1,8 +1,9 @@
+import logging
 import operator
 import pickle
+import time
 from dataclasses import dataclass, field
-from functools import cached_property, reduce
-from pprint import pprint
+from functools import reduce
 from typing import Annotated
 from typing import Optional, Self, Sequence, TypeAlias
 from uuid import UUID
@@ -12,17 +13,19 @@ from annotated_types import Lt
 from django.conf import settings
 from pydantic.types import NonNegativeInt
 from pydantic_extra_types.mac_address import MacAddress
+from scipy.sparse import csc_matrix, csr_matrix
+from shapely.geometry import Point
 
 from c3nav.mapdata.models import MapUpdate, Space
+from c3nav.mapdata.utils.cache.artifacts import artifacts
 from c3nav.mapdata.utils.locations import CustomLocation
+from c3nav.mesh.schemas import RangeResultItem
 from c3nav.mesh.utils import get_nodes_and_ranging_beacons
 from c3nav.routing.router import Router
 from c3nav.routing.schemas import LocateRequestWifiPeerSchema
+from c3nav.routing.trilateration import trilaterate
 
-try:
-    from asgiref.local import Local as LocalContext
-except ImportError:
-    from threading import local as LocalContext
+logger = logging.getLogger('c3nav')
 
 LocatorPeerIdentifier: TypeAlias = MacAddress | tuple[UUID, Annotated[NonNegativeInt, Lt(2 ** 16)], Annotated[NonNegativeInt, Lt(2 ** 16)]]
 
@@ -38,6 +41,7 @@ class LocatorPeer:
 class ScanDataValue:
     rssi: Optional[int] = None
     ibeacon_range: Optional[float] = None
+    # in centimeters, like the peer positions
     distance: Optional[float] = None
 
     @classmethod
@@ -62,12 +66,60 @@ class LocatorPoint:
     values: ScanData
 
 
+@dataclass
+class LocatorTrackingState:
+    """
+    Where a tracked device was last located, so its next fix can be limited to what is reachable from there
+    along the routing graph. Pass the same instance for all scans of the same device.
+    """
+    # meters per second that a device can move along the graph
+    max_speed = 2.0
+    # meters along the graph that are always reachable, to allow for inaccuracy
+    min_distance = 5.0
+    # seconds after which the device is searched everywhere again
+    max_age = 30.0
+
+    node: Optional[int] = None
+    timestamp: Optional[float] = None
+    router_update: Optional[tuple] = None
+
+    def get_max_distance(self, router, now: float) -> Optional[float]:
+        """
+        Get the distance the device could have moved since the last fix, or None if it has to be searched everywhere.
+        :param now: unix timestamp of the new scan
+        """
+        if self.node is None or self.router_update != router.update:
+            return None
+        elapsed = now - self.timestamp
+        # scans that are too old or appear to be from before the last fix (clock mismatch) can't be limited
+        if not 0 <= elapsed <= self.max_age:
+            return None
+        return max(self.min_distance, self.max_speed * elapsed)
+
+    def set(self, router, node: Optional[int], now: float):
+        self.node = node
+        self.timestamp = now
+        self.router_update = router.update
+
+
 @dataclass
 class Locator:
     peers: list[LocatorPeer] = field(default_factory=list)
     peer_lookup: dict[LocatorPeerIdentifier, int] = field(default_factory=dict)
     xyz: np.array = field(default_factory=(lambda: np.empty((0,))))
     spaces: dict[int, "LocatorSpace"] = field(default_factory=dict)
+    fingerprints: Optional["LocatorFingerprints"] = None
+    # boolean masks of the measurement points in restricted spaces, by RouterRestrictionSet.cache_key
+    restricted_points: dict[str, np.ndarray] = field(default_factory=dict, repr=False)
+
+    def __getstate__(self):
+        result = self.__dict__.copy()
+        result.pop('restricted_points', None)
+        return result
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.restricted_points = {}
 
     @classmethod
     def rebuild(cls, update, router):
@@ -93,6 +145,7 @@ class Locator:
                 )
         self.xyz = np.array(tuple(peer.xyz for peer in self.peers))
 
+        num_points = 0
         for space in Space.objects.prefetch_related('beacon_measurements'):
             new_space = LocatorSpace.create(
                 pk=space.pk,
@@ -103,10 +156,15 @@ class Locator:
                         values=self.convert_scans(measurement.data, create_peers=True),
                     )
                     for measurement in space.beacon_measurements.all()
-                )
+                ),
+                start=num_points,
             )
             if new_space.points:
                 self.spaces[space.pk] = new_space
+                num_points = new_space.rows.stop
+
+        self.fingerprints = LocatorFingerprints.create(self.spaces.values(), num_peers=len(self.peers),
+                                                       router=router)
 
     def get_peer_id(self, identifier: LocatorPeerIdentifier, create=False) -> Optional[int]:
         peer_id = self.peer_lookup.get(identifier, None)
@@ -162,22 +220,19 @@ class Locator:
     def load_nocache(cls, update):
         return pickle.load(open(cls.build_filename(update), 'rb'))
 
-    cached = LocalContext()
-
-    class NoUpdate:
-        pass
-
     @classmethod
     def load(cls):
         from c3nav.mapdata.models import MapUpdate
         update = MapUpdate.last_processed_update()
-        if getattr(cls.cached, 'update', cls.NoUpdate) != update:
-            cls.cached.update = update
-            cls.cached.data = cls.load_nocache(update)
-        return cls.cached.data
+        return artifacts.get('locator', update, lambda: cls.load_nocache(update), files=(cls.build_filename(update), ))
 
     def convert_raw_scan_data(self, raw_scan_data: list[LocateRequestWifiPeerSchema]) -> ScanData:
-        return self.convert_wifi_scan(raw_scan_data, create_peers=False)
+        result = self.convert_wifi_scan(raw_scan_data, create_peers=False)
+        # distances in the API are in meters
+        for value in result.values():
+            if value.distance is not None:
+                value.distance *= 100
+        return result
 
     def get_xyz(self, identifier: LocatorPeerIdentifier) -> tuple[int, int, int] | None:
         i = self.get_peer_id(identifier)
@@ -191,177 +246,213 @@ class Locator:
             if isinstance(peer.identifier, MacAddress)
         }
 
-    def locate(self, raw_scan_data: list[LocateRequestWifiPeerSchema], permissions=None):
+    def locate(self, raw_scan_data: list[LocateRequestWifiPeerSchema], permissions=None,
+               state: Optional[LocatorTrackingState] = None):
+        return self.locate_many((raw_scan_data, ), permissions, states=(state, ))[0]
+
+    def locate_many(self, raw_scans: Sequence[list[LocateRequestWifiPeerSchema]], permissions=None,
+                    states: Optional[Sequence[Optional[LocatorTrackingState]]] = None,
+                    timestamps: Optional[Sequence[Optional[float]]] = None) -> list[Optional[CustomLocation]]:
+        """
+        Locate several scans, for several devices or a time series.
+        All ranging based fixes are found in one pass, then all RSSI based fixes for the remaining scans.
+        :param states: tracking state for each scan, or None. scans with the same state are located in order.
+        :param timestamps: unix timestamp of each scan or None for now, used for tracking, or None for all now.
+        :return: one location or None for every scan
+        """
         # todo: support for ibeacons
-        scan_data = self.convert_raw_scan_data(raw_scan_data)
-        if not scan_data:
+        scans = tuple(self.convert_raw_scan_data(raw_scan_data) for raw_scan_data in raw_scans)
+        results = self.locate_range_many(scans, permissions)
+        rssi_scans = {i: scan_data for i, (scan_data, result) in enumerate(zip(scans, results))
+                      if scan_data and result is None}
+
+        for i, result in zip(rssi_scans.keys(), self.locate_rssi_many(
+            tuple(rssi_scans.values()), permissions,
+            states=None if states is None else tuple(states[i] for i in rssi_scans.keys()),
+            timestamps=None if timestamps is None else tuple(timestamps[i] for i in rssi_scans.keys()),
+        )):
+            results[i] = result
+        return results
+
+    def get_restricted_points(self, restrictions):
+        """
+        Get a boolean mask of the measurement points that are in spaces restricted by this RouterRestrictionSet.
+        """
+        mask = self.restricted_points.get(restrictions.cache_key)
+        if mask is None:
+            mask = np.zeros((self.fingerprints.num_points, ), dtype=np.bool_)
+            for pk in restrictions.spaces:
+                space = self.spaces.get(pk)
+                if space is not None:
+                    mask[space.rows] = True
+            mask.flags.writeable = False
+            mask = self.restricted_points.setdefault(restrictions.cache_key, mask)
+        return mask
+
+    def locate_rssi(self, scan_data: ScanData, permissions=None, state: Optional[LocatorTrackingState] = None):
+        return self.locate_rssi_many((scan_data, ), permissions, states=(state, ))[0]
+
+    def get_tracked_points(self, router, restrictions, state: LocatorTrackingState, now: float) -> Optional[np.ndarray]:
+        """
+        Get the points that a tracked device could have reached since its last fix, or None if it is not tracked.
+        """
+        max_distance = state.get_max_distance(router, now)
+        if max_distance is None:
             return None
+        distances, predecessors, best_target = router.graph.dijkstra(router.get_distance_weights(restrictions),
+                                                                     sources={state.node: 0}, limit=max_distance)
+        return self.fingerprints.get_node_points(distances.keys())
 
-        result = self.locate_range(scan_data, permissions)
-        if result is not None:
-            return result
-
-        return self.locate_rssi(scan_data, permissions)
-
-    def locate_rssi(self, scan_data: ScanData, permissions=None):
+    def locate_rssi_many(self, scans: Sequence[ScanData], permissions=None,
+                         states: Optional[Sequence[Optional[LocatorTrackingState]]] = None,
+                         timestamps: Optional[Sequence[Optional[float]]] = None) -> list[Optional[CustomLocation]]:
         router = Router.load()
         restrictions = router.get_restrictions(permissions)
 
-        # get visible spaces
-        spaces = tuple(space for pk, space in self.spaces.items() if pk not in restrictions.spaces)
-
-        # find best point
-        best_peer_id = max(scan_data.items(), key=lambda v: v[1].rssi)[0]
-        best_location = None
-        best_score = float('inf')
-        for space in spaces:
-            point, score = space.get_best_point(scan_data, needed_peer_id=best_peer_id)
-            if point is None:
-                continue
-            if score < best_score:
-                location = CustomLocation(router.spaces[space.pk].level, point.x, point.y,
+        results = [None] * len(scans)
+        if states is None:
+            states = (None, ) * len(scans)
+        # scans of a time series are only as far apart as their timestamps say, not all at the same time
+        now = time.time()
+        timestamps = tuple(now if timestamp is None else timestamp
+                           for timestamp in (timestamps or (None, ) * len(scans)))
+        scans = {i: {peer_id: value for peer_id, value in scan_data.items() if value.rssi is not None}
+                 for i, scan_data in enumerate(scans)}
+        scans = {i: scan_data for i, scan_data in scans.items() if scan_data}
+        if not scans or self.fingerprints is None:
+            return results
+
+        # scans of the same tracked device depend on each other, so they are located in rounds
+        rounds = []
+        device_rounds = {}
+        for i in scans.keys():
+            round_i = 0
+            if states[i] is not None:
+                round_i = device_rounds.get(id(states[i]), 0)
+                device_rounds[id(states[i])] = round_i + 1
+            if round_i == len(rounds):
+                rounds.append([])
+            rounds[round_i].append(i)
+
+        excluded_points = self.get_restricted_points(restrictions)
+        for round_scans in rounds:
+            # only points in spaces that know the strongest peer are acceptable
+            best_points = self.fingerprints.get_best_points(
+                tuple(scans[i] for i in round_scans),
+                needed_peer_ids=tuple(max(scans[i].items(), key=lambda v: v[1].rssi)[0] for i in round_scans),
+                excluded_points=excluded_points,
+                tracked_points=tuple(
+                    None if states[i] is None else self.get_tracked_points(router, restrictions, states[i],
+                                                                          timestamps[i])
+                    for i in round_scans
+                ),
+            )
+            for i, (point_i, score) in zip(round_scans, best_points):
+                if point_i is None:
+                    continue
+                x, y = self.fingerprints.xy[point_i]
+                space_pk = int(self.fingerprints.space_pks[self.fingerprints.spaces[point_i]])
+                location = CustomLocation(router.spaces[space_pk].level, float(x), float(y),
                                           permissions=permissions, icon='my_location')
-                best_location = location
-                best_score = score
-
-        best_location.score = best_score
-
-        return best_location
-
-    @cached_property
-    def least_squares_func(self):
-        # this is effectively a lazy import to save memory… todo: do we need that?
-        from scipy.optimize import least_squares
-        return least_squares
-
-    @cached_property
-    def norm_func(self):
-        # this is effectively a lazy import to save memory… todo: do we need that?
-        from scipy.linalg import norm
-        return norm
-
-    def locate_range(self, scan_data: ScanData, permissions=None, orig_addr=None):
-        pprint(scan_data)
-
-        peer_ids = tuple(i for i in scan_data if i < len(self.xyz))
+                location.score = score
+                results[i] = location
+                if states[i] is not None:
+                    node = int(self.fingerprints.point_nodes[point_i])
+                    states[i].set(router, None if node < 0 else node, timestamps[i])
+
+        return results
+
+    def convert_range_results(self, ranges: Sequence[RangeResultItem]) -> ScanData:
+        """
+        Convert FTM ranging results of a mesh node, which already are in centimeters.
+        """
+        result = {}
+        for range_result in ranges:
+            peer_id = self.get_peer_id(range_result.peer)
+            if peer_id is not None:
+                result[peer_id] = ScanDataValue(rssi=range_result.rssi, distance=range_result.distance)
+        return result
 
-        if len(peer_ids) < 3:
+    def locate_range(self, scan_data: ScanData, permissions=None, orig_addr=None, debug=None):
+        return self.locate_range_many((scan_data, ), permissions, orig_addrs=(orig_addr, ), debug=debug)[0]
+
+    def locate_range_many(self, scans: Sequence[ScanData], permissions=None,
+                          orig_addrs: Optional[Sequence[Optional[LocatorPeerIdentifier]]] = None,
+                          debug: Optional[bool] = None) -> list[Optional[CustomLocation]]:
+        """
+        Trilaterate all scans that have ranges to at least three peers with known positions at once.
+        :param orig_addrs: for debugging, the peer that made each scan, to compare results to its known position
+        :param debug: log details about every result, defaults to settings.LOCATOR_DEBUG
+        :return: one location or None for every scan
+        """
+        if debug is None:
+            debug = settings.LOCATOR_DEBUG
+
+        results = [None] * len(scans)
+        ranged = {}
+        for i, scan_data in enumerate(scans):
+            peer_ids = tuple(peer_id for peer_id, value in scan_data.items()
+                             if peer_id < len(self.xyz) and value.distance is not None)
             # can't get a good result from just two beacons
             # todo: maybe we can at least give… something?
-            print('less than 3 ranges, can\'t do ranging')
-            return None
-
-        if len(peer_ids) == 3 and 0:
-            print('2D trilateration')
-            dimensions = 2
-        else:
-            print('3D trilateration')
-            dimensions = 3
-
-        relevant_xyz = self.xyz[peer_ids, :]
-
-        # create 2d array with x, y, z, distance as rows
-        np_ranges = np.hstack((
-            relevant_xyz,
-            np.array(tuple(scan_data[i].distance for i in peer_ids)).reshape((-1, 1)),
-        ))
-
-        print(np_ranges)
-
-        measured_ranges = np_ranges[:, 3]
-        print('a', measured_ranges)
-        # measured_ranges[measured_ranges<1] = 1
-        print('b', measured_ranges)
-
-        # rating the guess by calculating the distances
-        def diff_func(guess):
-            result = self.norm_func(np_ranges[:, :dimensions] - guess[:dimensions], axis=1) - measured_ranges
-            # print(result)
-            return result
-            # factors = self.norm_func(np_ranges[:, :dimensions] - guess[:dimensions], axis=1) / measured_ranges
-            # return factors - np.mean(factors)
-
-        def cost_func(guess):
-            result = np.abs(diff_func(guess))
-            result[result < 300] = result[result < 300]/3+200
-            return result
-
-        # initial guess i the average of all beacons, with scale 1
-        initial_guess = np.average(np_ranges[:, :dimensions], axis=0)
-
-        # here the magic happens
-        results = self.least_squares_func(
-            fun=cost_func,
-            # jac="3-point",
-            loss="linear",
-            bounds=(
-                np.min(self.beacon_positions[:, :dimensions], axis=0) - np.array([200, 200, 100])[:dimensions],
-                np.max(self.beacon_positions[:, :dimensions], axis=0) + np.array([200, 200, 100])[:dimensions],
-            ),
-            x0=initial_guess,
-        )
-
-        # create result
-        # todo: figure out level
-        result_pos = results.x
-        from c3nav.mapdata.models import Level
-        location = CustomLocation(
-            level=Level.objects.first(),
-            x=result_pos[0]/100,
-            y=result_pos[1]/100,
-            permissions=(),
-            icon='my_location'
-        )
-        location.z = result_pos[2]/100
+            if len(peer_ids) >= 3:
+                ranged[i] = peer_ids
+        if not ranged:
+            return results
+
+        # ranges as sets × peers, padded with invalid ranges
+        num_peers = max(len(peer_ids) for peer_ids in ranged.values())
+        anchors = np.zeros((len(ranged), num_peers, 3), dtype=np.float64)
+        ranges = np.zeros((len(ranged), num_peers), dtype=np.float64)
+        valid = np.zeros((len(ranged), num_peers), dtype=np.bool_)
+        for j, (i, peer_ids) in enumerate(ranged.items()):
+            anchors[j, :len(peer_ids)] = self.xyz[list(peer_ids), :]
+            ranges[j, :len(peer_ids)] = tuple(scans[i][peer_id].distance for peer_id in peer_ids)
+            valid[j, :len(peer_ids)] = True
+
+        result = trilaterate(anchors, ranges, valid,
+                             lower=np.min(self.xyz, axis=0) - np.array([200, 200, 100]),
+                             upper=np.max(self.xyz, axis=0) + np.array([200, 200, 100]))
 
-        pprint(relevant_xyz)
-
-        orig_xyz = None
-        print('orig_addr', orig_addr)
-        if orig_addr:
-            orig_xyz = self.get_xyz(orig_addr)
-            if orig_xyz:
-                orig_xyz = np.array(orig_xyz)
-
-        print()
-        print("result:", ", ".join(("%.2f" % i) for i in tuple(result_pos)))
-        if orig_xyz is not None:
-            print("correct:", ", ".join(("%.2f" % i) for i in tuple(orig_xyz)))
-            print("diff:", ", ".join(("%.2f" % i) for i in tuple(orig_xyz-result_pos)))
-        print()
-        print("measured ranges:", ", ".join(("%.2f" % i) for i in tuple(np_ranges[:, 3])))
-        print("result ranges:", ", ".join(
-            ("%.2f" % i) for i in tuple(self.norm_func(np_ranges[:, :dimensions] - result_pos[:dimensions], axis=1))
-        ))
-        if orig_xyz is not None:
-            print("correct ranges:", ", ".join(
-                ("%.2f" % i)
-                for i in tuple(self.norm_func(np_ranges[:, :dimensions] - orig_xyz[:dimensions], axis=1))
-            ))
-        print()
-        print("diff result-measured:", ", ".join(
-            ("%.2f" % i) for i in
-            tuple(diff_func(result_pos))
-        ))
-        if orig_xyz is not None:
-            print("diff correct-measured:", ", ".join(
-                ("%.2f" % i) for i in
-                tuple(diff_func(orig_xyz))
-            ))
-
-        def print_cost(title, pos):
-            cost = cost_func(pos)
-            print(title, ", ".join(
-                ("%.2f" % i) for i in cost
-            ), '=', np.sum(cost**2))
-        print_cost("cost:", result_pos)
+        router = Router.load()
+        restrictions = None if permissions is None else router.get_restrictions(permissions)
+        for j, (i, peer_ids) in enumerate(ranged.items()):
+            x, y, z = (result.positions[j] / 100).tolist()
+            level = router.level_for_point_altitude(Point(x, y), z, restrictions)
+            if level is not None:
+                location = CustomLocation(level=level.src, x=x, y=y,
+                                          permissions=() if permissions is None else permissions,
+                                          icon='my_location')
+                location.z = z
+                results[i] = location
+
+            if debug:
+                orig_addr = orig_addrs[i] if orig_addrs else None
+                self._log_range_result(result, j, peer_ids, ranges[j],
+                                       orig_xyz=self.get_xyz(orig_addr) if orig_addr else None, level=level)
+
+        return results
+
+    def _log_range_result(self, result, j, peer_ids, measured_ranges, orig_xyz=None, level=None):
+        position = result.positions[j]
+        info = {
+            "position": tuple(round(i, 2) for i in position.tolist()),
+            "level": None if level is None else level.pk,
+            "converged": bool(result.converged[j]),
+            "rms_residual": round(float(result.rms_residuals[j]), 2),
+            "ranges": {
+                str(self.peers[peer_id].identifier): {
+                    "measured": round(float(measured_ranges[k]), 2),
+                    "result": round(float(np.linalg.norm(position - self.xyz[peer_id])), 2),
+                    "weight": round(float(result.weights[j, k]), 3),
+                }
+                for k, peer_id in enumerate(peer_ids)
+            },
+        }
         if orig_xyz is not None:
-            print_cost("cost of correct position:", orig_xyz)
-        if dimensions > 2:
-            print("height:", result_pos[2])
-        # print("scale:", (factor or results.x[3]))
-
-        return location
+            info["correct"] = tuple(orig_xyz)
+            info["error"] = round(float(np.linalg.norm(position - np.array(orig_xyz))), 2)
+        logger.debug('trilateration result: %r', info)
 
 
 no_signal = int(-90)**2
@@ -372,54 +463,199 @@ class LocatorSpace:
     pk: int
     points: list[LocatorPoint]
     peer_ids: frozenset[int]
-    peer_lookup: dict[int, int]
-    levels: np.array
+    # rows of this space's points in the fingerprint matrix
+    rows: slice
 
     @classmethod
-    def create(cls, pk: int, points: Sequence[LocatorPoint]):
-        peer_set = reduce(operator.or_, (frozenset(point.values.keys()) for point in points), frozenset())
-        peers = tuple(peer_set)
-        peer_lookup = {peer_id: i for i, peer_id in enumerate(peers)}
-        levels = np.full((len(points), len(peers)), fill_value=no_signal, dtype=np.int64)
-        for i, point in enumerate(points):
-            for peer_id, value in point.values.items():
-                levels[i][peer_lookup[peer_id]] = int(value.rssi)**2
-
+    def create(cls, pk: int, points: Sequence[LocatorPoint], start: int = 0):
         return cls(
             pk=pk,
             points=list(points),
-            peer_ids=peer_set,
-            peer_lookup=peer_lookup,
-            levels=levels,
+            peer_ids=reduce(operator.or_, (frozenset(point.values.keys()) for point in points), frozenset()),
+            rows=slice(start, start + len(points)),
+        )
+
+
+@dataclass
+class LocatorFingerprints:
+    """
+    The measurement points of all spaces, with their squared RSSI per peer in one sparse points × peers matrix.
+    The points of each space are in consecutive rows, in the order of Locator.spaces.
+    """
+    matrix: csr_matrix
+    # the same matrix in columns, an inverted index of which points observed a peer with which RSSI
+    peer_points: csc_matrix
+    xy: np.ndarray
+    spaces: np.ndarray
+    space_pks: np.ndarray
+    # first row of each space, and the number of points as the last item
+    space_starts: np.ndarray
+    point_levels: np.ndarray
+    # nearest routing graph node in the same space for each point, -1 if there is none
+    point_nodes: np.ndarray
+    # the points attached to each routing graph node, as indptr into node_points like a CSR matrix
+    node_points_indptr: np.ndarray
+    node_points: np.ndarray
+
+    # how much worse than the best of all points the best reachable point of a tracked device may score
+    tracked_tolerance = 1.5
+
+    @classmethod
+    def create(cls, spaces: Sequence[LocatorSpace], num_peers: int, router):
+        spaces = tuple(spaces)
+        indptr = [0]
+        indices = []
+        data = []
+        for space in spaces:
+            for point in space.points:
+                values = sorted((peer_id, value.rssi) for peer_id, value in point.values.items()
+                                if value.rssi is not None)
+                indices.extend(peer_id for peer_id, rssi in values)
+                data.extend(int(rssi)**2 for peer_id, rssi in values)
+                indptr.append(len(indices))
+        num_points = len(indptr) - 1
+        matrix = csr_matrix((np.array(data, dtype=np.int64),
+                             np.array(indices, dtype=np.int32),
+                             np.array(indptr, dtype=np.int32)), shape=(num_points, num_peers))
+        xy = np.array(tuple((point.x, point.y) for space in spaces for point in space.points),
+                      dtype=np.float64).reshape((-1, 2))
+
+        # attach every point to the nearest graph node of its space
+        graph = router.graph
+        point_nodes = np.full((num_points, ), fill_value=-1, dtype=np.int64)
+        for space in spaces:
+            nodes = np.fromiter(router.spaces[space.pk].nodes, dtype=np.int64)
+            if not nodes.size:
+                continue
+            distances = np.linalg.norm(xy[space.rows, np.newaxis, :] - graph.xyz[np.newaxis, nodes, :2], axis=2)
+            point_nodes[space.rows] = nodes[np.argmin(distances, axis=1)]
+        attached = np.flatnonzero(point_nodes >= 0)
+        node_points = attached[np.argsort(point_nodes[attached], kind='stable')]
+        node_points_indptr = np.zeros((graph.num_nodes+1, ), dtype=np.int64)
+        np.cumsum(np.bincount(point_nodes[attached], minlength=graph.num_nodes), out=node_points_indptr[1:])
+
+        return cls(
+            matrix=matrix,
+            peer_points=matrix.tocsc(),
+            xy=xy,
+            spaces=np.repeat(np.arange(len(spaces), dtype=np.uint32),
+                             tuple(len(space.points) for space in spaces)),
+            space_pks=np.array(tuple(space.pk for space in spaces), dtype=np.uint32),
+            space_starts=np.array(tuple(space.rows.start for space in spaces) + (num_points, ), dtype=np.uint32),
+            point_levels=np.repeat(np.array(tuple(router.spaces[space.pk].level_id for space in spaces),
+                                            dtype=np.uint32),
+                                   tuple(len(space.points) for space in spaces)),
+            point_nodes=point_nodes,
+            node_points_indptr=node_points_indptr,
+            node_points=node_points,
         )
 
-    def get_best_point(self, scan_values: ScanData,
-                       needed_peer_id=None) -> tuple[LocatorPoint, float] | tuple[None, None]:
-        # check if this space knows the needed peer id, otherwise no results here
-        if needed_peer_id not in self.peer_ids:
-            return None, None
-
-        # peers that this space knows
-        peer_ids = frozenset(scan_values.keys()) & self.peer_ids
-        penalty = 0
-        for peer_id, value in scan_values.items():
-            if peer_id not in self.peer_ids:
-                penalty += (value.rssi - no_signal)**2
-
-        peers = tuple(self.peer_lookup[peer_id] for peer_id in peer_ids)
-        values = np.array(tuple(scan_values[peer_id].rssi for peer_id in peer_ids), dtype=np.int64)
-
-        # acceptable points need to have a value for the needed_peer_id
-        points = tuple(
-            np.argwhere(self.levels[:, self.peer_lookup[needed_peer_id]] > 0).ravel()
+    @property
+    def num_points(self):
+        return self.matrix.shape[0]
+
+    def get_peer_points(self, peer_id: int) -> np.ndarray:
+        """
+        Get the points that observed this peer.
+        """
+        return self.peer_points.indices[self.peer_points.indptr[peer_id]:self.peer_points.indptr[peer_id+1]]
+
+    def get_node_points(self, nodes) -> np.ndarray:
+        """
+        Get the points that are attached to any of these routing graph nodes, in ascending order.
+        """
+        nodes = np.fromiter(nodes, dtype=np.int64)
+        if not nodes.size:
+            return np.empty((0, ), dtype=np.int64)
+        return np.sort(np.concatenate(tuple(
+            self.node_points[self.node_points_indptr[node]:self.node_points_indptr[node+1]] for node in nodes
+        )))
+
+    def get_candidate_points(self, needed_peer_id: int) -> np.ndarray:
+        """
+        Get all points in spaces where at least one point observed this peer, in ascending order.
+        """
+        spaces = np.unique(self.spaces[self.get_peer_points(needed_peer_id)])
+        if not spaces.size:
+            return np.empty((0, ), dtype=np.int64)
+        return np.concatenate(tuple(np.arange(self.space_starts[space], self.space_starts[space+1], dtype=np.int64)
+                                    for space in spaces))
+
+    def get_best_point(self, scan_values: ScanData, needed_peer_id=None,
+                       excluded_points=None) -> tuple[int, float] | tuple[None, None]:
+        """
+        Score the candidate points against the scan and return the index of the best one and its score.
+        A peer that a point did not observe counts as no_signal, whether its space knows the peer or not.
+        :param needed_peer_id: only consider points in spaces where at least one point observed this peer
+        :param excluded_points: boolean mask of points to skip
+        """
+        return self.get_best_points((scan_values, ), (needed_peer_id, ), excluded_points=excluded_points)[0]
+
+    def get_best_points(self, scans: Sequence[ScanData], needed_peer_ids: Sequence[Optional[int]],
+                        excluded_points=None, tracked_points: Optional[Sequence[Optional[np.ndarray]]] = None
+                        ) -> list[tuple[int, float] | tuple[None, None]]:
+        """
+        Like get_best_point, but for several scans, which are all scored in one pass.
+        :param tracked_points: for each scan, None or the points that are reachable for a tracked device.
+                               the best of them is used, unless the best of all candidates is clearly better
+                               (see tracked_tolerance) because the device was lost, or none of them are acceptable.
+        """
+        candidates = tuple(
+            # use the inverted index, so only the spaces that know this peer get looked at
+            np.arange(self.num_points, dtype=np.int64) if needed_peer_id is None
+            else self.get_candidate_points(needed_peer_id)
+            for needed_peer_id in needed_peer_ids
         )
-        if not points:
-            return None, None
-
-        scores = (np.sum(
-            (self.levels[np.array(points, dtype=np.uint32).reshape((-1, 1)), peers] - values)**2,
-            axis=1
-        )+penalty) / len(scan_values)
-        best_point_i = np.argmin(scores).ravel()[0]
-        best_point = points[best_point_i]
-        return self.points[best_point], scores[best_point_i]
+        if excluded_points is not None:
+            candidates = tuple(points[~excluded_points[points]] for points in candidates)
+
+        results = [(None, None)] * len(scans)
+        points = np.unique(np.concatenate(candidates)) if candidates else np.empty((0, ), dtype=np.int64)
+        if not points.size:
+            return results
+
+        # scan values as peers × scans
+        peer_ids = np.array(sorted(reduce(operator.or_, (frozenset(scan.keys()) for scan in scans))), dtype=np.int32)
+        values = np.zeros((peer_ids.size, len(scans)), dtype=np.int64)
+        heard = np.zeros((peer_ids.size, len(scans)), dtype=np.int64)
+        for i, scan in enumerate(scans):
+            peers = np.searchsorted(peer_ids, np.fromiter(scan.keys(), dtype=np.int32))
+            values[peers, i] = tuple(value.rssi for value in scan.values())
+            heard[peers, i] = 1
+
+        # every point starts out as if it had observed none of the peers…
+        scores = np.tile(np.sum(heard * (no_signal - values)**2, axis=0), (points.size, 1))
+
+        # …and then the stored value L replaces that for the peers it did observe:
+        # (L - v)² - (no_signal - v)² = (L² - no_signal²) - 2v(L - no_signal)
+        observed = self.matrix[points][:, peer_ids]
+        squared = observed.copy()
+        squared.data = observed.data**2 - no_signal**2
+        observed.data = observed.data - no_signal
+        scores += squared @ heard - 2 * (observed @ values)
+
+        # only keep the scores of each scan's candidates
+        is_candidate = np.zeros(scores.shape, dtype=np.bool_)
+        for i, scan_points in enumerate(candidates):
+            is_candidate[np.searchsorted(points, scan_points), i] = True
+        scores[~is_candidate] = np.iinfo(np.int64).max
+        best = np.argmin(scores, axis=0)
+
+        # for tracked devices, prefer the best reachable point, if it's not clearly worse than the best of all
+        if tracked_points is not None:
+            is_tracked = np.zeros(scores.shape, dtype=np.bool_)
+            for i, tracked in enumerate(tracked_points):
+                if tracked is not None:
+                    is_tracked[np.searchsorted(points, tracked[np.isin(tracked, points)]), i] = True
+            is_tracked &= is_candidate
+            tracked_scores = np.where(is_tracked, scores, np.iinfo(np.int64).max)
+            best_tracked = np.argmin(tracked_scores, axis=0)
+            columns = np.arange(len(scans))
+            use_tracked = (is_tracked.any(axis=0) &
+                           (scores[best_tracked, columns] <= scores[best, columns] * self.tracked_tolerance))
+            best = np.where(use_tracked, best_tracked, best)
+
+        for i, (scan, scan_points) in enumerate(zip(scans, candidates)):
+            if scan_points.size:
+                results[i] = (int(points[best[i]]), scores[best[i], i] / len(scan))
+        return results
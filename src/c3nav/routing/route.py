@@ -7,7 +7,15 @@ from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
 
-def describe_location(location, locations):
+def describe_location(location, locations, descriptions=None):
+    """
+    :param descriptions: optional LRUCache to memoize descriptions of real locations in,
+                         only valid for one map update and one set of visible locations
+    """
+    if descriptions is not None:
+        result = descriptions.get(location.pk)
+        if result is not None:
+            return result
     if location.can_describe:
         final_location = locations.get(location.pk)
         if final_location is not None:
@@ -15,6 +23,9 @@ def describe_location(location, locations):
     result = location.serialize(include_type=True, detailed=False, simple_geometry=True)
     if hasattr(location, 'serialize_position'):
         result.update(location.serialize_position())
+    elif descriptions is not None and isinstance(location.pk, int):
+        # custom locations and positions are not memoized, there can be arbitrarily many of them
+        descriptions.set(location.pk, result)
     return result
 
 
@@ -31,7 +42,10 @@ class Route:
         self.origin_xyz = origin_xyz
         self.destination_xyz = destination_xyz
 
-    def serialize(self, locations):
+    def get_nodes(self):
+        """
+        :return: (list of [node, edge], distance from origin to first node, distance from last node to destination)
+        """
         nodes = [[node, None] for node in self.path_nodes]
         if self.origin_addition and any(self.origin_addition):
             nodes.insert(0, (self.origin_addition[0], None))
@@ -55,15 +69,42 @@ class Route:
         else:
             destination_distance = 0
 
-        items = deque()
+        return nodes, origin_distance, destination_distance
+
+    def iter_node_edges(self, nodes):
+        """
+        :return: generator of (node, edge leading to this node or None) for the nodes returned by get_nodes()
+        """
         last_node = None
+        for node, edge in nodes:
+            if edge is None and last_node is not None:
+                edge = self.router.edges[last_node, node]
+            yield node, edge
+            last_node = node
+
+    def get_distance_and_duration(self):
+        """
+        Get distance and duration of this route without describing it.
+        """
+        nodes, origin_distance, destination_distance = self.get_nodes()
+        walk_factor = self.options.walk_factor
+        distance = origin_distance + destination_distance
+        duration = distance * walk_factor
+        for node, edge in self.iter_node_edges(nodes):
+            if edge:
+                distance += edge.distance
+                duration += self.router.waytypes[edge.waytype].get_duration(edge, walk_factor)
+        return round(distance, 1), round(duration)
+
+    def serialize(self, locations, descriptions=None):
+        nodes, origin_distance, destination_distance = self.get_nodes()
+
+        items = deque()
         last_item = None
         walk_factor = self.options.walk_factor
         distance = origin_distance
         duration = origin_distance * walk_factor
-        for i, (node, edge) in enumerate(nodes):
-            if edge is None:
-                edge = self.router.edges[last_node, node] if last_node else None
+        for node, edge in self.iter_node_edges(nodes):
             node_obj = self.router.nodes[node] if isinstance(node, (int, np.int32, np.int64)) else node
             item = RouteItem(self, node_obj, edge, last_item)
             if edge:
@@ -71,7 +112,6 @@ class Route:
                 duration += item.router_waytype.get_duration(edge, walk_factor)
             items.append(item)
             last_item = item
-            last_node = node
 
         distance += destination_distance
         duration += destination_distance * walk_factor
@@ -185,15 +225,15 @@ class Route:
         options_summary = ', '.join(str(s) for s in options_summary)
 
         return OrderedDict((
-            ('origin', describe_location(self.origin, locations)),
-            ('destination', describe_location(self.destination, locations)),
+            ('origin', describe_location(self.origin, locations, descriptions)),
+            ('destination', describe_location(self.destination, locations, descriptions)),
             ('distance', round(distance, 2)),
             ('duration', round(duration)),
             ('distance_str', distance_str),
             ('duration_str', duration_str),
             ('summary', summary),
             ('options_summary', options_summary),
-            ('items', tuple(item.serialize(locations=locations) for item in items)),
+            ('items', tuple(item.serialize(locations=locations, descriptions=descriptions) for item in items)),
         ))
 
 
@@ -231,7 +271,7 @@ class RouteItem:
     def new_level(self):
         return not self.last_item or self.level.pk != self.last_item.level.pk
 
-    def serialize(self, locations):
+    def serialize(self, locations, descriptions=None):
         result = OrderedDict((
             ('id', self.node.pk),
             ('coordinates', (self.node.x, self.node.y, self.node.altitude)),
@@ -242,10 +282,10 @@ class RouteItem:
             result['waytype'] = self.waytype.serialize(detailed=False)
 
         if self.new_space:
-            result['space'] = describe_location(self.space, locations)
+            result['space'] = describe_location(self.space, locations, descriptions)
 
         if self.new_level:
-            result['level'] = describe_location(self.level, locations)
+            result['level'] = describe_location(self.level, locations, descriptions)
 
         result['descriptions'] = [(icon, instruction) for (icon, instruction) in self.descriptions]
         return result
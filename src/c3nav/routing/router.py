@@ -1,31 +1,37 @@
+import copy
+import heapq
 import logging
+import math
+import multiprocessing
 import operator
+import os
 import pickle
 from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from functools import reduce
-from itertools import chain
+from itertools import accumulate, chain
 from typing import Optional
 
 import numpy as np
+import shapely
 from django.conf import settings
-from django.core.cache import cache
 from django.utils.functional import cached_property
-from shapely import prepared
+from django.utils.translation import get_language
+from scipy.spatial import KDTree
+from shapely import STRtree, prepared
 from shapely.geometry import LineString, Point
 from shapely.ops import unary_union
 
 from c3nav.mapdata.models import AltitudeArea, Area, GraphEdge, Level, LocationGroup, MapUpdate, Space, WayType
 from c3nav.mapdata.models.geometry.space import POI, CrossDescription, LeaveDescription
 from c3nav.mapdata.models.locations import CustomLocationProxyMixin
+from c3nav.mapdata.utils.cache.artifacts import artifacts
 from c3nav.mapdata.utils.geometry import assert_multipolygon, get_rings, good_representative_point, unwrap_geom
 from c3nav.mapdata.utils.locations import CustomLocation
+from c3nav.routing.contraction import ContractionHierarchy
 from c3nav.routing.exceptions import LocationUnreachable, NoRouteFound, NotYetRoutable
 from c3nav.routing.route import Route
-
-try:
-    from asgiref.local import Local as LocalContext
-except ImportError:
-    from threading import local as LocalContext
+from c3nav.routing.utils.cache import LRUCache
 
 logger = logging.getLogger('c3nav')
 
@@ -33,24 +39,64 @@ logger = logging.getLogger('c3nav')
 class Router:
     filename = settings.CACHE_ROOT / 'router'
 
-    def __init__(self, levels, spaces, areas, pois, groups, restrictions, nodes, edges, waytypes, graph):
+    # serialized routes, location descriptions and compiled edge weights, shared by all threads
+    route_cache = LRUCache(settings.CACHE_SIZE_ROUTES)
+    description_cache = LRUCache(16)
+    weights_cache = LRUCache(settings.CACHE_SIZE_ROUTE_WEIGHTS)
+    # prefetched levels by pk, only set while rebuild() forks worker processes
+    _rebuild_levels = {}
+
+    def __init__(self, update, levels, spaces, areas, pois, groups, restrictions, waytypes, graph):
+        self.update = update
         self.levels = levels
         self.spaces = spaces
         self.areas = areas
         self.pois = pois
         self.groups = groups
         self.restrictions = restrictions
-        self.nodes = nodes
-        self.edges = edges
         self.waytypes = waytypes
         self.graph = graph
+        # nodes and edges are only stored as graph arrays, these create thin views for serializing routes
+        self.nodes = RouterNodes(graph)
+        self.edges = RouterEdges(graph)
+        self.contraction_hierarchy = None
+        self.nearest_tables = {}
+        # precomputed searches from popular origins, by RouterOriginTree.get_key()
+        self.origin_trees = {}
+        # interned restriction sets, by frozenset of restriction pks
+        self.restriction_sets = {}
+        # walking distance edge weights, by RouterRestrictionSet.cache_key
+        self.distance_weights = {}
+
+    def __getstate__(self):
+        result = self.__dict__.copy()
+        result.pop('restriction_sets', None)
+        result.pop('distance_weights', None)
+        return result
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.restriction_sets = {}
+        self.distance_weights = {}
 
     @staticmethod
     def get_altitude_in_areas(areas, point):
         return max(area.get_altitudes(point)[0] for area in areas if area.geometry_prep.intersects(point))
 
     @classmethod
-    def rebuild(cls, update):
+    def rebuild(cls, update, previous_update=None, changed_levels=None):
+        """
+        Build the router for the given update.
+        :param previous_update: update of an existing router that the data of unchanged levels can be reused from
+        :param changed_levels: pks of the levels with geometry changes since previous_update, None if unknown
+        """
+        previous = None
+        if previous_update is not None and changed_levels is not None:
+            try:
+                previous = cls.load_nocache(previous_update)
+            except FileNotFoundError:
+                logger.warning('Previous router not found, rebuilding all levels.')
+
         levels_query = Level.objects.prefetch_related('buildings', 'spaces', 'altitudeareas', 'groups',
                                                       'spaces__holes', 'spaces__columns', 'spaces__groups',
                                                       'spaces__obstacles', 'spaces__lineobstacles',
@@ -64,158 +110,63 @@ class Router:
         groups = {}
         restrictions = {}
         nodes = deque()
-        for level in levels_query:
-            buildings_geom = unary_union(tuple(unwrap_geom(building.geometry) for building in level.buildings.all()))
-
-            nodes_before_count = len(nodes)
 
-            for group in level.groups.all():
-                groups.setdefault(group.pk, {}).setdefault('levels', set()).add(level.pk)
-
-            if level.access_restriction_id:
-                restrictions.setdefault(level.access_restriction_id, RouterRestriction()).spaces.update(
-                    space.pk for space in level.spaces.all()
-                )
-
-            for space in level.spaces.all():
-                # create space geometries
-                accessible_geom = space.geometry.difference(unary_union(
-                    tuple(unwrap_geom(column.geometry)
-                          for column in space.columns.all()
-                          if column.access_restriction_id is None) +
-                    tuple(unwrap_geom(hole.geometry) for hole in space.holes.all()) +
-                    ((buildings_geom, ) if space.outside else ())
-                ))
-                obstacles_geom = unary_union(
-                    tuple(unwrap_geom(obstacle.geometry) for obstacle in space.obstacles.all()) +
-                    tuple(unwrap_geom(lineobstacle.buffered_geometry) for lineobstacle in space.lineobstacles.all())
-                )
-                clear_geom = unary_union(tuple(get_rings(accessible_geom.difference(obstacles_geom))))
-                clear_geom_prep = prepared.prep(clear_geom)
-
-                for group in space.groups.all():
-                    groups.setdefault(group.pk, {}).setdefault('spaces', set()).add(space.pk)
-
-                if space.access_restriction_id:
-                    restrictions.setdefault(space.access_restriction_id, RouterRestriction()).spaces.add(space.pk)
-
-                space_nodes = tuple(RouterNode.from_graph_node(node, i)
-                                    for i, node in enumerate(space.graphnodes.all()))
-                for i, node in enumerate(space_nodes, start=len(nodes)):
-                    node.i = i
-                nodes.extend(space_nodes)
-
-                space_obj = space
-                space = RouterSpace(space)
-                space.nodes = set(node.i for node in space_nodes)
-
-                for area in space_obj.areas.all():
-                    for group in area.groups.all():
-                        groups.setdefault(group.pk, {}).setdefault('areas', set()).add(area.pk)
-                    area._prefetched_objects_cache = {}
-
-                    area = RouterArea(area)
-                    area_nodes = tuple(node for node in space_nodes if area.geometry_prep.intersects(node.point))
-                    area.nodes = set(node.i for node in area_nodes)
-                    for node in area_nodes:
-                        node.areas.add(area.pk)
-                    if not area.nodes and space_nodes:
-                        nearest_node = min(space_nodes, key=lambda node: area.geometry.distance(node.point))
-                        area.nodes.add(nearest_node.i)
-                    areas[area.pk] = area
-                    space.areas.add(area.pk)
-
-                for area in level.altitudeareas.all():
-                    if not space.geometry_prep.intersects(unwrap_geom(area.geometry)):
-                        continue
-                    for subgeom in assert_multipolygon(accessible_geom.intersection(unwrap_geom(area.geometry))):
-                        if subgeom.is_empty:
-                            continue
-                        area_clear_geom = unary_union(tuple(get_rings(subgeom.difference(obstacles_geom))))
-                        if area_clear_geom.is_empty:
-                            continue
-                        area = RouterAltitudeArea(subgeom, area_clear_geom,
-                                                  area.altitude, area.points)
-                        area_nodes = tuple(node for node in space_nodes if area.geometry_prep.intersects(node.point))
-                        area.nodes = set(node.i for node in area_nodes)
-                        for node in area_nodes:
-                            altitude = area.get_altitude(node)
-                            if node.altitude is None or node.altitude < altitude:
-                                node.altitude = altitude
-
-                        space.altitudeareas.append(area)
-
-                for node in space_nodes:
-                    if node.altitude is not None:
-                        continue
-                    logger.warning('Node %d in space %d is not inside an altitude area' % (node.pk, space.pk))
-                    node_altitudearea = min(space.altitudeareas,
-                                            key=lambda a: a.geometry.distance(node.point), default=None)
-                    if node_altitudearea:
-                        node.altitude = node_altitudearea.get_altitude(node)
-                    else:
-                        node.altitude = float(level.base_altitude)
-                        logger.info('Space %d has no altitude areas' % space.pk)
-
-                for area in space.altitudeareas:
-                    # create fallback nodes
-                    if not area.nodes and space_nodes:
-                        fallback_point = good_representative_point(area.clear_geometry)
-                        fallback_node = RouterNode(None, None, fallback_point.x, fallback_point.y,
-                                                   space.pk, area.get_altitude(fallback_point))
-                        # todo: check waytypes here
-                        for node in space_nodes:
-                            line = LineString([(node.x, node.y), (fallback_node.x, fallback_node.y)])
-                            if line.length < 5 and not clear_geom_prep.intersects(line):
-                                area.fallback_nodes[node.i] = (
-                                    fallback_node,
-                                    RouterEdge(fallback_node, node, 0)
-                                )
-                        if not area.fallback_nodes:
-                            nearest_node = min(space_nodes, key=lambda node: fallback_point.distance(node.point))
-                            area.fallback_nodes[nearest_node.i] = (
-                                fallback_node,
-                                RouterEdge(fallback_node, nearest_node, 0)
-                            )
-
-                for poi in space_obj.pois.all():
-                    for group in poi.groups.all():
-                        groups.setdefault(group.pk, {}).setdefault('pois', set()).add(poi.pk)
-                    poi._prefetched_objects_cache = {}
-
-                    poi = RouterPoint(poi)
-                    try:
-                        altitudearea = space.altitudearea_for_point(poi.geometry)
-                        poi.altitude = altitudearea.get_altitude(poi.geometry)
-                        poi_nodes = altitudearea.nodes_for_point(poi.geometry, all_nodes=nodes)
-                    except LocationUnreachable:
-                        poi_nodes = {}
-                    poi.nodes = set(i for i in poi_nodes.keys())
-                    poi.nodes_addition = poi_nodes
-                    pois[poi.pk] = poi
-                    space.pois.add(poi.pk)
-
-                for column in space_obj.columns.all():
-                    if column.access_restriction_id is None:
-                        continue
-                    column.geometry_prep = prepared.prep(unwrap_geom(column.geometry))
-                    column_nodes = tuple(node for node in space_nodes if column.geometry_prep.intersects(node.point))
-                    column_nodes = set(node.i for node in column_nodes)
-                    restrictions.setdefault(column.access_restriction_id,
-                                            RouterRestriction()).additional_nodes.update(column_nodes)
-
-                space_obj._prefetched_objects_cache = {}
-
-                space.src.geometry = accessible_geom
-
-                spaces[space.pk] = space
+        # node indices are assigned in level order, so each level can be built on its own
+        levels_query = tuple(levels_query)
+        level_node_counts = tuple(sum(len(space.graphnodes.all()) for space in level.spaces.all())
+                                  for level in levels_query)
+        first_nodes = tuple(accumulate(level_node_counts[:-1], initial=0))
+        signatures = tuple(cls.get_level_signature(level) for level in levels_query)
+
+        # levels without geometry changes and with the same structure can be taken from the previous router
+        reuse = tuple(
+            previous is not None and level.pk not in changed_levels and level.pk in previous.levels
+            and getattr(previous.levels[level.pk], 'signature', None) == signature
+            for level, signature in zip(levels_query, signatures)
+        )
+        if previous is not None:
+            logger.info('Reusing %d of %d levels from the previous router.' % (sum(reuse), len(levels_query)))
+
+        build_levels = tuple(level for level, reused in zip(levels_query, reuse) if not reused)
+        build_first_nodes = tuple(first_node for first_node, reused in zip(first_nodes, reuse) if not reused)
+        # more processes than cpus only add overhead
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+        processes = min(settings.ROUTING_REBUILD_PROCESSES, len(build_levels), cpus)
+        if processes > 1:
+            # forked workers inherit the prefetched levels, so only their pks have to be sent to them
+            cls._rebuild_levels = {level.pk: level for level in build_levels}
+            try:
+                with ProcessPoolExecutor(max_workers=processes,
+                                         mp_context=multiprocessing.get_context('fork')) as executor:
+                    built = tuple(executor.map(cls.rebuild_level_by_pk, (level.pk for level in build_levels),
+                                               build_first_nodes))
+            finally:
+                cls._rebuild_levels = {}
+        else:
+            built = tuple(map(cls.rebuild_level, build_levels, build_first_nodes))
 
-            level_spaces = set(space.pk for space in level.spaces.all())
-            level._prefetched_objects_cache = {}
+        built = iter(built)
+        results = tuple(
+            cls.reuse_level(level, previous, first_node) if reused else next(built)
+            for level, first_node, reused in zip(levels_query, first_nodes, reuse)
+        )
 
-            level = RouterLevel(level, spaces=level_spaces)
-            level.nodes = set(range(nodes_before_count, len(nodes)))
+        # merge results in level order
+        for (level, level_spaces, level_areas, level_pois, level_groups, level_restrictions,
+             level_nodes), signature in zip(results, signatures):
+            level.signature = signature
             levels[level.pk] = level
+            spaces.update(level_spaces)
+            areas.update(level_areas)
+            pois.update(level_pois)
+            for pk, group in level_groups.items():
+                for name, pks in group.items():
+                    groups.setdefault(pk, {}).setdefault(name, set()).update(pks)
+            for pk, level_restriction in level_restrictions.items():
+                restriction = restrictions.setdefault(pk, RouterRestriction())
+                restriction.spaces.update(level_restriction.spaces)
+                restriction.additional_nodes.update(level_restriction.additional_nodes)
+            nodes.extend(level_nodes)
 
         # add graph descriptions
         for description in LeaveDescription.objects.all():
@@ -242,58 +193,465 @@ class Router:
                                  to_node=nodes[nodes_lookup[edge.to_node_id]],
                                  waytype=waytypes_lookup[edge.waytype_id],
                                  access_restriction=edge.access_restriction_id) for edge in GraphEdge.objects.all())
-        edges = {(edge.from_node, edge.to_node): edge for edge in edges}
-
-        # build graph matrix
-        graph = np.full(shape=(len(nodes), len(nodes)), fill_value=np.inf, dtype=np.float32)
-        for edge in edges.values():
-            index = (edge.from_node, edge.to_node)
-            graph[index] = edge.distance
-            waytype = waytypes[edge.waytype]
-            (waytype.upwards_indices if edge.rise > 0 else waytype.nonupwards_indices).append(index)
+        edges = tuple(sorted(edges, key=lambda edge: (edge.from_node, edge.to_node)))
+
+        # build sparse graph
+        graph = RouterGraph(nodes, edges)
+        for i, edge in enumerate(edges):
             if edge.access_restriction:
-                restrictions.setdefault(edge.access_restriction, RouterRestriction()).edges.append(index)
+                restrictions.setdefault(edge.access_restriction, RouterRestriction()).edges.append(i)
 
         # respect slow_down_factor
         for area in areas.values():
             if area.slow_down_factor != 1:
-                area_nodes = np.array(tuple(area.nodes), dtype=np.uint32)
-                graph[area_nodes.reshape((-1, 1)), area_nodes] *= float(area.slow_down_factor)
-
-        # finalize waytype matrixes
-        for waytype in waytypes:
-            waytype.upwards_indices = np.array(waytype.upwards_indices, dtype=np.uint32).reshape((-1, 2))
-            waytype.nonupwards_indices = np.array(waytype.nonupwards_indices, dtype=np.uint32).reshape((-1, 2))
+                area_nodes = graph.node_mask(area.nodes)
+                graph.weights[area_nodes[graph.from_nodes] & area_nodes[graph.to_nodes]] *= float(area.slow_down_factor)
 
-        # finalize restriction edge matrixes
+        # finalize restriction edge arrays
         for restriction in restrictions.values():
-            restriction.edges = np.array(restriction.edges, dtype=np.uint32).reshape((-1, 2))
-
-        router = cls(levels, spaces, areas, pois, groups, restrictions, nodes, edges, waytypes, graph)
+            restriction.edges = np.array(restriction.edges, dtype=np.uint32)
+
+        router = cls(update, levels, spaces, areas, pois, groups, restrictions, waytypes, graph)
+        if settings.ROUTING_NEAREST_GROUPS:
+            router.build_nearest_tables(settings.ROUTING_NEAREST_GROUPS)
+        graph.save_arrays(cls.build_graph_dirname(update))
+        # a contraction hierarchy or origin trees from a previous rebuild would not match the new graph
+        ContractionHierarchy.build_filename(update).unlink(missing_ok=True)
+        cls.build_origin_trees_filename(update).unlink(missing_ok=True)
         pickle.dump(router, open(cls.build_filename(update), 'wb'))
         return router
 
+    @classmethod
+    def rebuild_level_by_pk(cls, pk, first_node):
+        """
+        Build one of the levels that were prefetched before the worker processes were forked, see rebuild_level().
+        """
+        return cls.rebuild_level(cls._rebuild_levels[pk], first_node)
+
+    @classmethod
+    def rebuild_level(cls, level, first_node):
+        """
+        Build the router data of one level. Levels are independent, so this can run in a worker process.
+        :param level: Level with all related objects prefetched, this function does not query the database
+        :param first_node: index of the first graph node of this level
+        :return: (RouterLevel, spaces, areas, pois, groups, restrictions, nodes)
+        """
+        spaces = {}
+        areas = {}
+        pois = {}
+        groups = {}
+        restrictions = {}
+        nodes = deque()
+        buildings_geom = unary_union(tuple(unwrap_geom(building.geometry) for building in level.buildings.all()))
+
+        for group in level.groups.all():
+            groups.setdefault(group.pk, {}).setdefault('levels', set()).add(level.pk)
+
+        if level.access_restriction_id:
+            restrictions.setdefault(level.access_restriction_id, RouterRestriction()).spaces.update(
+                space.pk for space in level.spaces.all()
+            )
+
+        for space in level.spaces.all():
+            # create space geometries
+            accessible_geom = space.geometry.difference(unary_union(
+                tuple(unwrap_geom(column.geometry)
+                      for column in space.columns.all()
+                      if column.access_restriction_id is None) +
+                tuple(unwrap_geom(hole.geometry) for hole in space.holes.all()) +
+                ((buildings_geom, ) if space.outside else ())
+            ))
+            obstacles_geom = unary_union(
+                tuple(unwrap_geom(obstacle.geometry) for obstacle in space.obstacles.all()) +
+                tuple(unwrap_geom(lineobstacle.buffered_geometry) for lineobstacle in space.lineobstacles.all())
+            )
+            clear_geom = unary_union(tuple(get_rings(accessible_geom.difference(obstacles_geom))))
+            clear_geom_prep = prepared.prep(clear_geom)
+
+            for group in space.groups.all():
+                groups.setdefault(group.pk, {}).setdefault('spaces', set()).add(space.pk)
+
+            if space.access_restriction_id:
+                restrictions.setdefault(space.access_restriction_id, RouterRestriction()).spaces.add(space.pk)
+
+            space_nodes = tuple(RouterNode.from_graph_node(node, i)
+                                for i, node in enumerate(space.graphnodes.all()))
+            for i, node in enumerate(space_nodes, start=first_node+len(nodes)):
+                node.i = i
+            nodes.extend(space_nodes)
+
+            space_obj = space
+            space = RouterSpace(space)
+            space.nodes = set(node.i for node in space_nodes)
+
+            for area in space_obj.areas.all():
+                for group in area.groups.all():
+                    groups.setdefault(group.pk, {}).setdefault('areas', set()).add(area.pk)
+                area._prefetched_objects_cache = {}
+
+                area = RouterArea(area)
+                area_nodes = tuple(node for node in space_nodes if area.geometry_prep.intersects(node.point))
+                area.nodes = set(node.i for node in area_nodes)
+                if not area.nodes and space_nodes:
+                    nearest_node = min(space_nodes, key=lambda node: area.geometry.distance(node.point))
+                    area.nodes.add(nearest_node.i)
+                areas[area.pk] = area
+                space.areas.add(area.pk)
+
+            for area in level.altitudeareas.all():
+                if not space.geometry_prep.intersects(unwrap_geom(area.geometry)):
+                    continue
+                for subgeom in assert_multipolygon(accessible_geom.intersection(unwrap_geom(area.geometry))):
+                    if subgeom.is_empty:
+                        continue
+                    area_clear_geom = unary_union(tuple(get_rings(subgeom.difference(obstacles_geom))))
+                    if area_clear_geom.is_empty:
+                        continue
+                    area = RouterAltitudeArea(subgeom, area_clear_geom,
+                                              area.altitude, area.points)
+                    area_nodes = tuple(node for node in space_nodes if area.geometry_prep.intersects(node.point))
+                    area.set_nodes(area_nodes)
+                    for node in area_nodes:
+                        altitude = area.get_altitude(node)
+                        if node.altitude is None or node.altitude < altitude:
+                            node.altitude = altitude
+
+                    space.altitudeareas.append(area)
+
+            for node in space_nodes:
+                if node.altitude is not None:
+                    continue
+                logger.warning('Node %d in space %d is not inside an altitude area' % (node.pk, space.pk))
+                node_altitudearea = min(space.altitudeareas,
+                                        key=lambda a: a.geometry.distance(node.point), default=None)
+                if node_altitudearea:
+                    node.altitude = node_altitudearea.get_altitude(node)
+                else:
+                    node.altitude = float(level.base_altitude)
+                    logger.info('Space %d has no altitude areas' % space.pk)
+
+            for area in space.altitudeareas:
+                # create fallback nodes
+                if not area.nodes and space_nodes:
+                    fallback_point = good_representative_point(area.clear_geometry)
+                    fallback_node = RouterNode(None, None, fallback_point.x, fallback_point.y,
+                                               space.pk, area.get_altitude(fallback_point))
+                    # todo: check waytypes here
+                    for node in space_nodes:
+                        line = LineString([(node.x, node.y), (fallback_node.x, fallback_node.y)])
+                        if line.length < 5 and not clear_geom_prep.intersects(line):
+                            area.fallback_nodes[node.i] = (
+                                fallback_node,
+                                RouterEdge(fallback_node, node, 0)
+                            )
+                    if not area.fallback_nodes:
+                        nearest_node = min(space_nodes, key=lambda node: fallback_point.distance(node.point))
+                        area.fallback_nodes[nearest_node.i] = (
+                            fallback_node,
+                            RouterEdge(fallback_node, nearest_node, 0)
+                        )
+
+            for poi in space_obj.pois.all():
+                for group in poi.groups.all():
+                    groups.setdefault(group.pk, {}).setdefault('pois', set()).add(poi.pk)
+                poi._prefetched_objects_cache = {}
+
+                poi = RouterPoint(poi)
+                try:
+                    altitudearea = space.altitudearea_for_point(poi.geometry)
+                    poi.altitude = altitudearea.get_altitude(poi.geometry)
+                    poi_nodes = altitudearea.nodes_for_point(poi.geometry)
+                except LocationUnreachable:
+                    poi_nodes = {}
+                poi.nodes = set(i for i in poi_nodes.keys())
+                poi.nodes_addition = poi_nodes
+                pois[poi.pk] = poi
+                space.pois.add(poi.pk)
+
+            for column in space_obj.columns.all():
+                if column.access_restriction_id is None:
+                    continue
+                column.geometry_prep = prepared.prep(unwrap_geom(column.geometry))
+                column_nodes = tuple(node for node in space_nodes if column.geometry_prep.intersects(node.point))
+                column_nodes = set(node.i for node in column_nodes)
+                restrictions.setdefault(column.access_restriction_id,
+                                        RouterRestriction()).additional_nodes.update(column_nodes)
+
+            space_obj._prefetched_objects_cache = {}
+
+            space.src.geometry = accessible_geom
+
+            spaces[space.pk] = space
+
+        level_spaces = set(space.pk for space in level.spaces.all())
+        level._prefetched_objects_cache = {}
+
+        level = RouterLevel(level, spaces=level_spaces)
+        level.nodes = set(range(first_node, first_node+len(nodes)))
+        level.spaces_index = RouterGeometryIndex(spaces[pk] for pk in level_spaces)
+        level.areas_index = RouterGeometryIndex(areas[pk] for space in level_spaces for pk in spaces[space].areas)
+        level.pois_index = RouterGeometryIndex(pois[pk] for space in level_spaces for pk in spaces[space].pois)
+
+        return level, spaces, areas, pois, groups, restrictions, tuple(nodes)
+
+    @staticmethod
+    def get_level_signature(level):
+        """
+        Get everything besides geometries that the router data of this level depends on,
+        except for names, groups and access restrictions, which are taken from the database again when reusing it.
+        """
+        return (
+            float(level.base_altitude),
+            tuple(building.pk for building in level.buildings.all()),
+            tuple((area.pk, None if area.altitude is None else float(area.altitude),
+                   tuple((point.coordinates, point.altitude) for point in area.points) if area.points else None)
+                  for area in level.altitudeareas.all()),
+            tuple((space.pk, space.outside,
+                   tuple(node.pk for node in space.graphnodes.all()),
+                   tuple((column.pk, column.access_restriction_id) for column in space.columns.all()),
+                   tuple(hole.pk for hole in space.holes.all()),
+                   tuple(obstacle.pk for obstacle in space.obstacles.all()),
+                   tuple((obstacle.pk, float(obstacle.width)) for obstacle in space.lineobstacles.all()),
+                   tuple(area.pk for area in space.areas.all()),
+                   tuple(poi.pk for poi in space.pois.all()))
+                  for space in level.spaces.all()),
+        )
+
+    @classmethod
+    def reuse_level(cls, level, previous, first_node):
+        """
+        Take the router data of an unchanged level from the previous router, like rebuild_level() would build it.
+        Names, groups and access restrictions are taken from the given level, node indices are moved if needed.
+        :param level: Level with all related objects prefetched
+        :param previous: previous router
+        :param first_node: index of the first graph node of this level
+        :return: (RouterLevel, spaces, areas, pois, groups, restrictions, nodes)
+        """
+        spaces = {}
+        areas = {}
+        pois = {}
+        groups = {}
+        restrictions = {}
+
+        router_level = previous.levels[level.pk]
+        previous_first_node = min(router_level.nodes, default=first_node)
+        offset = first_node - previous_first_node
+        nodes = deque()
+        for i in range(previous_first_node, previous_first_node+len(router_level.nodes)):
+            node = previous.graph.get_node(i)
+            node.i += offset
+            nodes.append(node)
+
+        moved_edges = {}
+
+        def move_nodes(node_set):
+            return set(node+offset for node in node_set) if offset else node_set
+
+        def move_addition(addition):
+            # node additions are shared between altitude areas and points, so are their fallback edges
+            if not offset:
+                return addition
+            result = {}
+            for node, (fallback_node, fallback_edge) in addition.items():
+                if fallback_edge is not None:
+                    moved_edge = moved_edges.get(id(fallback_edge))
+                    if moved_edge is None:
+                        moved_edge = copy.copy(fallback_edge)
+                        moved_edge.to_node += offset
+                        moved_edges[id(fallback_edge)] = moved_edge
+                    fallback_edge = moved_edge
+                result[node+offset] = (fallback_node, fallback_edge)
+            return result
+
+        for group in level.groups.all():
+            groups.setdefault(group.pk, {}).setdefault('levels', set()).add(level.pk)
+
+        if level.access_restriction_id:
+            restrictions.setdefault(level.access_restriction_id, RouterRestriction()).spaces.update(
+                space.pk for space in level.spaces.all()
+            )
+
+        # nodes inside of restricted columns
+        for pk, restriction in previous.restrictions.items():
+            column_nodes = restriction.additional_nodes & router_level.nodes
+            if column_nodes:
+                restrictions.setdefault(pk, RouterRestriction()).additional_nodes.update(move_nodes(column_nodes))
+
+        for space_obj in level.spaces.all():
+            for group in space_obj.groups.all():
+                groups.setdefault(group.pk, {}).setdefault('spaces', set()).add(space_obj.pk)
+
+            if space_obj.access_restriction_id:
+                restrictions.setdefault(space_obj.access_restriction_id, RouterRestriction()).spaces.add(space_obj.pk)
+
+            space = previous.spaces[space_obj.pk]
+            space.nodes = move_nodes(space.nodes)
+            space.leave_descriptions = {}
+            space.cross_descriptions = {}
+
+            for area in space.altitudeareas:
+                area.nodes = move_nodes(area.nodes)
+                if area.nodes_index is not None:
+                    area.nodes_index = (area.nodes_index.astype(np.int64) + offset).astype(np.uint32)
+                area.fallback_nodes = move_addition(area.fallback_nodes)
+
+            for area_obj in space_obj.areas.all():
+                for group in area_obj.groups.all():
+                    groups.setdefault(group.pk, {}).setdefault('areas', set()).add(area_obj.pk)
+                area_obj._prefetched_objects_cache = {}
+
+                area = previous.areas[area_obj.pk]
+                area.src = area_obj
+                area.nodes = move_nodes(area.nodes)
+                areas[area.pk] = area
+
+            for poi_obj in space_obj.pois.all():
+                for group in poi_obj.groups.all():
+                    groups.setdefault(group.pk, {}).setdefault('pois', set()).add(poi_obj.pk)
+                poi_obj._prefetched_objects_cache = {}
+
+                poi = previous.pois[poi_obj.pk]
+                poi.src = poi_obj
+                poi.nodes = move_nodes(poi.nodes)
+                poi.nodes_addition = move_addition(poi.nodes_addition)
+                pois[poi.pk] = poi
+
+            space_obj._prefetched_objects_cache = {}
+
+            space_obj.geometry = space.src.geometry
+            space.src = space_obj
+
+            spaces[space.pk] = space
+
+        level._prefetched_objects_cache = {}
+
+        router_level.src = level
+        router_level.nodes = move_nodes(router_level.nodes)
+
+        return router_level, spaces, areas, pois, groups, restrictions, tuple(nodes)
+
     @classmethod
     def build_filename(cls, update):
         return settings.CACHE_ROOT / MapUpdate.build_cache_key(*update) / 'router.pickle'
 
+    @classmethod
+    def build_graph_dirname(cls, update):
+        return settings.CACHE_ROOT / MapUpdate.build_cache_key(*update) / 'router_graph'
+
     @classmethod
     def load_nocache(cls, update):
-        return pickle.load(open(cls.build_filename(update), 'rb'))
+        router = pickle.load(open(cls.build_filename(update), 'rb'))
+        router.graph.load_arrays(cls.build_graph_dirname(update))
+        router.contraction_hierarchy = ContractionHierarchy.load_nocache(update)
+        try:
+            router.origin_trees = pickle.load(open(cls.build_origin_trees_filename(update), 'rb'))
+        except FileNotFoundError:
+            pass
+        return router
 
-    cached = LocalContext()
+    @classmethod
+    def build_origin_trees_filename(cls, update):
+        return settings.CACHE_ROOT / MapUpdate.build_cache_key(*update) / 'router_origin_trees.pickle'
+
+    @staticmethod
+    def get_profile(options, restrictions):
+        """
+        get a hashable representation of the route options and restriction set, to match precomputed data
+        """
+        return options.serialize_string(), frozenset(restrictions.restrictions.keys())
+
+    def get_default_profile(self):
+        """
+        get the default route options and the public restriction set, which is what most route requests use
+        :return: (options, restrictions)
+        """
+        from c3nav.mapdata.models.access import AccessRestriction
+        from c3nav.routing.models import RouteOptions
+        return RouteOptions(), self.get_restrictions(set(AccessRestriction.objects.filter(public=True)
+                                                         .values_list('pk', flat=True)))
+
+    def build_contraction_hierarchy(self, update):
+        """
+        Build a contraction hierarchy for the default profile. Other route requests still use the regular search.
+        """
+        options, restrictions = self.get_default_profile()
+        contraction_hierarchy = ContractionHierarchy(self.graph, self.get_edge_weights(restrictions, options),
+                                                     profile=self.get_profile(options, restrictions))
+        contraction_hierarchy.save(update)
+        self.contraction_hierarchy = contraction_hierarchy
+        return contraction_hierarchy
 
-    class NoUpdate:
-        pass
+    @staticmethod
+    def get_popular_origins(count):
+        """
+        Get the locations that were requested as route origins the most, according to the api stats.
+        Custom locations are not included.
+        """
+        from c3nav.mapdata.models.locations import LocationSlug
+        from c3nav.mapdata.utils.cache.stats import get_top_stats
+        pks = tuple(int(value) for value, num in get_top_stats('apistats__route_origin_') if value.isdigit())[:count]
+        locations = {location.pk: location.get_child() for location in LocationSlug.objects.filter(pk__in=pks)}
+        return tuple(locations[pk] for pk in pks if locations.get(pk) is not None)
+
+    def build_origin_trees(self, update, origins):
+        """
+        For each of the given origins, run a full search for the default profile and save the result for this update,
+        so routes from these origins can be looked up instead of searched.
+        """
+        options, restrictions = self.get_default_profile()
+        profile = self.get_profile(options, restrictions)
+        weights = self.get_edge_weights(restrictions, options)
+        cost_factor = 1 if options['mode'] == 'shortest' else 1 / options.walk_factor
+        origin_trees = {}
+        for origin in origins:
+            try:
+                sources = self.get_locations(origin, restrictions).get_node_costs(self.nodes, cost_factor)
+            except (NotYetRoutable, LocationUnreachable):
+                continue
+            distances, predecessors, best_target = self.graph.dijkstra(weights, sources=sources)
+            origin_trees[RouterOriginTree.get_key(profile, sources)] = RouterOriginTree(
+                self.graph.num_nodes, distances, predecessors, profile=profile
+            )
+        pickle.dump(origin_trees, open(self.build_origin_trees_filename(update), 'wb'))
+        self.origin_trees = origin_trees
+        return origin_trees
+
+    def build_nearest_tables(self, groups):
+        """
+        For each of the given location groups, run a reverse search from all its members for the default profile,
+        so routes to the nearest member of these groups can be looked up instead of searched.
+        """
+        options, restrictions = self.get_default_profile()
+        profile = self.get_profile(options, restrictions)
+        weights = self.get_edge_weights(restrictions, options)
+        cost_factor = 1 if options['mode'] == 'shortest' else 1 / options.walk_factor
+        for group in LocationGroup.objects.filter(pk__in=groups):
+            try:
+                members = self.get_locations(group, restrictions)
+            except (NotYetRoutable, LocationUnreachable):
+                continue
+            distances, predecessors, best_target = self.graph.dijkstra(
+                weights, sources=members.get_node_costs(self.nodes, cost_factor), reverse=True
+            )
+            self.nearest_tables[group.pk] = RouterNearestTable(self.graph.num_nodes, distances, predecessors,
+                                                               profile=profile)
 
     @classmethod
     def load(cls):
         from c3nav.mapdata.models import MapUpdate
         update = MapUpdate.last_processed_update()
-        if getattr(cls.cached, 'update', cls.NoUpdate) != update:
-            cls.cached.update = update
-            cls.cached.data = cls.load_nocache(update)
-        return cls.cached.data
+
+        def load():
+            router = cls.load_nocache(update)
+            # cached routes are only valid for the router they were found with
+            cls.route_cache.clear()
+            cls.description_cache.clear()
+            cls.weights_cache.clear()
+            return router
+
+        return artifacts.get('router', update, load, files=(cls.build_filename(update),
+                                                            cls.build_graph_dirname(update),
+                                                            ContractionHierarchy.build_filename(update)))
 
     def get_locations(self, location, restrictions):
         locations = ()
@@ -341,11 +699,11 @@ class Router:
                 raise LocationUnreachable
             altitudearea = space.altitudearea_for_point(point)
             location.altitude = altitudearea.get_altitude(point)
-            location_nodes = altitudearea.nodes_for_point(point, all_nodes=self.nodes)
+            location_nodes = altitudearea.nodes_for_point(point)
             location.nodes = set(i for i in location_nodes.keys())
             location.nodes_addition = location_nodes
             locations = tuple((location, ))
-        result = RouterLocation(locations)
+        result = RouterLocation(locations, group=location.pk if isinstance(location, LocationGroup) else None)
         if not result.nodes:
             raise LocationUnreachable
         return result
@@ -354,21 +712,45 @@ class Router:
         point = Point(point.x, point.y)
         level = self.levels[level]
         excluded_spaces = restrictions.spaces if restrictions else ()
-        for space in level.spaces:
-            if space in excluded_spaces:
-                continue
-            if self.spaces[space].geometry_prep.contains(point):
+        for space in level.spaces_index.containing(point):
+            if space not in excluded_spaces:
                 return self.spaces[space]
-        spaces = (self.spaces[space] for space in level.spaces if space not in excluded_spaces)
-        spaces = ((space, space.geometry.distance(point)) for space in spaces)
-        spaces = tuple((space, distance) for space, distance in spaces if distance < 20)
+        spaces = tuple((space, distance) for space, distance in level.spaces_index.nearby(point, 20)
+                       if space not in excluded_spaces)
         if not spaces:
             return None
-        return min(spaces, key=operator.itemgetter(1))[0]
+        return self.spaces[min(spaces, key=operator.itemgetter(1))[0]]
 
     def altitude_for_point(self, space: int, point: Point) -> float:
         return self.spaces[space].altitudearea_for_point(point).get_altitude(point)
 
+    def level_for_point_altitude(self, point, altitude, restrictions=None) -> Optional['RouterLevel']:
+        """
+        Get the level whose ground altitude at this point is closest to the given altitude,
+        e.g. to find out which level a trilaterated position is on.
+        Spaces containing the point are considered first, if there are none, spaces up to 20 meters away.
+        """
+        point = Point(point.x, point.y)
+        excluded_spaces = restrictions.spaces if restrictions else ()
+        for get_spaces in (lambda level: level.spaces_index.containing(point),
+                           lambda level: (space for space, distance in level.spaces_index.nearby(point, 20))):
+            best_level = None
+            best_difference = np.inf
+            for level in self.levels.values():
+                for space in get_spaces(level):
+                    if space in excluded_spaces:
+                        continue
+                    try:
+                        difference = abs(self.altitude_for_point(space, point) - altitude)
+                    except LocationUnreachable:
+                        continue
+                    if difference < best_difference:
+                        best_level = level
+                        best_difference = difference
+            if best_level is not None:
+                return best_level
+        return None
+
     def describe_custom_location(self, location):
         restrictions = self.get_restrictions(location.permissions)
         space = self.space_for_point(level=location.level.pk, point=location, restrictions=restrictions)
@@ -379,11 +761,12 @@ class Router:
             altitude = space.altitudearea_for_point(location).get_altitude(location)
         except LocationUnreachable:
             altitude = None
+        level = self.levels[location.level.pk]
         areas, near_area, nearby_areas = space.areas_for_point(
-            areas=self.areas, point=location, restrictions=restrictions
+            areas=self.areas, point=location, restrictions=restrictions, index=level.areas_index
         )
         near_poi, nearby_pois = space.poi_for_point(
-            pois=self.pois, point=location, restrictions=restrictions
+            pois=self.pois, point=location, restrictions=restrictions, index=level.pois_index
         )
         nearby = tuple(sorted(
             tuple(location for location in nearby_areas+nearby_pois if location[0].can_search),
@@ -398,91 +781,109 @@ class Router:
         return CustomLocationDescription(space=space, altitude=altitude,
                                          areas=areas, near_area=near_area, near_poi=near_poi, nearby=nearby)
 
-    @cached_property
-    def shortest_path_func(self):
-        # this is effectively a lazy import to save memory… todo: do we need that?
-        from scipy.sparse.csgraph import shortest_path
-        return shortest_path
-
-    def shortest_path(self, restrictions, options):
-        options_key = options.serialize_string()
-        cache_key = 'router:shortest_path:%s:%s:%s' % (MapUpdate.current_processed_cache_key(),
-                                                       restrictions.cache_key,
-                                                       options_key)
-        result = cache.get(cache_key)
-        if result:
-            distances, predecessors = result
-            return (np.frombuffer(distances, dtype=np.float64).reshape(self.graph.shape),
-                    np.frombuffer(predecessors, dtype=np.int32).reshape(self.graph.shape))
-
-        graph = self.graph.copy()
+    def get_weights(self, restrictions, options, penalties=True):
+        """
+        Get the compiled edge weights for these route options and restrictions, using the weights cache.
+        :param penalties: see get_edge_weights()
+        """
+        cache_key = (MapUpdate.build_cache_key(*self.update), self.get_profile(options, restrictions), penalties)
+        weights = self.weights_cache.get(cache_key)
+        if weights is None:
+            weights = RouterWeights(self.graph, self.get_edge_weights(restrictions, options, penalties=penalties))
+            self.weights_cache.set(cache_key, weights)
+        return weights
+
+    def get_edge_weights(self, restrictions, options, penalties=True):
+        """
+        :param penalties: make avoided waytypes and restrictions very expensive and preferred restrictions cheap.
+                          if False, avoided ones are excluded instead and preferring is ignored,
+                          so the weights stay seconds or meters, e.g. to use them as a cost limit.
+        """
+        graph = self.graph
+        weights = graph.weights.copy()
 
         # speeds of waytypes, if relevant
         if options['mode'] == 'fastest':
-            self.waytypes[0].speed = 1
-            self.waytypes[0].speed_up = 1
-            self.waytypes[0].extra_seconds = 0
-            self.waytypes[0].walk = True
-
-            for waytype in self.waytypes:
-                speed = float(waytype.speed)
-                speed_up = float(waytype.speed_up)
-                if waytype.walk:
-                    speed *= options.walk_factor
-                    speed_up *= options.walk_factor
-
-                for indices, dir_speed in ((waytype.nonupwards_indices, speed), (waytype.upwards_indices, speed_up)):
-                    indices = tuple(indices.transpose().tolist())
-                    values = graph[indices]
-                    values /= dir_speed
-                    if waytype.extra_seconds:
-                        values += int(waytype.extra_seconds)
-                    graph[indices] = values
+            speed = np.ones((len(self.waytypes), ), dtype=np.float32)
+            speed_up = np.ones((len(self.waytypes), ), dtype=np.float32)
+            extra_seconds = np.zeros((len(self.waytypes), ), dtype=np.float32)
+            walk = np.ones((len(self.waytypes), ), dtype=np.bool_)
+            for i, waytype in enumerate(self.waytypes[1:], start=1):
+                speed[i] = float(waytype.speed)
+                speed_up[i] = float(waytype.speed_up)
+                extra_seconds[i] = int(waytype.extra_seconds)
+                walk[i] = waytype.walk
+            speed[walk] *= options.walk_factor
+            speed_up[walk] *= options.walk_factor
+
+            weights /= np.where(graph.upwards, speed_up[graph.waytypes], speed[graph.waytypes])
+            weights += extra_seconds[graph.waytypes]
 
         # avoid waytypes as specified in settings
-        for waytype in self.waytypes[1:]:
+        avoided = np.zeros(weights.shape, dtype=np.bool_)
+        for i, waytype in enumerate(self.waytypes[1:], start=1):
             value = options.get('waytype_%s' % waytype.pk, 'allow')
             if value in ('avoid', 'avoid_up'):
-                graph[tuple(waytype.upwards_indices.transpose().tolist())] *= 100000
+                avoided |= (graph.waytypes == i) & graph.upwards
             if value in ('avoid', 'avoid_down'):
-                graph[tuple(waytype.nonupwards_indices.transpose().tolist())] *= 100000
+                avoided |= (graph.waytypes == i) & ~graph.upwards
+        if penalties:
+            weights[avoided] *= 100000
+        else:
+            weights[avoided] = np.inf
 
         # prefer/avoid restrictions
         restrictions_setting = options.get("restrictions", "normal")
-        if restrictions_setting != "normal":
-            if restrictions_setting == "avoid":
-                factor = 100000
+        if restrictions_setting != "normal" and (penalties or restrictions_setting == "avoid"):
+            space_nodes = self.get_restrictions(()).space_node_mask
+            additional_nodes = restrictions.additional_node_mask
+            exponents = (space_nodes[graph.from_nodes].astype(np.int8) + space_nodes[graph.to_nodes] +
+                         additional_nodes[graph.from_nodes] + additional_nodes[graph.to_nodes])
+            exponents += restrictions.edge_mask
+            if not penalties:
+                weights[exponents > 0] = np.inf
             else:
-                graph *= 100000
-                factor = 1/100000
-            all_restrictions = RouterRestrictionSet(self.restrictions)
-            space_nodes = tuple(reduce(operator.or_, (self.spaces[space].nodes
-                                                      for space in all_restrictions.spaces), set()))
-            graph[space_nodes, :] *= factor
-            graph[:, space_nodes] *= factor
-            if restrictions.additional_nodes:
-                graph[tuple(restrictions.additional_nodes), :] *= factor
-                graph[:, tuple(restrictions.additional_nodes)] *= factor
-            graph[tuple(restrictions.edges.transpose().tolist())] *= factor
+                if restrictions_setting == "avoid":
+                    factor = 100000
+                else:
+                    weights *= 100000
+                    factor = 1/100000
+                weights *= np.float32(factor) ** exponents
 
         # exclude spaces and edges
-        space_nodes = tuple(reduce(operator.or_, (self.spaces[space].nodes for space in restrictions.spaces), set()))
-        graph[space_nodes, :] = np.inf
-        graph[:, space_nodes] = np.inf
-        if restrictions.additional_nodes:
-            graph[tuple(restrictions.additional_nodes), :] = np.inf
-            graph[:, tuple(restrictions.additional_nodes)] = np.inf
-        graph[tuple(restrictions.edges.transpose().tolist())] = np.inf
-
-        distances, predecessors = self.shortest_path_func(graph, directed=True, return_predecessors=True)
-        cache.set(cache_key, (distances.astype(np.float64).tobytes(),
-                              predecessors.astype(np.int32).tobytes()), 600)
-        return distances, predecessors
+        excluded_nodes = restrictions.node_mask
+        weights[excluded_nodes[graph.from_nodes] | excluded_nodes[graph.to_nodes] | restrictions.edge_mask] = np.inf
+
+        return weights
+
+    def get_distance_weights(self, restrictions):
+        """
+        Get edge weights that are just the distance, with everything excluded that these restrictions forbid.
+        Unlike get_weights(), these don't depend on any route options.
+        """
+        weights = self.distance_weights.get(restrictions.cache_key)
+        if weights is None:
+            graph = self.graph
+            weights = graph.distances.copy()
+            excluded_nodes = restrictions.node_mask
+            weights[excluded_nodes[graph.from_nodes] | excluded_nodes[graph.to_nodes] | restrictions.edge_mask] = np.inf
+            weights.flags.writeable = False
+            weights = self.distance_weights.setdefault(restrictions.cache_key, weights)
+        return weights
 
     def get_restrictions(self, permissions):
-        return RouterRestrictionSet({
-            pk: restriction for pk, restriction in self.restrictions.items() if pk not in permissions
-        })
+        """
+        Get the restriction set that applies despite these permissions.
+        Restriction sets are interned for as long as this router is loaded, so their masks are only built once.
+        """
+        key = frozenset(pk for pk in self.restrictions.keys() if pk not in permissions)
+        restrictions = self.restriction_sets.get(key)
+        if restrictions is None:
+            restrictions = self.restriction_sets.setdefault(key, RouterRestrictionSet(
+                {pk: restriction for pk, restriction in self.restrictions.items() if pk in key},
+                spaces=self.spaces, graph=self.graph,
+            ))
+        return restrictions
 
     def get_route(self, origin, destination, permissions, options):
         restrictions = self.get_restrictions(permissions)
@@ -491,33 +892,178 @@ class Router:
         origins = self.get_locations(origin, restrictions)
         destinations = self.get_locations(destination, restrictions)
 
-        # calculate shortest path matrix
-        distances, predecessors = self.shortest_path(restrictions, options=options)
+        return self.get_route_for_locations(origins, destinations, restrictions, options)
 
-        # find shortest path for our origins and destinations
-        origin_nodes = np.array(tuple(origins.nodes))
-        destination_nodes = np.array(tuple(destinations.nodes))
-        origin_node, destination_node = np.unravel_index(
-            distances[origin_nodes.reshape((-1, 1)), destination_nodes].argmin(),
-            (len(origin_nodes), len(destination_nodes))
+    def get_serialized_route(self, origin, destination, permissions, options, locations, locations_cache_key):
+        """
+        Get a route and serialize it, using the route cache.
+        :param locations: visible locations, used to describe the route
+        :param locations_cache_key: cache key for the visible locations, like AccessPermission.cache_key_for_request()
+        """
+        restrictions = self.get_restrictions(permissions)
+        origins = self.get_locations(origin, restrictions)
+        destinations = self.get_locations(destination, restrictions)
+
+        # positions move, everything else depends only on what is in the key
+        cache_key = None
+        if not isinstance(origin, CustomLocationProxyMixin) and not isinstance(destination, CustomLocationProxyMixin):
+            cache_key = (MapUpdate.build_cache_key(*self.update), get_language(), locations_cache_key,
+                         origin.pk, destination.pk, origins.nodes, destinations.nodes,
+                         options.serialize_string(), restrictions.cache_key)
+            result = self.route_cache.get(cache_key)
+            if result is not None:
+                return result
+
+        result = self.get_route_for_locations(origins, destinations, restrictions, options).serialize(
+            locations, descriptions=self.get_location_descriptions(locations_cache_key)
         )
-        origin_node = origin_nodes[origin_node]
-        destination_node = destination_nodes[destination_node]
+        if cache_key is not None:
+            self.route_cache.set(cache_key, result)
+        return result
 
-        if distances[origin_node, destination_node] == np.inf:
+    def get_location_descriptions(self, locations_cache_key):
+        """
+        Get the LRUCache to memoize serialized location descriptions in for Route.serialize().
+        :param locations_cache_key: cache key for the visible locations, like AccessPermission.cache_key_for_request()
+        """
+        cache_key = (MapUpdate.build_cache_key(*self.update), get_language(), locations_cache_key)
+        descriptions = self.description_cache.get(cache_key)
+        if descriptions is None:
+            descriptions = LRUCache(settings.CACHE_SIZE_LOCATION_DESCRIPTIONS)
+            self.description_cache.set(cache_key, descriptions)
+        return descriptions
+
+    def get_route_for_locations(self, origins, destinations, restrictions, options):
+        # get the costs to get from the locations to their nodes
+        cost_factor = 1 if options['mode'] == 'shortest' else 1 / options.walk_factor
+        origin_costs = origins.get_node_costs(self.nodes, cost_factor)
+        destination_costs = destinations.get_node_costs(self.nodes, cost_factor)
+
+        # search from all origin nodes at once until the best destination node is found
+        profile = self.get_profile(options, restrictions)
+        nearest_table = self.nearest_tables.get(destinations.group)
+        origin_tree = None
+        if self.origin_trees:
+            origin_tree = self.origin_trees.get(RouterOriginTree.get_key(profile, origin_costs))
+        contraction_hierarchy = self.contraction_hierarchy
+        if nearest_table is not None and nearest_table.profile == profile:
+            path_nodes = nearest_table.get_path(sources=origin_costs)
+        elif origin_tree is not None:
+            path_nodes = origin_tree.get_path(targets=destination_costs)
+        elif contraction_hierarchy is not None and contraction_hierarchy.profile == profile:
+            path_nodes = contraction_hierarchy.shortest_path(sources=origin_costs, targets=destination_costs)
+        else:
+            weights = self.get_weights(restrictions, options)
+            path_nodes = self.graph.shortest_path(weights.weights, sources=origin_costs, targets=destination_costs,
+                                                  heuristic_factor=weights.heuristic_factor,
+                                                  reverse_weights=weights.reverse_weights)
+        if path_nodes is None:
             raise NoRouteFound
+        return self.get_route_for_path(origins, destinations, path_nodes, options)
 
-        # get best origin and destination
-        origin = origins.get_location_for_node(origin_node)
-        destination = destinations.get_location_for_node(destination_node)
+    def get_routes(self, origin, destinations, permissions, options):
+        """
+        Get routes from one origin to many destinations with a single search.
+        :return: list containing a Route or the routing exception for each destination
+        """
+        restrictions = self.get_restrictions(permissions)
+        origins = self.get_locations(origin, restrictions)
+        cost_factor = 1 if options['mode'] == 'shortest' else 1 / options.walk_factor
+        origin_costs = origins.get_node_costs(self.nodes, cost_factor)
+
+        results = []
+        destination_costs = []
+        for destination in destinations:
+            try:
+                destination = self.get_locations(destination, restrictions)
+            except (NotYetRoutable, LocationUnreachable) as e:
+                results.append(e)
+                destination_costs.append(None)
+                continue
+            results.append(destination)
+            destination_costs.append(destination.get_node_costs(self.nodes, cost_factor))
+
+        # search from all origin nodes until all destination nodes are found
+        targets = {}
+        for costs in destination_costs:
+            for node, cost in (costs or {}).items():
+                targets[node] = min(cost, targets.get(node, np.inf))
+        distances, predecessors, best_target = self.graph.dijkstra(self.get_weights(restrictions, options).weights,
+                                                                   sources=origin_costs, targets=targets,
+                                                                   all_targets=True)
+
+        for i, (destination_results, costs) in enumerate(zip(results, destination_costs)):
+            if costs is None:
+                continue
+            reached = tuple((distances[node] + cost, node) for node, cost in costs.items() if node in distances)
+            if not reached:
+                results[i] = NoRouteFound()
+                continue
+            cost, destination_node = min(reached)
+            results[i] = self.get_route_for_path(origins, destination_results,
+                                                 self.graph.get_path(predecessors, destination_node), options)
+        return results
+
+    def get_reachable(self, origin, permissions, options, max_cost, geometries=False):
+        """
+        Get all spaces, areas and POIs that can be reached from the origin within the given cost,
+        which is the duration in seconds for the fastest route mode and the distance in meters for the shortest.
+        :param geometries: also build a geometry of all reachable altitude areas for each level
+        """
+        restrictions = self.get_restrictions(permissions)
+        origins = self.get_locations(origin, restrictions)
+        cost_factor = 1 if options['mode'] == 'shortest' else 1 / options.walk_factor
+        # penalties would scale the costs away from seconds or meters, so avoided edges are excluded instead
+        weights = self.get_weights(restrictions, options, penalties=False).weights
+        distances, predecessors, best_target = self.graph.dijkstra(weights,
+                                                                   sources=origins.get_node_costs(self.nodes,
+                                                                                                  cost_factor),
+                                                                   limit=max_cost)
+
+        def get_cost(location):
+            return min((distances[node] + location.get_distance_to_node(node, self.nodes) * cost_factor
+                        for node in location.nodes if node in distances), default=np.inf)
+
+        reachable_spaces = {}
+        reachable_areas = {}
+        reachable_pois = {}
+        reached_nodes = np.fromiter(distances.keys(), dtype=np.uint32, count=len(distances))
+        for space in np.unique(self.graph.node_spaces[reached_nodes]).tolist():
+            if space in restrictions.spaces:
+                continue
+            space = self.spaces[space]
+            reachable_spaces[space.pk] = get_cost(space)
+            for locations, pks, result in ((self.areas, space.areas, reachable_areas),
+                                           (self.pois, space.pois, reachable_pois)):
+                for pk in pks:
+                    location = locations[pk]
+                    if location.access_restriction_id in restrictions:
+                        continue
+                    cost = get_cost(location)
+                    if cost <= max_cost:
+                        result[pk] = cost
+
+        level_geometries = None
+        if geometries:
+            level_geometries = {}
+            for space in reachable_spaces.keys():
+                space = self.spaces[space]
+                level_geometries.setdefault(space.level_id, []).extend(
+                    area.geometry for area in space.altitudeareas
+                    if not (area.nodes or area.fallback_nodes.keys()).isdisjoint(distances.keys())
+                )
+            level_geometries = {level: unary_union(geoms) for level, geoms in level_geometries.items() if geoms}
+
+        return ReachableLocations(spaces=reachable_spaces, areas=reachable_areas, pois=reachable_pois,
+                                  geometries=level_geometries)
 
-        # recreate path
-        path_nodes = deque((destination_node, ))
-        last_node = destination_node
-        while last_node != origin_node:
-            last_node = predecessors[origin_node, last_node]
-            path_nodes.appendleft(last_node)
-        path_nodes = tuple(path_nodes)
+    def get_route_for_path(self, origins, destinations, path_nodes, options):
+        origin_node = path_nodes[0]
+        destination_node = path_nodes[-1]
+
+        # get best origin and destination
+        origin = origins.get_location_for_node(origin_node, self.nodes)
+        destination = destinations.get_location_for_node(destination_node, self.nodes)
 
         origin_addition = origin.nodes_addition.get(origin_node)
         destination_addition = destination.nodes_addition.get(destination_node)
@@ -530,6 +1076,9 @@ class Router:
                      origin_addition, destination_addition, origin_xyz, destination_xyz)
 
 
+ReachableLocations = namedtuple('ReachableLocations', ('spaces', 'areas', 'pois', 'geometries'))
+
+
 CustomLocationDescription = namedtuple('CustomLocationDescription', ('space', 'altitude',
                                                                      'areas', 'near_area', 'near_poi', 'nearby'))
 
@@ -544,6 +1093,9 @@ class BaseRouterProxy:
     def geometry_prep(self):
         return prepared.prep(unwrap_geom(self.src.geometry))
 
+    def get_distance_to_node(self, node, nodes):
+        return 0
+
     def __getstate__(self):
         result = self.__dict__.copy()
         result.pop('geometry_prep', None)
@@ -579,15 +1131,14 @@ class RouterSpace(BaseRouterProxy):
                 return area
         return min(self.altitudeareas, key=lambda area: area.geometry.distance(point))
 
-    def areas_for_point(self, areas, point, restrictions):
+    def areas_for_point(self, areas, point, restrictions, index):
         point = Point(point.x, point.y)
-        areas = {pk: area for pk, area in areas.items()
-                 if pk in self.areas and area.can_describe and area.access_restriction_id not in restrictions}
 
-        nearby = ((area, area.geometry.distance(point)) for area in areas.values())
-        nearby = tuple((area, distance) for area, distance in nearby if distance < 20)
+        nearby = tuple((areas[pk], distance) for pk, distance in index.nearby(point, 20)
+                       if pk in self.areas and areas[pk].can_describe
+                       and areas[pk].access_restriction_id not in restrictions)
 
-        contained = tuple(area for area in areas.values() if area.geometry_prep.contains(point))
+        contained = tuple(area for area, distance in nearby if area.geometry_prep.contains(point))
         if contained:
             return tuple(sorted(contained, key=lambda area: area.geometry.area)), None, nearby
 
@@ -596,13 +1147,12 @@ class RouterSpace(BaseRouterProxy):
             return (), None, nearby
         return (), min(near, key=operator.itemgetter(1))[0], nearby
 
-    def poi_for_point(self, pois, point, restrictions):
+    def poi_for_point(self, pois, point, restrictions, index):
         point = Point(point.x, point.y)
-        pois = {pk: poi for pk, poi in pois.items()
-                if pk in self.pois and poi.can_describe and poi.access_restriction_id not in restrictions}
 
-        nearby = ((poi, poi.geometry.distance(point)) for poi in pois.values())
-        nearby = tuple((poi, distance) for poi, distance in nearby if distance < 20)
+        nearby = tuple((pois[pk], distance) for pk, distance in index.nearby(point, 20)
+                       if pk in self.pois and pois[pk].can_describe
+                       and pois[pk].access_restriction_id not in restrictions)
 
         near = tuple((poi, distance) for poi, distance in nearby if distance < 5)
         if not near:
@@ -623,6 +1173,12 @@ class RouterPoint(BaseRouterProxy):
     def xyz(self):
         return np.array((self.x, self.y, self.altitude))
 
+    def get_distance_to_node(self, node, nodes):
+        fallback_node, fallback_edge = self.nodes_addition.get(node, None) or (None, None)
+        if fallback_node is None:
+            return np.linalg.norm(nodes[node].xyz - self.xyz)
+        return np.linalg.norm(fallback_node.xyz - self.xyz) + fallback_edge.distance
+
 
 class RouterAltitudeArea:
     def __init__(self, geometry, clear_geometry, altitude, points):
@@ -631,6 +1187,8 @@ class RouterAltitudeArea:
         self.altitude = altitude
         self.points = points
         self.nodes = frozenset()
+        self.nodes_index = None
+        self.nodes_tree = None
         self.fallback_nodes = {}
 
     @cached_property
@@ -645,22 +1203,31 @@ class RouterAltitudeArea:
         # noinspection PyTypeChecker,PyCallByClass
         return AltitudeArea.get_altitudes(self, (point.x, point.y))[0]
 
-    def nodes_for_point(self, point, all_nodes):
+    def set_nodes(self, nodes):
+        self.nodes = set(node.i for node in nodes)
+        if nodes:
+            # node indices and kd-tree over the node coordinates in the same order
+            self.nodes_index = np.array(tuple(node.i for node in nodes), dtype=np.uint32)
+            self.nodes_tree = KDTree(np.array(tuple((node.x, node.y) for node in nodes), dtype=np.float64))
+
+    def nodes_for_point(self, point):
         point = Point(point.x, point.y)
 
-        nodes = {}
-        if self.nodes:
-            for node in self.nodes:
-                node = all_nodes[node]
-                line = LineString([(node.x, node.y), (point.x, point.y)])
-                if line.length < 10 and not self.clear_geometry_prep.intersects(line):
-                    nodes[node.i] = (None, None)
-            if not nodes:
-                nearest_node = min(tuple(all_nodes[node] for node in self.nodes),
-                                   key=lambda node: point.distance(node.point))
-                nodes[nearest_node.i] = (None, None)
-        else:
-            nodes = self.fallback_nodes
+        if not self.nodes:
+            return self.fallback_nodes
+
+        # only nodes within 10 meters are candidates, check which ones can be reached in a straight line
+        candidates = np.array(sorted(self.nodes_tree.query_ball_point((point.x, point.y), 10)), dtype=np.int64)
+        candidates_xy = self.nodes_tree.data[candidates]
+        lines = shapely.linestrings(np.stack((candidates_xy, np.broadcast_to((point.x, point.y),
+                                                                             candidates_xy.shape)), axis=1))
+        shapely.prepare(self.clear_geometry)
+        reachable = (shapely.length(lines) < 10) & ~shapely.intersects(self.clear_geometry, lines)
+        nodes = {i: (None, None) for i in self.nodes_index[candidates[reachable]].tolist()}
+
+        if not nodes:
+            distance, nearest = self.nodes_tree.query((point.x, point.y))
+            nodes[int(self.nodes_index[nearest])] = (None, None)
         return nodes
 
     def __getstate__(self):
@@ -671,29 +1238,32 @@ class RouterAltitudeArea:
 
 
 class RouterNode:
-    def __init__(self, i, pk, x, y, space, altitude=None, areas=None):
+    __slots__ = ('i', 'pk', 'x', 'y', 'space', 'altitude')
+
+    def __init__(self, i, pk, x, y, space, altitude=None):
         self.i = i
         self.pk = pk
         self.x = x
         self.y = y
         self.space = space
         self.altitude = altitude
-        self.areas = areas if areas else set()
 
     @classmethod
     def from_graph_node(cls, node, i):
         return cls(i, node.pk, node.geometry.x, node.geometry.y, node.space_id)
 
-    @cached_property
+    @property
     def point(self):
         return Point(self.x, self.y)
 
-    @cached_property
+    @property
     def xyz(self):
         return np.array((self.x, self.y, self.altitude))
 
 
 class RouterEdge:
+    __slots__ = ('from_node', 'to_node', 'waytype', 'access_restriction', 'rise', 'distance')
+
     def __init__(self, from_node, to_node, waytype, access_restriction=None, rise=None, distance=None):
         self.from_node = from_node.i
         self.to_node = to_node.i
@@ -708,11 +1278,370 @@ class RouterEdge:
         self.distance = distance if distance is not None else np.linalg.norm(to_node.xyz - from_node.xyz)
 
 
+class RouterGeometryIndex:
+    """
+    STRtree of the geometries of some locations, to find the locations at or near a point in logarithmic time.
+    """
+    def __init__(self, locations):
+        locations = tuple(locations)
+        self.pks = tuple(location.pk for location in locations)
+        self.tree = STRtree(tuple(unwrap_geom(location.geometry) for location in locations))
+
+    def containing(self, point):
+        """
+        :return: pks of the locations that contain the given point
+        """
+        return tuple(self.pks[i] for i in sorted(self.tree.query(point, predicate='within').tolist()))
+
+    def nearby(self, point, max_distance):
+        """
+        :return: tuple of (pk, distance) for all locations closer than max_distance to the given point
+        """
+        indices = np.sort(self.tree.query(point, predicate='dwithin', distance=max_distance))
+        distances = shapely.distance(self.tree.geometries.take(indices), point)
+        return tuple((self.pks[i], d) for i, d in zip(indices.tolist(), distances.tolist()) if d < max_distance)
+
+
+class RouterNodes:
+    """
+    Read-only sequence of RouterNode views onto the graph arrays.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __len__(self):
+        return self.graph.num_nodes
+
+    def __getitem__(self, i):
+        return self.graph.get_node(i)
+
+
+class RouterEdges:
+    """
+    Read-only mapping of (from node, to node) to RouterEdge views onto the graph arrays.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getitem__(self, key):
+        return self.graph.get_edge(*key)
+
+
+class RouterGraph:
+    """
+    The routing graph as sparse edge columns, sorted by origin node so they can be used as a CSR matrix.
+    Memory usage is O(E) instead of O(N²).
+    The columns are not pickled, they are stored as .npy files and memory-mapped when loading,
+    so all worker processes share them through the page cache.
+    """
+    array_names = ('xyz', 'node_pks', 'node_spaces', 'from_nodes', 'to_nodes', 'distances', 'waytypes', 'rises',
+                   'access_restrictions', 'weights', 'indptr', 'reverse_order', 'reverse_from_nodes', 'reverse_indptr')
+
+    def __init__(self, nodes, edges):
+        self.num_nodes = num_nodes = len(nodes)
+        self.xyz = np.array(tuple(node.xyz for node in nodes), dtype=np.float64).reshape((-1, 3))
+        self.node_pks = np.array(tuple(node.pk for node in nodes), dtype=np.uint32)
+        self.node_spaces = np.array(tuple(node.space for node in nodes), dtype=np.uint32)
+        self.from_nodes = np.array(tuple(edge.from_node for edge in edges), dtype=np.uint32)
+        self.to_nodes = np.array(tuple(edge.to_node for edge in edges), dtype=np.uint32)
+        self.distances = np.array(tuple(edge.distance for edge in edges), dtype=np.float32)
+        self.waytypes = np.array(tuple(edge.waytype for edge in edges), dtype=np.uint16)
+        self.rises = np.array(tuple(np.nan if edge.rise is None else edge.rise for edge in edges), dtype=np.float32)
+        self.access_restrictions = np.array(tuple(edge.access_restriction or 0 for edge in edges), dtype=np.uint32)
+        # base weights, distance multiplied by slow down factors
+        self.weights = self.distances.copy()
+        self.indptr = np.zeros((num_nodes+1, ), dtype=np.uint32)
+        np.cumsum(np.bincount(self.from_nodes, minlength=num_nodes), out=self.indptr[1:])
+        # the same edges, sorted by destination node, for searching backwards
+        self.reverse_order = np.argsort(self.to_nodes, kind='stable').astype(np.uint32)
+        self.reverse_from_nodes = self.from_nodes[self.reverse_order]
+        self.reverse_indptr = np.zeros((num_nodes+1, ), dtype=np.uint32)
+        np.cumsum(np.bincount(self.to_nodes, minlength=num_nodes), out=self.reverse_indptr[1:])
+
+    def __getstate__(self):
+        result = self.__dict__.copy()
+        for name in self.array_names:
+            result.pop(name, None)
+        result.pop('xyz_list', None)
+        return result
+
+    def save_arrays(self, path):
+        path.mkdir(exist_ok=True)
+        for name in self.array_names:
+            np.save(path / ('%s.npy' % name), getattr(self, name))
+
+    def load_arrays(self, path):
+        for name in self.array_names:
+            # plain read-only ndarray views, because memmap slices are slow to create
+            setattr(self, name, np.load(path / ('%s.npy' % name), mmap_mode='r').view(np.ndarray))
+
+    def get_node(self, i):
+        x, y, altitude = self.xyz[i].tolist()
+        return RouterNode(int(i), int(self.node_pks[i]), x, y, int(self.node_spaces[i]), altitude)
+
+    def get_edge(self, from_node, to_node):
+        start, end = self.indptr[from_node], self.indptr[from_node+1]
+        matches = np.flatnonzero(self.to_nodes[start:end] == to_node)
+        if not matches.size:
+            raise KeyError((from_node, to_node))
+        # with duplicate edges, the last one wins, like it did when edges were stored in a dict
+        i = start + matches[-1]
+        return RouterEdge(self.get_node(from_node), self.get_node(to_node), waytype=int(self.waytypes[i]),
+                          access_restriction=int(self.access_restrictions[i]) or None)
+
+    @property
+    def upwards(self):
+        return self.rises > 0
+
+    def node_mask(self, nodes):
+        mask = np.zeros((self.num_nodes, ), dtype=np.bool_)
+        if nodes:
+            mask[np.fromiter(nodes, dtype=np.uint32)] = True
+        return mask
+
+    def dijkstra(self, weights, sources, targets=None, limit=np.inf, all_targets=False, reverse=False):
+        """
+        Multi-source dijkstra search, starting from all sources at once.
+        If targets are given, the search stops as soon as the best target has been found.
+        :param weights: edge weights, as returned by Router.get_edge_weights()
+        :param sources: dict of node → initial cost
+        :param targets: dict of node → additional cost to get from the node to the destination
+        :param limit: maximum cost, nodes beyond it will not be settled
+        :param all_targets: don't stop at the best target, continue until all targets have been found
+        :param reverse: search backwards, following edges in reverse direction
+        :return: (distances, predecessors, best target) with distances and predecessors as dicts of settled nodes
+        """
+        if all_targets and not targets:
+            return {}, {}, None
+        if reverse:
+            indptr, to_nodes, weights = self.reverse_indptr, self.reverse_from_nodes, weights[self.reverse_order]
+        else:
+            indptr, to_nodes = self.indptr, self.to_nodes
+        distances = {}
+        predecessors = {}
+        tentative = dict(sources)
+        heap = [(cost, node, -1) for node, cost in sources.items()]
+        heapq.heapify(heap)
+        remaining_targets = set(targets) if all_targets else None
+        best_target = None
+        best_cost = limit
+        while heap:
+            cost, node, predecessor = heapq.heappop(heap)
+            if node in distances:
+                continue
+            if cost > limit or (best_target is not None and not all_targets and cost >= best_cost):
+                break
+            distances[node] = cost
+            predecessors[node] = predecessor
+            if targets is not None and node in targets:
+                if cost + targets[node] < best_cost:
+                    best_target = node
+                    best_cost = cost + targets[node]
+                if all_targets:
+                    remaining_targets.discard(node)
+                    if not remaining_targets:
+                        break
+            start, end = indptr[node], indptr[node+1]
+            for next_node, weight in zip(to_nodes[start:end].tolist(), weights[start:end].tolist()):
+                next_cost = cost + weight
+                if next_cost < tentative.get(next_node, np.inf):
+                    tentative[next_node] = next_cost
+                    heapq.heappush(heap, (next_cost, next_node, node))
+        return distances, predecessors, best_target
+
+    def get_heuristic_factor(self, weights):
+        """
+        get the largest factor for euclidean distances that still never overestimates the edge weights.
+        this makes the euclidean distance an admissible and consistent heuristic for every route profile,
+        e.g. the inverse of the highest speed for the fastest route or the avoid/prefer multipliers.
+        """
+        usable = (self.distances > 0) & np.isfinite(weights)
+        if not usable.any():
+            return 0
+        # leave some room for float32 inaccuracies
+        return float(np.min(weights[usable] / self.distances[usable])) * 0.999
+
+    @cached_property
+    def xyz_list(self):
+        # plain python floats are a lot faster than numpy for single-node distance calculations
+        return self.xyz.tolist()
+
+    def _get_lower_bound_func(self, costs, factor):
+        # lower bound for the cost to get from a node to any of the given nodes with their costs (or vice versa)
+        if len(costs) > 8:
+            xyz = self.xyz[tuple(costs.keys()), :]
+            offsets = np.array(tuple(costs.values()), dtype=np.float64)
+
+            def lower_bound(point):
+                return float(np.min(np.linalg.norm(xyz - point, axis=1) * factor + offsets))
+            return lower_bound
+
+        xyz_list = self.xyz_list
+        points = tuple((xyz_list[node], cost) for node, cost in costs.items())
+        dist = math.dist
+        return lambda point: min(dist(point, other) * factor + cost for other, cost in points)
+
+    def _get_potential_func(self, sources, targets, factor):
+        # average of the lower bounds for the remaining cost to the targets and from the sources
+        xyz_list = self.xyz_list
+        to_target = self._get_lower_bound_func(targets, factor)
+        from_source = self._get_lower_bound_func(sources, factor)
+        cache = {}
+
+        def potential(node):
+            try:
+                return cache[node]
+            except KeyError:
+                point = xyz_list[node]
+                result = cache[node] = (to_target(point) - from_source(point)) / 2
+                return result
+        return potential
+
+    def bidirectional_astar(self, weights, sources, targets, heuristic_factor=None, reverse_weights=None):
+        """
+        Bidirectional A* search from any of the sources to any of the targets, using euclidean distances as
+        the heuristic. Both searches use the average of both potential functions, which keeps them consistent,
+        so the search can stop as soon as the two searches meet in the middle.
+        :param weights: edge weights, as returned by Router.get_edge_weights()
+        :param sources: dict of node → initial cost
+        :param targets: dict of node → additional cost to get from the node to the destination
+        :param heuristic_factor: factor for euclidean distances, as returned by get_heuristic_factor()
+        :param reverse_weights: edge weights in the order of the reverse edges
+        :return: tuple of nodes or None if there is no path
+        """
+        if heuristic_factor is None:
+            heuristic_factor = self.get_heuristic_factor(weights)
+        potential = self._get_potential_func(sources, targets, heuristic_factor)
+
+        if reverse_weights is None:
+            reverse_weights = weights[self.reverse_order]
+        searches = (
+            # indptr, next nodes, weights, potential sign, tentative costs, predecessors, settled nodes, heap
+            (self.indptr, self.to_nodes, weights, 1, dict(sources), {}, set(), []),
+            (self.reverse_indptr, self.reverse_from_nodes, reverse_weights, -1, dict(targets), {}, set(), []),
+        )
+        for indptr, next_nodes, search_weights, sign, costs, predecessors, settled, heap in searches:
+            for node, cost in costs.items():
+                predecessors[node] = -1
+                heap.append((cost + sign * potential(node), node))
+            heapq.heapify(heap)
+
+        forward_costs, backward_costs = searches[0][4], searches[1][4]
+        best_cost = np.inf
+        best_node = None
+        for node in sources.keys() & targets.keys():
+            if sources[node] + targets[node] < best_cost:
+                best_cost = sources[node] + targets[node]
+                best_node = node
+
+        forward_heap, backward_heap = searches[0][7], searches[1][7]
+        while forward_heap and backward_heap:
+            if forward_heap[0][0] + backward_heap[0][0] >= best_cost:
+                break
+            search, other_costs = ((searches[0], backward_costs) if forward_heap[0][0] <= backward_heap[0][0]
+                                   else (searches[1], forward_costs))
+            indptr, next_nodes, search_weights, sign, costs, predecessors, settled, heap = search
+            key, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            cost = costs[node]
+            start, end = indptr[node], indptr[node+1]
+            for next_node, weight in zip(next_nodes[start:end].tolist(), search_weights[start:end].tolist()):
+                next_cost = cost + weight
+                if next_cost < costs.get(next_node, np.inf):
+                    costs[next_node] = next_cost
+                    predecessors[next_node] = node
+                    heapq.heappush(heap, (next_cost + sign * potential(next_node), next_node))
+                    total_cost = next_cost + other_costs.get(next_node, np.inf)
+                    if total_cost < best_cost:
+                        best_cost = total_cost
+                        best_node = next_node
+
+        if best_node is None:
+            return None
+        return self.get_path(searches[0][5], best_node) + tuple(reversed(self.get_path(searches[1][5], best_node)))[1:]
+
+    def shortest_path(self, weights, sources, targets, heuristic_factor=None, reverse_weights=None):
+        """
+        Find the shortest path from any of the sources to any of the targets.
+        :return: tuple of nodes or None if there is no path
+        """
+        return self.bidirectional_astar(weights, sources, targets, heuristic_factor, reverse_weights)
+
+    @staticmethod
+    def get_path(predecessors, node):
+        path_nodes = deque((node, ))
+        while (node := predecessors[node]) != -1:
+            path_nodes.appendleft(node)
+        return tuple(path_nodes)
+
+
+class RouterWeights:
+    """
+    Edge weights compiled for one route profile, plus what the searches derive from them.
+    These are shared between requests, so they are read-only.
+    """
+    def __init__(self, graph, weights):
+        self.weights = weights
+        self.reverse_weights = weights[graph.reverse_order]
+        self.heuristic_factor = graph.get_heuristic_factor(weights)
+        self.weights.flags.writeable = False
+        self.reverse_weights.flags.writeable = False
+
+
+class RouterNearestTable:
+    """
+    Cost and next hop to the nearest member of a location group for every node, for one route profile.
+    """
+    def __init__(self, num_nodes, distances, predecessors, profile=None):
+        self.profile = profile
+        self.costs = np.full((num_nodes, ), np.inf, dtype=np.float64)
+        self.next_hops = np.full((num_nodes, ), -1, dtype=np.int32)
+        if distances:
+            self.costs[np.fromiter(distances.keys(), dtype=np.uint32)] = tuple(distances.values())
+            self.next_hops[np.fromiter(predecessors.keys(), dtype=np.uint32)] = tuple(predecessors.values())
+
+    def get_path(self, sources):
+        """
+        Get the path from the best of the sources to the nearest member.
+        :param sources: dict of node → initial cost
+        :return: tuple of nodes or None if there is no path
+        """
+        if not sources:
+            return None
+        nodes = np.fromiter(sources.keys(), dtype=np.uint32)
+        costs = np.fromiter(sources.values(), dtype=np.float64) + self.costs[nodes]
+        best = int(np.argmin(costs))
+        if costs[best] == np.inf:
+            return None
+        path = [int(nodes[best])]
+        while self.next_hops[path[-1]] >= 0:
+            path.append(int(self.next_hops[path[-1]]))
+        return tuple(path)
+
+
+class RouterOriginTree(RouterNearestTable):
+    """
+    Cost from one origin and predecessor on the way there for every node, for one route profile.
+    """
+    @staticmethod
+    def get_key(profile, sources):
+        return profile, tuple(sorted(sources.items()))
+
+    def get_path(self, targets):
+        """
+        Get the path from the origin to the best of the targets.
+        :param targets: dict of node → additional cost to get from the node to the destination
+        :return: tuple of nodes or None if there is no path
+        """
+        path = super().get_path(targets)
+        return None if path is None else tuple(reversed(path))
+
+
 class RouterWayType:
     def __init__(self, waytype):
         self.src = waytype
-        self.upwards_indices = deque()
-        self.nonupwards_indices = deque()
 
     def __getattr__(self, name):
         if name in ('__getstate__', '__setstate__'):
@@ -729,18 +1658,33 @@ class RouterWayType:
 
 
 class RouterLocation:
-    def __init__(self, locations=()):
+    def __init__(self, locations=(), group=None):
         self.locations = locations
+        # location group pk, if these are the members of a location group
+        self.group = group
 
     @cached_property
     def nodes(self):
         return reduce(operator.or_, (location.nodes for location in self.locations), frozenset())
 
-    def get_location_for_node(self, node):
+    def get_node_costs(self, nodes, factor=1):
+        """
+        get the cost to get from this location to each of its nodes
+        :param nodes: all router nodes
+        :param factor: factor to convert distances into edge weights
+        :return: dict of node → cost
+        """
+        costs = {}
         for location in self.locations:
-            if node in location.nodes:
-                return location
-        return None
+            for node in location.nodes:
+                cost = location.get_distance_to_node(node, nodes) * factor
+                if cost < costs.get(node, np.inf):
+                    costs[node] = cost
+        return costs
+
+    def get_location_for_node(self, node, nodes):
+        return min((location for location in self.locations if node in location.nodes),
+                   key=lambda location: location.get_distance_to_node(node, nodes), default=None)
 
 
 class RouterRestriction:
@@ -751,28 +1695,34 @@ class RouterRestriction:
 
 
 class RouterRestrictionSet:
-    def __init__(self, restrictions):
+    """
+    The restrictions that apply to a route request, with precomputed boolean node and edge masks.
+    Use Router.get_restrictions() to get one, they are interned.
+    """
+    def __init__(self, restrictions, spaces, graph):
         self.restrictions = restrictions
-
-    @cached_property
-    def spaces(self):
-        return reduce(operator.or_, (restriction.spaces for restriction in self.restrictions.values()), frozenset())
-
-    @cached_property
-    def additional_nodes(self):
-        return reduce(operator.or_, (restriction.additional_nodes
-                                     for restriction in self.restrictions.values()), frozenset())
-
-    @cached_property
-    def edges(self):
-        if not self.restrictions:
-            return np.array((), dtype=np.uint32).reshape((-1, 2))
-        return np.vstack(tuple(restriction.edges for restriction in self.restrictions.values()))
-
-    @cached_property
-    def cache_key(self):
-        return '%s_%s' % ('-'.join(str(i) for i in self.spaces),
-                          '-'.join(str(i) for i in self.edges.flatten().tolist()))
+        self.spaces = reduce(operator.or_, (restriction.spaces for restriction in restrictions.values()),
+                             frozenset())
+        self.additional_nodes = reduce(operator.or_, (restriction.additional_nodes
+                                                      for restriction in restrictions.values()), frozenset())
+        if restrictions:
+            self.edges = np.concatenate(tuple(restriction.edges for restriction in restrictions.values()))
+        else:
+            self.edges = np.array((), dtype=np.uint32)
+
+        # nodes in restricted spaces
+        self.space_node_mask = graph.node_mask(reduce(operator.or_, (spaces[space].nodes for space in self.spaces),
+                                                      set()))
+        # restricted nodes outside of restricted spaces
+        self.additional_node_mask = graph.node_mask(self.additional_nodes)
+        # all nodes that can not be passed
+        self.node_mask = self.space_node_mask | self.additional_node_mask
+        self.edge_mask = np.zeros(graph.from_nodes.shape, dtype=np.bool_)
+        self.edge_mask[self.edges] = True
+        for mask in (self.space_node_mask, self.additional_node_mask, self.node_mask, self.edge_mask):
+            mask.flags.writeable = False
+
+        self.cache_key = '-'.join(str(pk) for pk in sorted(restrictions.keys()))
 
     def __contains__(self, pk):
         return pk in self.restrictions
@@ -0,0 +1,51 @@
+import random
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from c3nav.routing.tests.utils import create_graph, get_all_costs, get_best_cost, get_path_cost
+
+
+class BidirectionalAStarTests(SimpleTestCase):
+    def setUp(self):
+        self.graph, self.nodes = create_graph()
+
+    def assertShortestPaths(self, weights, seed=1):
+        all_costs = get_all_costs(self.graph, weights)
+        heuristic_factor = self.graph.get_heuristic_factor(weights)
+        rnd = random.Random(seed)
+        for i in range(50):
+            sources = {node: rnd.uniform(0, 5) for node in rnd.sample(range(self.graph.num_nodes), rnd.randint(1, 3))}
+            targets = {node: rnd.uniform(0, 5) for node in rnd.sample(range(self.graph.num_nodes), rnd.randint(1, 3))}
+            path = self.graph.shortest_path(weights, sources, targets, heuristic_factor=heuristic_factor)
+            expected = get_best_cost(all_costs, sources, targets)
+            if expected == np.inf:
+                self.assertIsNone(path)
+                continue
+            self.assertIn(path[0], sources)
+            self.assertIn(path[-1], targets)
+            cost = sources[path[0]] + get_path_cost(self.graph, weights, path) + targets[path[-1]]
+            self.assertAlmostEqual(cost, expected, places=3)
+
+    def test_distances(self):
+        self.assertShortestPaths(self.graph.weights.copy())
+
+    def test_scaled_weights(self):
+        # e.g. the fastest route mode, where the heuristic has to be scaled down to stay admissible
+        rnd = np.random.default_rng(1)
+        weights = self.graph.weights * rnd.uniform(0.5, 3, self.graph.weights.shape).astype(np.float32)
+        self.assertShortestPaths(weights, seed=2)
+
+    def test_excluded_edges(self):
+        weights = self.graph.weights.copy()
+        weights[np.random.default_rng(2).random(weights.shape) < 0.2] = np.inf
+        self.assertShortestPaths(weights, seed=3)
+
+    def test_source_is_target(self):
+        path = self.graph.shortest_path(self.graph.weights, {10: 0}, {10: 0, 20: 0})
+        self.assertEqual(path, (10, ))
+
+    def test_unreachable(self):
+        weights = self.graph.weights.copy()
+        weights[self.graph.to_nodes == 30] = np.inf
+        self.assertIsNone(self.graph.shortest_path(weights, {0: 0}, {30: 0}))
@@ -0,0 +1,26 @@
+from c3nav.routing.benchmark import run_benchmark
+from c3nav.routing.tests.utils import RouterTestCase
+
+
+class RoutingBenchmarkTests(RouterTestCase):
+    """
+    A small run of the routing benchmark, so big regressions fail CI. The limits leave a lot of room for slow CI
+    machines, local results are far below them. Use the benchmarkrouting command for real measurements.
+    """
+    max_rebuild_seconds = 10
+    max_route_p95_ms = 200
+    max_serialize_p95_ms = 500
+    # a dense all-pairs matrix alone would take more than this for 500 nodes
+    max_bytes_per_node = 1000
+
+    def test_small_venue(self):
+        results = run_benchmark(nodes=500, routes=20)
+        nodes = results['venue']['nodes']
+        self.assertGreaterEqual(nodes, 500)
+        self.assertLess(results['routes']['unreachable'], 10)
+
+        self.assertLess(results['rebuild_seconds'], self.max_rebuild_seconds)
+        for kind in ('locations', 'coordinates'):
+            self.assertLess(results['routes'][kind]['p95_ms'], self.max_route_p95_ms, kind)
+        self.assertLess(results['serialize']['p95_ms'], self.max_serialize_p95_ms)
+        self.assertLess((results['pickle_bytes'] + results['graph_bytes']) / nodes, self.max_bytes_per_node)
@@ -0,0 +1,39 @@
+import random
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from c3nav.routing.contraction import ContractionHierarchy
+from c3nav.routing.tests.utils import create_graph, get_all_costs, get_best_cost, get_path_cost
+
+
+class ContractionHierarchyTests(SimpleTestCase):
+    def assertShortestPaths(self, graph, weights, seed=1):
+        contraction_hierarchy = ContractionHierarchy(graph, weights)
+        all_costs = get_all_costs(graph, weights)
+        rnd = random.Random(seed)
+        for i in range(50):
+            sources = {node: rnd.uniform(0, 5) for node in rnd.sample(range(graph.num_nodes), rnd.randint(1, 3))}
+            targets = {node: rnd.uniform(0, 5) for node in rnd.sample(range(graph.num_nodes), rnd.randint(1, 3))}
+            path = contraction_hierarchy.shortest_path(sources, targets)
+            expected = get_best_cost(all_costs, sources, targets)
+            if expected == np.inf:
+                self.assertIsNone(path)
+                continue
+            # shortcuts have to be unpacked into edges of the original graph
+            cost = sources[path[0]] + get_path_cost(graph, weights, path) + targets[path[-1]]
+            self.assertAlmostEqual(cost, expected, places=3)
+
+    def test_same_costs_as_dijkstra(self):
+        graph, nodes = create_graph()
+        self.assertShortestPaths(graph, graph.weights.copy())
+
+    def test_excluded_edges(self):
+        graph, nodes = create_graph(seed=2)
+        weights = graph.weights.copy()
+        weights[np.random.default_rng(1).random(weights.shape) < 0.2] = np.inf
+        self.assertShortestPaths(graph, weights, seed=2)
+
+    def test_one_way_edges(self):
+        graph, nodes = create_graph(one_way=0.5, seed=3)
+        self.assertShortestPaths(graph, graph.weights.copy(), seed=3)
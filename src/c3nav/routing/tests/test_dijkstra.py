@@ -0,0 +1,66 @@
+import random
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from c3nav.routing.tests.utils import create_graph, get_all_costs, get_best_cost, get_path_cost
+
+
+class DijkstraTests(SimpleTestCase):
+    def setUp(self):
+        self.graph, self.nodes = create_graph()
+        self.weights = self.graph.weights.copy()
+        self.all_costs = get_all_costs(self.graph, self.weights)
+
+    def test_single_source_settles_everything_at_the_right_cost(self):
+        for source in (0, 17, 123):
+            distances, predecessors, best_target = self.graph.dijkstra(self.weights, sources={source: 0})
+            reachable = np.flatnonzero(np.isfinite(self.all_costs[source]))
+            self.assertEqual(set(distances.keys()), set(reachable.tolist()))
+            for node, cost in distances.items():
+                self.assertAlmostEqual(cost, self.all_costs[source, node], places=3)
+            self.assertIsNone(best_target)
+
+    def test_predecessors_form_shortest_paths(self):
+        distances, predecessors, best_target = self.graph.dijkstra(self.weights, sources={5: 0})
+        for node in (0, 50, 199):
+            path = self.graph.get_path(predecessors, node)
+            self.assertEqual(path[0], 5)
+            self.assertEqual(path[-1], node)
+            self.assertAlmostEqual(get_path_cost(self.graph, self.weights, path), distances[node], places=3)
+
+    def test_multiple_sources_and_targets(self):
+        rnd = random.Random(2)
+        for i in range(20):
+            sources = {node: rnd.uniform(0, 20) for node in rnd.sample(range(self.graph.num_nodes), 3)}
+            targets = {node: rnd.uniform(0, 20) for node in rnd.sample(range(self.graph.num_nodes), 3)}
+            distances, predecessors, best_target = self.graph.dijkstra(self.weights, sources=sources, targets=targets)
+            expected = get_best_cost(self.all_costs, sources, targets)
+            if expected == np.inf:
+                self.assertIsNone(best_target)
+                continue
+            self.assertAlmostEqual(distances[best_target] + targets[best_target], expected, places=3)
+
+    def test_limit(self):
+        distances, predecessors, best_target = self.graph.dijkstra(self.weights, sources={0: 0}, limit=30)
+        self.assertEqual(set(distances.keys()), set(np.flatnonzero(self.all_costs[0] <= 30).tolist()))
+
+    def test_all_targets(self):
+        targets = {node: 0 for node in (3, 60, 150) if np.isfinite(self.all_costs[0, node])}
+        distances, predecessors, best_target = self.graph.dijkstra(self.weights, sources={0: 0}, targets=targets,
+                                                                   all_targets=True)
+        for node in targets:
+            self.assertAlmostEqual(distances[node], self.all_costs[0, node], places=3)
+
+    def test_reverse(self):
+        distances, predecessors, best_target = self.graph.dijkstra(self.weights, sources={42: 0}, reverse=True)
+        reachable = np.flatnonzero(np.isfinite(self.all_costs[:, 42]))
+        self.assertEqual(set(distances.keys()), set(reachable.tolist()))
+        for node, cost in distances.items():
+            self.assertAlmostEqual(cost, self.all_costs[node, 42], places=3)
+
+    def test_excluded_edges(self):
+        weights = self.weights.copy()
+        weights[self.graph.from_nodes == 7] = np.inf
+        distances, predecessors, best_target = self.graph.dijkstra(weights, sources={7: 0})
+        self.assertEqual(distances, {7: 0})
@@ -0,0 +1,133 @@
+import random
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from c3nav.routing.locator import LocatorFingerprints, LocatorPoint, LocatorSpace, ScanDataValue, no_signal
+from c3nav.routing.tests.utils import create_graph, create_router
+
+
+def create_fingerprints(num_spaces=4, num_peers=30, seed=1):
+    """
+    Create fingerprints for a router from create_router(), with one space per level.
+    Each space only observed some of the peers, and each point some of those.
+    :return: (LocatorFingerprints, LocatorSpace list, router)
+    """
+    rnd = random.Random(seed)
+    graph, nodes = create_graph(levels=num_spaces, seed=seed)
+    router = create_router(graph)
+    spaces = []
+    start = 0
+    for pk in range(1, num_spaces+1):
+        space_peers = rnd.sample(range(num_peers), num_peers // 2)
+        points = [LocatorPoint(x=rnd.uniform(0, 100), y=rnd.uniform(0, 100), values={
+            peer_id: ScanDataValue(rssi=-rnd.randint(30, 95)) for peer_id in rnd.sample(space_peers, 8)
+        }) for i in range(rnd.randint(5, 20))]
+        spaces.append(LocatorSpace.create(pk, points, start=start))
+        start += len(points)
+    return LocatorFingerprints.create(spaces, num_peers, router), spaces, router
+
+
+def create_scan(rnd, num_peers=30, size=6):
+    return {peer_id: ScanDataValue(rssi=-rnd.randint(30, 95)) for peer_id in rnd.sample(range(num_peers), size)}
+
+
+def get_best_point_per_space(spaces, scan, needed_peer_id, excluded_spaces=()):
+    """
+    The scoring from before the global fingerprint matrix: each space on its own, with a dense points × peers array
+    of squared RSSI values, and no_signal for the peers that a point did not observe.
+    """
+    best_point, best_score = None, None
+    for space in spaces:
+        if space.pk in excluded_spaces or needed_peer_id not in space.peer_ids:
+            continue
+        peers = {peer_id: i for i, peer_id in enumerate(sorted(space.peer_ids))}
+        levels = np.full((len(space.points), len(peers)), fill_value=no_signal, dtype=np.int64)
+        for i, point in enumerate(space.points):
+            for peer_id, value in point.values.items():
+                levels[i, peers[peer_id]] = value.rssi**2
+        scores = np.zeros((len(space.points), ), dtype=np.int64)
+        for peer_id, value in scan.items():
+            scores += ((levels[:, peers[peer_id]] if peer_id in peers else no_signal) - value.rssi)**2
+        scores = scores / len(scan)
+        i = int(np.argmin(scores))
+        if best_score is None or scores[i] < best_score:
+            best_point, best_score = space.rows.start + i, scores[i]
+    return best_point, best_score
+
+
+class LocatorFingerprintsTests(SimpleTestCase):
+    def setUp(self):
+        self.fingerprints, self.spaces, self.router = create_fingerprints()
+
+    def test_matrix(self):
+        for space in self.spaces:
+            for i, point in enumerate(space.points, start=space.rows.start):
+                self.assertEqual(dict(zip(self.fingerprints.matrix[i].indices.tolist(),
+                                          self.fingerprints.matrix[i].data.tolist())),
+                                 {peer_id: value.rssi**2 for peer_id, value in point.values.items()})
+                self.assertEqual(self.fingerprints.space_pks[self.fingerprints.spaces[i]], space.pk)
+                self.assertEqual(tuple(self.fingerprints.xy[i]), (point.x, point.y))
+
+    def test_same_as_per_space_scoring(self):
+        rnd = random.Random(2)
+        for i in range(100):
+            scan = create_scan(rnd)
+            needed_peer_id = max(scan.items(), key=lambda item: item[1].rssi)[0]
+            point, score = self.fingerprints.get_best_point(scan, needed_peer_id=needed_peer_id)
+            expected_point, expected_score = get_best_point_per_space(self.spaces, scan, needed_peer_id)
+            self.assertEqual(point, expected_point)
+            if expected_point is not None:
+                self.assertAlmostEqual(score, expected_score)
+
+    def test_batch_same_as_single(self):
+        rnd = random.Random(3)
+        scans = [create_scan(rnd, size=rnd.randint(1, 10)) for i in range(30)]
+        needed_peer_ids = [rnd.choice(tuple(scan.keys())) for scan in scans]
+        self.assertEqual(self.fingerprints.get_best_points(scans, needed_peer_ids),
+                         [self.fingerprints.get_best_point(scan, needed_peer_id)
+                          for scan, needed_peer_id in zip(scans, needed_peer_ids)])
+
+
+class LocatorCandidatePointsTests(SimpleTestCase):
+    def setUp(self):
+        self.fingerprints, self.spaces, self.router = create_fingerprints(num_peers=40)
+
+    def test_peer_points(self):
+        for peer_id in range(40):
+            self.assertEqual(self.fingerprints.get_peer_points(peer_id).tolist(), [
+                i for space in self.spaces for i, point in enumerate(space.points, start=space.rows.start)
+                if peer_id in point.values
+            ])
+
+    def test_candidate_points_only_in_spaces_that_know_the_peer(self):
+        for peer_id in range(40):
+            self.assertEqual(self.fingerprints.get_candidate_points(peer_id).tolist(), [
+                i for space in self.spaces if peer_id in space.peer_ids for i in range(space.rows.start, space.rows.stop)
+            ])
+
+    def test_unknown_peer(self):
+        peer_id = next(peer_id for peer_id in range(40)
+                       if not any(peer_id in space.peer_ids for space in self.spaces))
+        scan = {peer_id: ScanDataValue(rssi=-40), 0: ScanDataValue(rssi=-60)}
+        self.assertEqual(self.fingerprints.get_best_point(scan, needed_peer_id=peer_id), (None, None))
+        self.assertIsNotNone(self.fingerprints.get_best_point(scan)[0])
+
+    def test_excluded_points(self):
+        rnd = random.Random(4)
+        excluded_space = self.spaces[1]
+        excluded_points = np.zeros((self.fingerprints.num_points, ), dtype=np.bool_)
+        excluded_points[excluded_space.rows.start:excluded_space.rows.stop] = True
+        for i in range(50):
+            scan = create_scan(rnd, num_peers=40)
+            needed_peer_id = rnd.choice(tuple(scan.keys()))
+            point, score = self.fingerprints.get_best_point(scan, needed_peer_id=needed_peer_id,
+                                                            excluded_points=excluded_points)
+            self.assertEqual(point, get_best_point_per_space(self.spaces, scan, needed_peer_id,
+                                                             excluded_spaces={excluded_space.pk})[0])
+            self.assertFalse(point is not None and excluded_points[point])
+
+        # not even a scan recorded at one of the excluded points finds it
+        for point in excluded_space.points:
+            best_point, score = self.fingerprints.get_best_point(point.values, excluded_points=excluded_points)
+            self.assertFalse(excluded_points[best_point])
@@ -0,0 +1,61 @@
+import random
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from c3nav.mapdata.models import LocationGroup, Space
+from c3nav.routing.benchmark import generate_venue
+from c3nav.routing.models import RouteOptions
+from c3nav.routing.router import Router, RouterNearestTable
+from c3nav.routing.tests.utils import RouterTestCase, create_graph, get_all_costs, get_path_cost
+
+
+class RouterNearestTableTests(SimpleTestCase):
+    def setUp(self):
+        self.graph, self.nodes = create_graph(one_way=0.3)
+        self.weights = self.graph.weights.copy()
+        self.all_costs = get_all_costs(self.graph, self.weights)
+        self.members = {12: 0, 80: 3.5, 151: 1}
+        distances, predecessors, best_target = self.graph.dijkstra(self.weights, sources=self.members, reverse=True)
+        self.table = RouterNearestTable(self.graph.num_nodes, distances, predecessors)
+
+    def get_expected_cost(self, node):
+        return min(self.all_costs[node, member] + cost for member, cost in self.members.items())
+
+    def test_costs_to_nearest_member(self):
+        for node in range(self.graph.num_nodes):
+            self.assertAlmostEqual(self.table.costs[node], self.get_expected_cost(node), places=3)
+
+    def test_path_to_nearest_member(self):
+        rnd = random.Random(1)
+        for i in range(30):
+            sources = {node: rnd.uniform(0, 5) for node in rnd.sample(range(self.graph.num_nodes), 2)}
+            expected = min(cost + self.get_expected_cost(node) for node, cost in sources.items())
+            path = self.table.get_path(sources)
+            if expected == np.inf:
+                self.assertIsNone(path)
+                continue
+            self.assertIn(path[0], sources)
+            self.assertIn(path[-1], self.members)
+            cost = sources[path[0]] + get_path_cost(self.graph, self.weights, path) + self.members[path[-1]]
+            self.assertAlmostEqual(cost, expected, places=3)
+
+
+class NearestGroupRouteTests(RouterTestCase):
+    def test_route_to_group_as_fast_as_search(self):
+        generate_venue(nodes=400, levels=2)
+        toilets = LocationGroup.objects.get(slug='benchmark-toilets')
+        with override_settings(ROUTING_NEAREST_GROUPS=(toilets.pk, )):
+            router = Router.rebuild(self.create_update())
+        options = RouteOptions()
+        self.assertEqual(router.nearest_tables[toilets.pk].profile,
+                         router.get_profile(options, router.get_restrictions(set())))
+
+        for space in Space.objects.all()[:20]:
+            distance, with_table = router.get_route(space, toilets, set(), options).get_distance_and_duration()
+            nearest_tables, router.nearest_tables = router.nearest_tables, {}
+            try:
+                distance, searched = router.get_route(space, toilets, set(), options).get_distance_and_duration()
+            finally:
+                router.nearest_tables = nearest_tables
+            self.assertEqual(with_table, searched)
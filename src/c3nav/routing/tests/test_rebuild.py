@@ -0,0 +1,104 @@
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+import numpy as np
+from django.test import override_settings
+from shapely.geometry import Point
+
+from c3nav.mapdata.models import GraphEdge, GraphNode
+from c3nav.routing.benchmark import generate_venue
+from c3nav.routing.router import Router
+from c3nav.routing.tests.utils import RouterTestCase
+
+
+class RouterRebuildTestCase(RouterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.levels = generate_venue(nodes=300, levels=3)
+
+    def assertSameRouter(self, router, expected):
+        for name in expected.graph.array_names:
+            np.testing.assert_array_equal(getattr(router.graph, name), getattr(expected.graph, name), err_msg=name)
+
+        self.assertEqual(router.levels.keys(), expected.levels.keys())
+        for pk, level in expected.levels.items():
+            self.assertEqual(router.levels[pk].nodes, level.nodes)
+            self.assertEqual(router.levels[pk].spaces, level.spaces)
+
+        self.assertEqual(router.spaces.keys(), expected.spaces.keys())
+        for pk, space in expected.spaces.items():
+            other = router.spaces[pk]
+            self.assertEqual((other.nodes, other.areas, other.pois), (space.nodes, space.areas, space.pois))
+            self.assertEqual(len(other.altitudeareas), len(space.altitudeareas))
+            for other_area, area in zip(other.altitudeareas, space.altitudeareas):
+                self.assertEqual(other_area.nodes, area.nodes)
+                self.assertEqual(other_area.fallback_nodes.keys(), area.fallback_nodes.keys())
+
+        for locations, expected_locations in ((router.areas, expected.areas), (router.pois, expected.pois)):
+            self.assertEqual(locations.keys(), expected_locations.keys())
+            for pk, location in expected_locations.items():
+                self.assertEqual(locations[pk].nodes, location.nodes)
+                self.assertEqual(locations[pk].nodes_addition.keys(), location.nodes_addition.keys())
+
+        self.assertEqual(router.groups, expected.groups)
+        self.assertEqual(router.restrictions.keys(), expected.restrictions.keys())
+        for pk, restriction in expected.restrictions.items():
+            self.assertEqual(router.restrictions[pk].spaces, restriction.spaces)
+            self.assertEqual(router.restrictions[pk].additional_nodes, restriction.additional_nodes)
+            np.testing.assert_array_equal(router.restrictions[pk].edges, restriction.edges)
+
+
+class ReuseLevelTests(RouterRebuildTestCase):
+    def rebuild_incrementally(self, changed_levels):
+        previous_update = self.create_update()
+        Router.rebuild(previous_update)
+        self.change_first_level()
+        with self.assertLogs('c3nav', level='INFO') as logs:
+            router = Router.rebuild(self.create_update(), previous_update=previous_update,
+                                    changed_levels=changed_levels)
+        return router, logs.output
+
+    def change_first_level(self):
+        # a new node on the first level moves the node indices of all levels after it
+        space = self.levels[0].spaces.first()
+        other = space.graphnodes.first()
+        node = GraphNode.objects.create(space=space, geometry=Point(other.geometry.x + 0.5, other.geometry.y + 0.5))
+        GraphEdge.objects.create(from_node=node, to_node=other)
+        GraphEdge.objects.create(from_node=other, to_node=node)
+
+    def test_same_as_full_rebuild(self):
+        router, logs = self.rebuild_incrementally(changed_levels={self.levels[0].pk})
+        self.assertIn('Reusing 2 of 3 levels', logs[0])
+        self.assertSameRouter(router, Router.rebuild(self.create_update()))
+
+    def test_changed_structure_is_rebuilt(self):
+        # the level signature catches changes that are not reported as geometry changes
+        router, logs = self.rebuild_incrementally(changed_levels=set())
+        self.assertIn('Reusing 2 of 3 levels', logs[0])
+        self.assertSameRouter(router, Router.rebuild(self.create_update()))
+
+    def test_nothing_changed(self):
+        previous_update = self.create_update()
+        Router.rebuild(previous_update)
+        with self.assertLogs('c3nav', level='INFO') as logs:
+            router = Router.rebuild(self.create_update(), previous_update=previous_update, changed_levels=set())
+        self.assertIn('Reusing 3 of 3 levels', logs.output[0])
+        self.assertSameRouter(router, Router.rebuild(self.create_update()))
+
+
+class ParallelRebuildTests(RouterRebuildTestCase):
+    @mock.patch('c3nav.routing.router.os.sched_getaffinity', return_value={0, 1}, create=True)
+    def test_same_as_serial(self, sched_getaffinity):
+        with override_settings(ROUTING_REBUILD_PROCESSES=2), \
+                mock.patch('c3nav.routing.router.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as executor:
+            router = Router.rebuild(self.create_update())
+        self.assertEqual(executor.call_args.kwargs['max_workers'], 2)
+        self.assertEqual(Router._rebuild_levels, {})
+        self.assertSameRouter(router, Router.rebuild(self.create_update()))
+
+    @mock.patch('c3nav.routing.router.os.sched_getaffinity', return_value={0}, create=True)
+    def test_serial_on_one_cpu(self, sched_getaffinity):
+        with override_settings(ROUTING_REBUILD_PROCESSES=4), \
+                mock.patch('c3nav.routing.router.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as executor:
+            Router.rebuild(self.create_update())
+        executor.assert_not_called()
@@ -0,0 +1,53 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from c3nav.routing.router import RouterRestriction
+from c3nav.routing.tests.utils import create_graph, create_router
+
+
+class RouterRestrictionSetTests(SimpleTestCase):
+    def setUp(self):
+        self.graph, self.nodes = create_graph(levels=2)
+        restricted_space = RouterRestriction(spaces={2})
+        restricted_column = RouterRestriction()
+        restricted_column.additional_nodes.update((4, 6))
+        restricted_edges = RouterRestriction()
+        restricted_edges.edges.extend((0, 10))
+        self.router = create_router(self.graph, {1: restricted_space, 2: restricted_column, 3: restricted_edges})
+
+    def test_interned(self):
+        restrictions = self.router.get_restrictions(set())
+        self.assertIs(self.router.get_restrictions(frozenset()), restrictions)
+        self.assertIs(self.router.get_restrictions(()), restrictions)
+        self.assertIs(self.router.get_restrictions({1}), self.router.get_restrictions([1, 999]))
+        self.assertIsNot(self.router.get_restrictions({1}), restrictions)
+
+    def test_masks(self):
+        restrictions = self.router.get_restrictions({3})
+        self.assertEqual(restrictions.cache_key, '1-2')
+        self.assertIn(1, restrictions)
+        self.assertNotIn(3, restrictions)
+
+        space_nodes = self.graph.node_spaces == 2
+        np.testing.assert_array_equal(restrictions.space_node_mask, space_nodes)
+        np.testing.assert_array_equal(np.flatnonzero(restrictions.additional_node_mask), (4, 6))
+        np.testing.assert_array_equal(restrictions.node_mask,
+                                      restrictions.space_node_mask | restrictions.additional_node_mask)
+        self.assertFalse(restrictions.edge_mask.any())
+        np.testing.assert_array_equal(np.flatnonzero(self.router.get_restrictions({1, 2}).edge_mask), (0, 10))
+
+        for mask in (restrictions.space_node_mask, restrictions.additional_node_mask,
+                     restrictions.node_mask, restrictions.edge_mask):
+            self.assertFalse(mask.flags.writeable)
+
+    def test_excluded_edges(self):
+        restrictions = self.router.get_restrictions(set())
+        weights = self.router.get_distance_weights(restrictions)
+        self.assertIs(self.router.get_distance_weights(self.router.get_restrictions(())), weights)
+
+        excluded = np.zeros(weights.shape, dtype=np.bool_)
+        excluded[[0, 10]] = True
+        for node in np.flatnonzero(self.graph.node_spaces == 2).tolist() + [4, 6]:
+            excluded |= (self.graph.from_nodes == node) | (self.graph.to_nodes == node)
+        np.testing.assert_array_equal(np.isinf(weights), excluded)
+        np.testing.assert_array_equal(weights[~excluded], self.graph.distances[~excluded])
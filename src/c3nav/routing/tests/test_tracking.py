@@ -0,0 +1,120 @@
+import random
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from c3nav.routing.locator import Locator, LocatorTrackingState
+from c3nav.routing.tests.test_locator import create_fingerprints, create_scan
+from c3nav.routing.tests.utils import get_all_costs
+
+
+class LocatorTrackingStateTests(SimpleTestCase):
+    def setUp(self):
+        self.fingerprints, self.spaces, self.router = create_fingerprints()
+        self.state = LocatorTrackingState()
+        self.state.set(self.router, 10, now=1000.0)
+
+    def test_not_tracked(self):
+        self.assertIsNone(LocatorTrackingState().get_max_distance(self.router, 1000.0))
+        self.state.set(self.router, None, now=1000.0)
+        self.assertIsNone(self.state.get_max_distance(self.router, 1001.0))
+
+    def test_max_distance(self):
+        state = self.state
+        self.assertEqual(state.get_max_distance(self.router, 1000.0), state.min_distance)
+        self.assertEqual(state.get_max_distance(self.router, 1001.0), state.min_distance)
+        self.assertEqual(state.get_max_distance(self.router, 1010.0), state.max_speed * 10)
+        self.assertEqual(state.get_max_distance(self.router, 1000.0 + state.max_age),
+                         state.max_speed * state.max_age)
+
+    def test_too_old_or_from_the_future(self):
+        self.assertIsNone(self.state.get_max_distance(self.router, 1000.0 + self.state.max_age + 1))
+        self.assertIsNone(self.state.get_max_distance(self.router, 999.0))
+
+    def test_other_router(self):
+        self.router.update = (2, 2)
+        self.assertIsNone(self.state.get_max_distance(self.router, 1001.0))
+
+
+class LocatorTrackedPointsTests(SimpleTestCase):
+    def setUp(self):
+        self.fingerprints, self.spaces, self.router = create_fingerprints()
+        self.locator = Locator(fingerprints=self.fingerprints)
+        self.restrictions = self.router.get_restrictions(())
+        self.all_costs = get_all_costs(self.router.graph, self.router.get_distance_weights(self.restrictions))
+
+    def test_reachable_points(self):
+        for node in (3, 50, 151):
+            state = LocatorTrackingState()
+            state.set(self.router, node, now=1000.0)
+            for elapsed in (0.0, 5.0, 20.0):
+                max_distance = state.get_max_distance(self.router, 1000.0 + elapsed)
+                tracked = self.locator.get_tracked_points(self.router, self.restrictions, state, 1000.0 + elapsed)
+                point_nodes = self.fingerprints.point_nodes
+                expected = np.flatnonzero((point_nodes >= 0) &
+                                          (self.all_costs[node, np.maximum(point_nodes, 0)] <= max_distance))
+                self.assertEqual(tracked.tolist(), expected.tolist())
+
+    def test_jumps_faster_than_max_speed_are_rejected(self):
+        state = LocatorTrackingState()
+        state.set(self.router, 0, now=1000.0)
+        tracked = self.locator.get_tracked_points(self.router, self.restrictions, state, 1005.0)
+        far_points = np.flatnonzero(self.all_costs[0, np.maximum(self.fingerprints.point_nodes, 0)] >
+                                    state.max_speed * 5 + 0.01)
+        self.assertTrue(far_points.size)
+        self.assertFalse(np.isin(far_points, tracked).any())
+
+    def test_not_tracked(self):
+        self.assertIsNone(self.locator.get_tracked_points(self.router, self.restrictions,
+                                                          LocatorTrackingState(), 1000.0))
+
+
+class LocatorTrackedBestPointTests(SimpleTestCase):
+    def setUp(self):
+        self.fingerprints, self.spaces, self.router = create_fingerprints()
+
+    def get_score(self, scan, point):
+        excluded_points = np.ones((self.fingerprints.num_points, ), dtype=np.bool_)
+        excluded_points[point] = False
+        return self.fingerprints.get_best_point(scan, excluded_points=excluded_points)[1]
+
+    def test_tracked_point_within_tolerance(self):
+        rnd = random.Random(5)
+        tolerance = self.fingerprints.tracked_tolerance
+        used_tracked = used_global = 0
+        for i in range(50):
+            scan = create_scan(rnd)
+            best_point, best_score = self.fingerprints.get_best_point(scan)
+            for point in rnd.sample(range(self.fingerprints.num_points), 5):
+                score = self.get_score(scan, point)
+                result = self.fingerprints.get_best_points((scan, ), (None, ),
+                                                           tracked_points=(np.array([point]), ))[0]
+                if score <= best_score * tolerance:
+                    self.assertEqual(result, (point, score))
+                    used_tracked += point != best_point
+                else:
+                    self.assertEqual(result, (best_point, best_score))
+                    used_global += 1
+        # make sure both cases actually happened
+        self.assertTrue(used_tracked)
+        self.assertTrue(used_global)
+
+    def test_best_of_the_tracked_points(self):
+        rnd = random.Random(6)
+        scan = create_scan(rnd)
+        tracked = np.array(sorted(rnd.sample(range(self.fingerprints.num_points), 10)))
+        scores = [self.get_score(scan, point) for point in tracked]
+        point, score = self.fingerprints.get_best_points((scan, ), (None, ), tracked_points=(tracked, ))[0]
+        best_point, best_score = self.fingerprints.get_best_point(scan)
+        self.assertLessEqual(min(scores), best_score * self.fingerprints.tracked_tolerance)
+        self.assertEqual(score, min(scores))
+        self.assertIn(point, tracked)
+
+    def test_untracked_scans_in_the_same_batch(self):
+        rnd = random.Random(7)
+        scans = [create_scan(rnd) for i in range(10)]
+        tracked_points = [np.array([i]) if i % 2 else None for i in range(10)]
+        results = self.fingerprints.get_best_points(scans, (None, ) * 10, tracked_points=tracked_points)
+        for scan, tracked, result in zip(scans, tracked_points, results):
+            self.assertEqual(result, self.fingerprints.get_best_points((scan, ), (None, ),
+                                                                       tracked_points=(tracked, ))[0])
@@ -0,0 +1,89 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from c3nav.routing.trilateration import trilaterate
+
+
+class TrilaterationTests(SimpleTestCase):
+    # a room of 20m × 15m × 3m, in centimeters
+    lower = np.array((0, 0, 0))
+    upper = np.array((2000, 1500, 300))
+
+    def setUp(self):
+        self.rnd = np.random.default_rng(1)
+
+    def create_sets(self, num_sets, num_peers=8):
+        """
+        Create sets of peers at random places near the ceiling, and random positions below them
+        with the exact ranges to them.
+        """
+        anchors = self.rnd.uniform((0, 0, 250), self.upper, size=(num_sets, num_peers, 3))
+        positions = self.rnd.uniform(self.lower, (2000, 1500, 200), size=(num_sets, 3))
+        ranges = np.linalg.norm(anchors - positions[:, np.newaxis, :], axis=2)
+        return anchors, ranges, positions
+
+    def test_exact_ranges(self):
+        anchors, ranges, positions = self.create_sets(50)
+        result = trilaterate(anchors, ranges, lower=self.lower, upper=self.upper)
+        self.assertTrue(result.converged.all())
+        np.testing.assert_allclose(result.positions, positions, atol=5)
+        np.testing.assert_array_less(result.rms_residuals, 5)
+
+    def test_peers_at_the_same_height(self):
+        anchors, ranges, positions = self.create_sets(50)
+        anchors[:, :, 2] = 300
+        ranges = np.linalg.norm(anchors - positions[:, np.newaxis, :], axis=2)
+        result = trilaterate(anchors, ranges, lower=self.lower, upper=self.upper)
+        np.testing.assert_allclose(result.positions, positions, atol=5)
+
+    def test_same_as_one_at_a_time(self):
+        anchors, ranges, positions = self.create_sets(10)
+        result = trilaterate(anchors, ranges, lower=self.lower, upper=self.upper)
+        for i in range(10):
+            single = trilaterate(anchors[i:i+1], ranges[i:i+1], lower=self.lower, upper=self.upper)
+            np.testing.assert_allclose(single.positions[0], result.positions[i], atol=1)
+
+    def test_invalid_ranges(self):
+        anchors, ranges, positions = self.create_sets(20, num_peers=10)
+        valid = np.ones(ranges.shape, dtype=np.bool_)
+        valid[:, 5:] = False
+        # these must not matter at all
+        ranges[~valid] = 1e6
+        result = trilaterate(anchors, ranges, valid=valid, lower=self.lower, upper=self.upper)
+        np.testing.assert_allclose(result.positions, positions, atol=5)
+        self.assertTrue(np.all(result.weights[~valid] == 0))
+        self.assertTrue(np.all(result.residuals[~valid] == 0))
+        self.assertTrue(np.all(result.weights[valid] > 0))
+
+    def test_outlier(self):
+        anchors, ranges, positions = self.create_sets(100, num_peers=10)
+        ranges[:, 0] += 1000
+        result = trilaterate(anchors, ranges, lower=self.lower, upper=self.upper)
+        errors = np.linalg.norm(result.positions - positions, axis=1)
+        # plain least squares, which follows the outlier a lot further
+        least_squares = trilaterate(anchors, ranges, lower=self.lower, upper=self.upper, huber_delta=np.inf)
+        least_squares_errors = np.linalg.norm(least_squares.positions - positions, axis=1)
+        self.assertLess(np.median(errors), np.median(least_squares_errors) / 2)
+        # the outlier gets less weight than the good ranges
+        np.testing.assert_array_less(result.weights[:, 0], result.weights[:, 1:].min(axis=1))
+
+    def test_bounds(self):
+        anchors, ranges, positions = self.create_sets(20)
+        # ranges as if everything was 5m higher, above the ceiling
+        ranges = np.linalg.norm(anchors - (positions + (0, 0, 500))[:, np.newaxis, :], axis=2)
+        result = trilaterate(anchors, ranges, lower=self.lower, upper=self.upper)
+        self.assertTrue(np.all(result.positions >= self.lower))
+        self.assertTrue(np.all(result.positions <= self.upper))
+
+        # per set bounds
+        upper = np.tile(self.upper, (20, 1)).astype(np.float64)
+        upper[:, 0] = 100
+        result = trilaterate(anchors, ranges, lower=self.lower, upper=upper)
+        self.assertTrue(np.all(result.positions[:, 0] <= 100))
+
+    def test_without_bounds(self):
+        anchors, ranges, positions = self.create_sets(20)
+        anchors[:, :, 2] = self.rnd.choice((0, 300), size=anchors.shape[:2])
+        ranges = np.linalg.norm(anchors - positions[:, np.newaxis, :], axis=2)
+        result = trilaterate(anchors, ranges)
+        np.testing.assert_allclose(result.positions, positions, atol=5)
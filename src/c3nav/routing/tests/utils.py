@@ -0,0 +1,113 @@
+import random
+import shutil
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from django.conf import settings
+from django.test import TestCase, override_settings
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra as csgraph_dijkstra
+from scipy.spatial import KDTree
+
+from c3nav.mapdata.models import MapUpdate
+from c3nav.routing.router import Router, RouterEdge, RouterGraph, RouterNode, RouterSpace, RouterWayType
+
+
+def create_graph(num_nodes=200, levels=2, neighbors=4, one_way=0.1, seed=1):
+    """
+    Create a random routing graph without the database: nodes on a few levels, one space per level,
+    each node connected to its nearest neighbors on the same level, some edges only in one direction,
+    and stairs between the levels.
+    :return: (RouterGraph, RouterNode list)
+    """
+    rnd = random.Random(seed)
+    nodes = [RouterNode(i, i+1, rnd.uniform(0, 100), rnd.uniform(0, 100), space=i % levels + 1,
+                        altitude=float(i % levels * 4))
+             for i in range(num_nodes)]
+
+    pairs = set()
+    for level in range(levels):
+        level_nodes = nodes[level::levels]
+        tree = KDTree(tuple((node.x, node.y) for node in level_nodes))
+        for node in level_nodes:
+            for j in tree.query((node.x, node.y), k=neighbors+1)[1][1:].tolist():
+                other = level_nodes[j]
+                pairs.add((node.i, other.i))
+                if rnd.random() > one_way:
+                    pairs.add((other.i, node.i))
+        if level:
+            for node in rnd.sample(level_nodes, 3):
+                pairs.add((node.i, node.i-1))
+                pairs.add((node.i-1, node.i))
+
+    edges = tuple(RouterEdge(nodes[from_node], nodes[to_node], waytype=0) for from_node, to_node in sorted(pairs))
+    return RouterGraph(nodes, edges), nodes
+
+
+def create_router(graph, restrictions=None):
+    """
+    Create a router around a graph from create_graph(), with one space per level and without any locations.
+    :param restrictions: dict of restriction pk → RouterRestriction
+    """
+    spaces = {}
+    for i, space in enumerate(graph.node_spaces.tolist()):
+        if space not in spaces:
+            spaces[space] = RouterSpace(SimpleNamespace(pk=space, level_id=space))
+        spaces[space].nodes.add(i)
+    for restriction in (restrictions or {}).values():
+        restriction.edges = np.array(restriction.edges, dtype=np.uint32)
+    return Router((1, 1), levels={}, spaces=spaces, areas={}, pois={}, groups={},
+                  restrictions=restrictions or {}, waytypes=(RouterWayType(None), ), graph=graph)
+
+
+def get_all_costs(graph, weights):
+    """
+    Get the cost from every node to every node with scipy's dijkstra, as an independent reference.
+    """
+    usable = np.isfinite(weights)
+    matrix = csr_matrix((weights[usable].astype(np.float64), (graph.from_nodes[usable], graph.to_nodes[usable])),
+                        shape=(graph.num_nodes, graph.num_nodes))
+    return csgraph_dijkstra(matrix, directed=True)
+
+
+def get_best_cost(all_costs, sources, targets):
+    """
+    Get the cost of the best path from any of the sources to any of the targets, including their costs.
+    """
+    return min((cost + all_costs[source, target] + target_cost
+                for source, cost in sources.items() for target, target_cost in targets.items()), default=np.inf)
+
+
+def get_path_cost(graph, weights, path):
+    """
+    Get the cost of a path along the cheapest edges between its nodes, or fail if an edge is missing.
+    """
+    cost = 0
+    for from_node, to_node in zip(path[:-1], path[1:]):
+        start, end = graph.indptr[from_node], graph.indptr[from_node+1]
+        matches = np.flatnonzero(graph.to_nodes[start:end] == to_node)
+        assert matches.size, 'no edge from %d to %d' % (from_node, to_node)
+        cost += float(np.min(weights[start + matches]))
+    return cost
+
+
+class RouterTestCase(TestCase):
+    """
+    Test case for rebuilding routers from the database, with its own cache directory.
+    """
+    def setUp(self):
+        super().setUp()
+        cache_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, cache_root, ignore_errors=True)
+        self.enterContext(override_settings(CACHE_ROOT=cache_root))
+
+    @staticmethod
+    def create_update():
+        """
+        Create a map update and its cache directory.
+        """
+        update = MapUpdate.objects.create(type='management', geometries_changed=False).to_tuple
+        (settings.CACHE_ROOT / MapUpdate.build_cache_key(*update)).mkdir()
+        return update
@@ -0,0 +1,124 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class TrilaterationResult:
+    # best position for each set of ranges, shape (sets, 3)
+    positions: np.ndarray
+    # estimated minus measured range for every peer, 0 where there is no range, shape (sets, peers)
+    residuals: np.ndarray
+    # final robust weight of every range, 0 where there is no range, shape (sets, peers)
+    weights: np.ndarray
+    # whether the solver converged for each set, shape (sets, )
+    converged: np.ndarray
+    iterations: int
+
+    @property
+    def rms_residuals(self) -> np.ndarray:
+        counts = np.maximum(np.count_nonzero(self.weights > 0, axis=1), 1)
+        return np.sqrt(np.sum(self.weights * self.residuals**2, axis=1) / counts)
+
+
+def _huber_weights(residuals, valid, delta):
+    return valid * np.minimum(1, delta / np.maximum(np.abs(residuals), 1e-9))
+
+
+def _huber_cost(residuals, valid, delta):
+    absolute = np.abs(residuals)
+    return np.sum(valid * np.where(absolute <= delta, residuals**2 / 2, delta * (absolute - delta / 2)), axis=1)
+
+
+def trilaterate(anchors: np.ndarray, ranges: np.ndarray, valid: np.ndarray = None, lower=None, upper=None,
+                huber_delta=200.0, max_iterations=50, tolerance=1.0, start_offset=100.0) -> TrilaterationResult:
+    """
+    Find the positions that match many sets of measured ranges best, all at once.
+    This is a batched Levenberg-Marquardt solver with Huber weights, so single bad ranges don't pull results far.
+    Positions and ranges have to be in the same unit, the default parameters assume centimeters.
+    :param anchors: positions of the peers, shape (sets, peers, 3)
+    :param ranges: measured range to each peer, shape (sets, peers)
+    :param valid: which peers of each set have a range, shape (sets, peers), all if None
+    :param lower: lower bounds of the positions, shape (3, ) or (sets, 3)
+    :param upper: upper bounds of the positions, shape (3, ) or (sets, 3)
+    :param huber_delta: residuals bigger than this get less weight
+    :param tolerance: stop once the step is shorter than this
+    :param start_offset: each set is solved starting this far below and this far above the middle of its peers
+    """
+    anchors = np.asarray(anchors, dtype=np.float64)
+    ranges = np.maximum(np.asarray(ranges, dtype=np.float64), 0)
+    valid = np.ones(ranges.shape, dtype=np.float64) if valid is None else np.asarray(valid, dtype=np.float64)
+    num_sets = anchors.shape[0]
+    identity = np.eye(3)
+
+    # start in the middle of the peers of each set. but if the peers are at similar heights, like on the ceiling,
+    # the height of that point is a saddle that the solver can't leave, and above and below them look alike.
+    # so every set is solved twice, starting a bit below and a bit above, and the better result is kept.
+    positions = np.sum(anchors * valid[:, :, np.newaxis], axis=1) / np.maximum(valid.sum(axis=1), 1)[:, np.newaxis]
+    positions = np.concatenate((positions - (0, 0, start_offset), positions + (0, 0, start_offset)))
+    anchors = np.concatenate((anchors, anchors))
+    ranges = np.concatenate((ranges, ranges))
+    valid = np.concatenate((valid, valid))
+    if lower is not None and np.ndim(lower) == 2:
+        lower = np.concatenate((lower, lower))
+    if upper is not None and np.ndim(upper) == 2:
+        upper = np.concatenate((upper, upper))
+
+    def get_residuals(positions):
+        differences = positions[:, np.newaxis, :] - anchors
+        distances = np.maximum(np.linalg.norm(differences, axis=2), 1e-9)
+        return differences, distances, (distances - ranges) * valid
+
+    if lower is not None or upper is not None:
+        positions = np.clip(positions, lower, upper)
+    differences, distances, residuals = get_residuals(positions)
+    costs = _huber_cost(residuals, valid, huber_delta)
+    damping = np.full((num_sets*2, ), 1e-3)
+    converged = np.zeros((num_sets*2, ), dtype=np.bool_)
+
+    iterations = 0
+    for iterations in range(1, max_iterations+1):
+        active = ~converged
+        if not active.any():
+            break
+
+        # gauss-newton step on the reweighted problem, damped towards gradient descent
+        weights = _huber_weights(residuals, valid, huber_delta)
+        jacobian = differences / distances[:, :, np.newaxis]
+        weighted_jacobian = jacobian * weights[:, :, np.newaxis]
+        normal = np.einsum('nki,nkj->nij', weighted_jacobian, jacobian)
+        gradient = np.einsum('nki,nk->ni', weighted_jacobian, residuals)
+        diagonal = np.diagonal(normal, axis1=1, axis2=2)
+        normal = normal + (damping[:, np.newaxis] * diagonal + 1e-6 * (1 + diagonal.max(axis=1, keepdims=True)))[
+            :, :, np.newaxis
+        ] * identity
+        steps = -np.linalg.solve(normal, gradient[:, :, np.newaxis])[:, :, 0]
+        steps[~active] = 0
+
+        new_positions = positions + steps
+        if lower is not None or upper is not None:
+            new_positions = np.clip(new_positions, lower, upper)
+        new_differences, new_distances, new_residuals = get_residuals(new_positions)
+        new_costs = _huber_cost(new_residuals, valid, huber_delta)
+        step_lengths = np.linalg.norm(new_positions - positions, axis=1)
+
+        # accept steps that made things better and trust gauss-newton more, otherwise damp more
+        accepted = active & (new_costs <= costs)
+        positions[accepted] = new_positions[accepted]
+        differences[accepted] = new_differences[accepted]
+        distances[accepted] = new_distances[accepted]
+        residuals[accepted] = new_residuals[accepted]
+        costs[accepted] = new_costs[accepted]
+        damping = np.where(accepted, np.maximum(damping / 10, 1e-9), damping * 10)
+
+        # if even heavily damped steps don't help, this is as good as it gets
+        converged |= active & ((step_lengths < tolerance) | (damping > 1e6))
+
+    best = np.arange(num_sets) + np.argmin(costs.reshape((2, num_sets)), axis=0) * num_sets
+    return TrilaterationResult(
+        positions=positions[best],
+        residuals=residuals[best],
+        weights=_huber_weights(residuals[best], valid[best], huber_delta),
+        converged=converged[best],
+        iterations=iterations,
+    )
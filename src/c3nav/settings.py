@@ -93,6 +93,22 @@ os.environ.setdefault('MPLCONFIGDIR', str(get_data_dir('MPLCONFIGDIR', CACHE_ROO
 PUBLIC_EDITOR = config.getboolean('c3nav', 'editor', fallback=True)
 PUBLIC_BASE_MAPDATA = config.getboolean('c3nav', 'public_base_mapdata', fallback=False)
 AUTO_PROCESS_UPDATES = config.getboolean('c3nav', 'auto_process_updates', fallback=True)
+# precompute contraction hierarchies for the default route options when processing updates
+ROUTING_CONTRACTION_HIERARCHIES = config.getboolean('c3nav', 'routing_contraction_hierarchies', fallback=False)
+# location groups (e.g. toilets or exits) for which routes to the nearest member are precomputed
+ROUTING_NEAREST_GROUPS = config.getlist('c3nav', 'routing_nearest_groups', fallback=None)
+ROUTING_NEAREST_GROUPS = tuple(int(i) for i in ROUTING_NEAREST_GROUPS) if ROUTING_NEAREST_GROUPS else ()
+# how many of the most popular route origins (according to the api stats) to precompute routes from after updates
+ROUTING_WARMUP_ORIGINS = config.getint('c3nav', 'routing_warmup_origins', fallback=0)
+# how many processes to build the router's levels in, 1 builds them in the current process.
+# only the geometry processing of each level runs in parallel and the results have to be sent back, so this only
+# pays off for maps with many big levels on a machine with free cpus. it is never more than the available cpus.
+# celery's prefork workers can not start processes, use the processupdates command or another pool for this.
+ROUTING_REBUILD_PROCESSES = config.getint('c3nav', 'routing_rebuild_processes', fallback=1)
+# log details about every trilaterated position, like the measured and resulting ranges
+LOCATOR_DEBUG = config.getboolean('c3nav', 'locator_debug', fallback=False)
+# load router, locator and cache package when a worker starts instead of on the first request that needs them
+PRELOAD_ARTIFACTS = config.getboolean('c3nav', 'preload_artifacts', fallback=False)
 
 RANDOM_LOCATION_GROUPS = config.getlist('c3nav', 'random_location_groups', fallback=None)
 if RANDOM_LOCATION_GROUPS:
@@ -173,6 +189,12 @@ SERVE_API = config.getboolean('c3nav', 'serve_api', fallback=SERVE_ANYTHING, env
 # how many location lookups to cache in each worker's in-memory LRU cache proxy
 CACHE_SIZE_LOCATIONS = config.getint('c3nav', 'cache_size_locations', fallback=128)
 CACHE_SIZE_API = config.getint('c3nav', 'cache_size_api', fallback=64)
+# how many serialized routes to cache in each worker's in-memory LRU cache
+CACHE_SIZE_ROUTES = config.getint('c3nav', 'cache_size_routes', fallback=256)
+# how many compiled edge weight arrays (one per route options and restrictions combination) to cache
+CACHE_SIZE_ROUTE_WEIGHTS = config.getint('c3nav', 'cache_size_route_weights', fallback=32)
+# how many serialized location descriptions to memoize for each set of visible locations
+CACHE_SIZE_LOCATION_DESCRIPTIONS = config.getint('c3nav', 'cache_size_location_descriptions', fallback=1024)
 
 RENDER_SCALE = config.getfloat('c3nav', 'render_scale', fallback=20.0)
 IMAGE_RENDERER = config.get('c3nav', 'image_renderer', fallback='svg')
@@ -38,6 +38,11 @@ if settings.SERVE_ANYTHING:
         path('', include(c3nav.site.urls)),
     ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
+    if settings.SERVE_API:
+        websocket_urlpatterns += [
+            path('api/', URLRouter(c3nav.api.urls.websocket_urlpatterns)),
+        ]
+
     if settings.ENABLE_MESH:
         websocket_urlpatterns += [
             path('mesh/', URLRouter(c3nav.mesh.urls.websocket_urlpatterns)),
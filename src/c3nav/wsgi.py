@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "c3nav.settings")
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa
+
+if settings.PRELOAD_ARTIFACTS:
+    from c3nav.mapdata.utils.cache.artifacts import preload_artifacts
+    preload_artifacts()